@@ -0,0 +1,258 @@
+"""
+Benchmarks for behavior trees.
+
+    python bench_bt.py tick
+    python bench_bt.py memory
+    python bench_bt.py many
+    python bench_bt.py sleep
+"""
+
+import time
+import random
+import argparse
+import resource
+
+import bt
+
+
+ENEMY = (10.0, 10.0)
+ATTACK_RANGE = 5.0
+
+
+class Npc(object):
+
+    def __init__(self, rng):
+        self.health = rng.randint(0, 100)
+        self.x = rng.uniform(0, 20)
+        self.y = rng.uniform(0, 20)
+        self.pos = (0, 0)
+
+
+class IsEnemyNear(bt._BaseNode):
+
+    def tick(self, ctx):
+        agent = ctx.target
+        dx = ENEMY[0] - agent.x
+        dy = ENEMY[1] - agent.y
+        if (dx ** 2 + dy ** 2) ** 0.5 <= ATTACK_RANGE:
+            return bt.OK
+        return bt.FAIL
+
+    def tickColumns(self, columns, targets):
+        import numpy as np
+        distance = np.hypot(ENEMY[0] - columns['x'], ENEMY[1] - columns['y'])
+        return np.where(distance <= ATTACK_RANGE, bt.OK, bt.FAIL)
+
+
+class IsHealthy(bt._BaseNode):
+
+    def tick(self, ctx):
+        if ctx.target.health >= 50:
+            return bt.OK
+        return bt.FAIL
+
+    def tickColumns(self, columns, targets):
+        import numpy as np
+        return np.where(columns['health'] >= 50, bt.OK, bt.FAIL)
+
+
+class Act(bt._BaseNode):
+
+    def __init__(self, name):
+        self.name = name
+
+    def tick(self, ctx):
+        return bt.RUNNING
+
+
+class Walk(bt._BaseNode):
+
+    def __init__(self, dest):
+        self.dest = dest
+
+    def tick(self, ctx):
+        if ctx.target.pos == self.dest:
+            return bt.OK
+        ctx.target.pos = self.dest
+        return bt.RUNNING
+
+
+def npcTree(**kwargs):
+    """
+    Make a tree shaped like the one in C{trainbt}.
+    """
+    return bt.BehaviorTree(
+        bt.Priority('behave', [
+            bt.Sequence('handle enemy', [
+                IsEnemyNear(),
+                bt.Priority('fight or flight', [
+                    bt.Sequence('flight', [
+                        bt.Inverter(IsHealthy()),
+                        Act('flee'),
+                    ]),
+                    bt.Sequence('fight', [
+                        IsHealthy(),
+                        Act('attack'),
+                    ]),
+                ]),
+            ]),
+            bt.Sequence('be healthy', [
+                bt.Inverter(IsHealthy()),
+                Act('rest'),
+            ]),
+            bt.MemSequence('walk around', [
+                Walk((2, 0)),
+                Walk((2, 2)),
+                Walk((0, 2)),
+                Walk((2, 4)),
+            ]),
+        ]), **kwargs)
+
+
+def benchTick(sizes, count):
+    """
+    Tick one tree for crowds of agents, running its nodes one by one
+    and compiled.
+    """
+    print 'tick: one tree, N agents, ms per frame'
+    print '{0:>8} {1:>14} {2:>14}'.format('agents', 'node ms', 'compiled ms')
+    for size in sizes:
+        row = [size]
+        for compiled in [False, True]:
+            rng = random.Random(size)
+            tree = npcTree(compiled=compiled)
+            agents = [(Npc(rng), bt.Blackboard()) for i in xrange(size)]
+            start = time.time()
+            for i in xrange(count):
+                for agent, blackboard in agents:
+                    tree.tick(agent, blackboard)
+            row.append((time.time() - start) / count * 1e3)
+        print '{0:>8} {1:>14.2f} {2:>14.2f}'.format(*row)
+
+
+def benchMemory(sizes):
+    """
+    Measure how much memory each agent's blackboard takes once it has
+    been ticked.  Run this on its own: it measures the growth of the
+    process's peak memory use.
+    """
+    print 'memory: one tree, N agents ticked once'
+    print '{0:>8} {1:>16}'.format('agents', 'bytes/blackboard')
+    tree = npcTree()
+    crowds = []
+    for size in sizes:
+        rng = random.Random(size)
+        agents = [Npc(rng) for i in xrange(size)]
+        before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        blackboards = [bt.Blackboard() for i in xrange(size)]
+        for agent, blackboard in zip(agents, blackboards):
+            tree.tick(agent, blackboard)
+        after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        crowds.append((agents, blackboards))
+        print '{0:>8} {1:>16.1f}'.format(size,
+                                         (after - before) * 1024.0 / size)
+
+
+def benchMany(sizes, count):
+    """
+    Tick one tree for crowds of agents one at a time, with
+    L{bt.BehaviorTree.tickMany}, and with C{tickMany} given the agents'
+    state as NumPy columns (kept up to date by the game, so making
+    them isn't timed).
+    """
+    import numpy as np
+    print 'many: one tree, N agents, median ms per frame'
+    print '{0:>8} {1:>12} {2:>12} {3:>12}'.format('agents', 'tick ms',
+                                                  'many ms', 'columns ms')
+    for size in sizes:
+        row = [size]
+        for mode in ['tick', 'many', 'columns']:
+            rng = random.Random(size)
+            tree = npcTree()
+            agents = [Npc(rng) for i in xrange(size)]
+            blackboards = [bt.Blackboard() for i in xrange(size)]
+            columns = {
+                'health': np.array([x.health for x in agents]),
+                'x': np.array([x.x for x in agents]),
+                'y': np.array([x.y for x in agents]),
+            }
+            times = []
+            for i in xrange(count):
+                start = time.time()
+                if mode == 'tick':
+                    for agent, blackboard in zip(agents, blackboards):
+                        tree.tick(agent, blackboard)
+                elif mode == 'many':
+                    tree.tickMany(agents, blackboards)
+                else:
+                    tree.tickMany(agents, blackboards, columns)
+                times.append(time.time() - start)
+            times.sort()
+            row.append(times[len(times) // 2] * 1e3)
+        print '{0:>8} {1:>12.2f} {2:>12.2f} {3:>12.2f}'.format(*row)
+
+
+class FrameClock(object):
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def benchSleep(sizes, count):
+    """
+    Tick a crowd of agents that mostly wait, 50ms of game time a
+    frame, with L{bt.BehaviorTree.tickMany} and with a
+    L{bt.Scheduler} that skips agents while they wait.
+    """
+    print 'sleep: agents waiting 1-2s between walks, 50ms frames'
+    print '{0:>8} {1:>14} {2:>16}'.format('agents', 'tickMany ms',
+                                          'scheduler ms')
+    for size in sizes:
+        row = [size]
+        for mode in ['many', 'scheduler']:
+            rng = random.Random(size)
+            clock = FrameClock()
+            tree = bt.BehaviorTree(bt.Priority('idle', [
+                bt.Sequence('wait %d' % i, [
+                    bt.Inverter(IsHealthy()) if i % 2 else IsHealthy(),
+                    bt.WaitAction(i, clock),
+                    Walk((i, i)),
+                ]) for i in xrange(1, 6)]))
+            agents = [Npc(rng) for i in xrange(size)]
+            if mode == 'many':
+                blackboards = [bt.Blackboard() for x in agents]
+            else:
+                scheduler = bt.Scheduler(tree, clock)
+                for agent in agents:
+                    scheduler.add(agent)
+            start = time.time()
+            for i in xrange(count):
+                if mode == 'many':
+                    tree.tickMany(agents, blackboards)
+                else:
+                    scheduler.tick()
+                clock.now += 0.05
+            row.append((time.time() - start) / count * 1e3)
+        print '{0:>8} {1:>14.2f} {2:>16.2f}'.format(*row)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('benchmark', choices=['tick', 'memory', 'many', 'sleep'])
+    parser.add_argument('--sizes', default='100,1000,10000',
+        help='Comma-separated numbers of agents (default %(default)s)')
+    parser.add_argument('--count', type=int, default=10,
+        help='Frames per size (default %(default)s)')
+    args = parser.parse_args()
+    sizes = [int(x) for x in args.sizes.split(',')]
+    if args.benchmark == 'tick':
+        benchTick(sizes, args.count)
+    elif args.benchmark == 'memory':
+        benchMemory(sizes)
+    elif args.benchmark == 'many':
+        benchMany(sizes, args.count)
+    elif args.benchmark == 'sleep':
+        benchSleep(sizes, args.count)
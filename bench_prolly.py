@@ -0,0 +1,919 @@
+"""
+Benchmarks for the prolly inference engine.
+
+    python bench_prolly.py lookup
+    python bench_prolly.py conjunction
+    python bench_prolly.py memory
+    python bench_prolly.py load
+    python bench_prolly.py planning
+    python bench_prolly.py materialize
+    python bench_prolly.py columnar
+    python bench_prolly.py layers
+    python bench_prolly.py slices
+    python bench_prolly.py negation
+    python bench_prolly.py range
+    python bench_prolly.py subscribe
+    python bench_prolly.py profile
+    python bench_prolly.py startup
+    python bench_prolly.py answers
+    python bench_prolly.py parallel
+    python bench_prolly.py snapshot
+    python bench_prolly.py suite --sizes 500,2000 --json results.json
+    python bench_prolly.py compare before.json after.json
+"""
+
+import time
+import random
+import argparse
+import resource
+import multiprocessing
+import os
+import sys
+import json
+import platform
+import tempfile
+from StringIO import StringIO
+
+from prolly import Brain, Rule, Term, And, Atom, TRUE, PARSER, Profiler
+
+
+def fact(*values):
+    return Rule(Term(*[Atom(x) for x in values]), TRUE)
+
+
+def parse(query):
+    return PARSER(query).rule().normalizeVars().head
+
+
+class ScanningBrain(Brain):
+    """
+    I try every rule for every query, the way a L{Brain} did before
+    it had an index.
+    """
+
+    def _candidates(self, query, ranges=None):
+        return iter(self._rules)
+
+
+class UnrangedBrain(Brain):
+    """
+    I look up rules without the bounds that comparisons put on their
+    numbers, the way a L{Brain} did before it could scan by range.
+    """
+
+    def _candidates(self, query, ranges=None):
+        return Brain._candidates(self, query)
+
+
+class ForgetfulBrain(Brain):
+    """
+    I prove negated goals again every time, the way a L{Brain} did
+    before it remembered them.
+    """
+
+    def _provable(self, goal):
+        for match in self.parsedQuery(goal):
+            return True
+        return False
+
+
+class SortingBrain(Brain):
+    """
+    I skip answers I've given before by sorting each one into a tuple,
+    the way a L{Brain} did before it had an L{AnswerSet}.
+    """
+
+    def unique(self, gen, query_vars):
+        encountered = set()
+        for x in gen:
+            key = tuple(sorted(x.items()))
+            if key in encountered:
+                continue
+            encountered.add(key)
+            yield x
+
+
+def timeQueries(brain, queries):
+    """
+    Run each query to exhaustion and return the seconds taken per query.
+    """
+    start = time.time()
+    for query in queries:
+        for x in brain.parsedQuery(query):
+            pass
+    return (time.time() - start) / len(queries)
+
+
+def benchLookup(sizes, count):
+    """
+    Look up facts by a bound argument in brains of increasing size.
+    """
+    print 'lookup: (parent, pN, X) against N parent facts'
+    print '{0:>8} {1:>14} {2:>14}'.format('facts', 'indexed us/q', 'scan us/q')
+    for size in sizes:
+        row = [size]
+        for cls in [Brain, ScanningBrain]:
+            brain = cls()
+            for i in xrange(size):
+                brain._addRule(fact('parent', 'p%d' % i, 'p%d' % (i + 1)))
+            queries = [parse('(parent, p%d, X)' % random.randrange(size))
+                       for i in xrange(count)]
+            row.append(timeQueries(brain, queries) * 1e6)
+        print '{0:>8} {1:>14.1f} {2:>14.1f}'.format(*row)
+
+
+def countTerms(func):
+    """
+    Call C{func} and return how many L{Term}s and L{And}s it built.
+    """
+    counts = [0]
+    originals = Term.__init__, And.__init__
+
+    def counting(original):
+        def __init__(self, *args):
+            counts[0] += 1
+            original(self, *args)
+        return __init__
+    Term.__init__ = counting(originals[0])
+    And.__init__ = counting(originals[1])
+    try:
+        func()
+    finally:
+        Term.__init__, And.__init__ = originals
+    return counts[0]
+
+
+def chainBrain(engine, length, goals):
+    """
+    Make a brain with a rule whose body is a conjunction of C{goals}
+    steps along a chain of C{length} links.
+    """
+    brain = Brain(engine=engine)
+    for i in xrange(length):
+        brain._addRule(fact('link', 'n%d' % i, 'n%d' % (i + 1)))
+    body = ' and '.join('(link, V%d, V%d)' % (i, i + 1) for i in xrange(goals))
+    brain.add('(hops, V0, V%d) if %s' % (goals, body))
+    return brain
+
+
+def benchConjunction(sizes, count):
+    """
+    Answer queries whose rule body is a long conjunction with each
+    engine.
+    """
+    print 'conjunction: (hops, X, Y) with a body of 8 link goals'
+    print '{0:>8} {1:>10} {2:>12} {3:>14}'.format(
+        'links', 'engine', 'us/q', 'terms/q')
+    for size in sizes:
+        for engine in ['recursive', 'trail']:
+            brain = chainBrain(engine, size, 8)
+            queries = [parse('(hops, n%d, X)' % random.randrange(size))
+                       for i in xrange(count)]
+            seconds = timeQueries(brain, queries)
+            terms = countTerms(lambda: timeQueries(brain, queries))
+            print '{0:>8} {1:>10} {2:>12.1f} {3:>14.1f}'.format(
+                size, engine, seconds * 1e6, float(terms) / count)
+
+
+def benchMemory(sizes):
+    """
+    Measure how much memory facts take.  Run this on its own: it
+    measures the growth of the process's peak memory use.
+    """
+    print 'memory: (owns, agentN, (thing, M)) facts for 1000 agents'
+    print '{0:>8} {1:>14}'.format('facts', 'bytes/fact')
+    brains = []
+    for size in sizes:
+        before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        brain = Brain()
+        for i in xrange(size):
+            thing = Term(Atom('thing'), Atom('item%d' % (i % 50)))
+            brain._addRule(Rule(
+                Term(Atom('owns'), Atom('agent%d' % (i % 1000)), thing), TRUE))
+        brains.append(brain)
+        after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        print '{0:>8} {1:>14.1f}'.format(size, (after - before) * 1024.0 / size)
+
+
+def factLines(size):
+    """
+    Make the lines of a fact dump like the ones made from world state.
+    """
+    lines = []
+    for i in xrange(size):
+        if i % 3:
+            lines.append('(at, agent%d, (room, %d), %d)\n' % (i, i % 97, i))
+        else:
+            lines.append('(owns, agent%d, (thing, item%d))\n' % (i, i % 50))
+    return lines
+
+
+def benchLoad(sizes):
+    """
+    Load fact dumps with L{Brain.load} and with L{Brain.add} line by
+    line.  C{add} is only timed on the smaller dumps.
+    """
+    print 'load: fact dumps of (at, ...) and (owns, ...) facts'
+    print '{0:>8} {1:>14} {2:>14}'.format('facts', 'load facts/s', 'add facts/s')
+    for size in sizes:
+        lines = factLines(size)
+        start = time.time()
+        Brain().load(StringIO(''.join(lines)))
+        row = [size, size / (time.time() - start)]
+        if size <= 16000:
+            brain = Brain()
+            start = time.time()
+            for line in lines:
+                brain.add(line.strip())
+            row.append('{0:.0f}'.format(size / (time.time() - start)))
+        else:
+            row.append('-')
+        print '{0:>8} {1:>14.0f} {2:>14}'.format(*row)
+
+
+def benchPlanning(sizes, count):
+    """
+    Answer queries with a rule whose body is badly ordered, with and
+    without planning.
+    """
+    print 'planning: (grandchild, X, pN) if (parent, P, X) and (parent, pN, P)'
+    print '{0:>8} {1:>10} {2:>12} {3:>12}'.format(
+        'facts', 'engine', 'naive us/q', 'planned us/q')
+    for size in sizes:
+        queries = [parse('(grandchild, X, p%d)' % random.randrange(size))
+                   for i in xrange(count)]
+        for engine in ['recursive', 'trail']:
+            row = [size, engine]
+            for planning in [False, True]:
+                brain = Brain(engine=engine, planning=planning)
+                brain.add('(grandchild, C, G) if (parent, P, C) and (parent, G, P)')
+                brain.addFacts(('parent', 'p%d' % i, 'p%d' % (i + 1))
+                               for i in xrange(size))
+                row.append(timeQueries(brain, queries) * 1e6)
+            print '{0:>8} {1:>10} {2:>12.1f} {3:>12.1f}'.format(*row)
+
+
+def benchMaterialize(sizes, count):
+    """
+    Answer queries about derived facts by resolution and from a
+    materialized brain, and time keeping the materialized facts up to
+    date as facts are added.  Adding a parent fact means deriving
+    orphan again, since it depends on (not, (parent, ...)).
+    """
+    print 'materialize: (ancestor, pN, X) over a family tree of N people'
+    print '{0:>8} {1:>14} {2:>14} {3:>12} {4:>12}'.format(
+        'people', 'resolve us/q', 'lookup us/q', 'build s', 'add us/fact')
+    rules = [
+        '(ancestor, X, Y) if (parent, X, Y)',
+        '(ancestor, X, Z) if (parent, X, Y) and (ancestor, Y, Z)',
+        '(orphan, X) if (person, X) and (not, (parent, Y, X))',
+    ]
+    for size in sizes:
+        facts = [('person', 'p%d' % i) for i in xrange(size)]
+        facts += [('parent', 'p%d' % (i // 4), 'p%d' % i)
+                  for i in xrange(1, size)]
+        queries = [parse('(ancestor, p%d, X)' % random.randrange(size))
+                   for i in xrange(count)]
+        resolved = Brain()
+        map(resolved.add, rules)
+        resolved.addFacts(facts)
+        row = [size, timeQueries(resolved, queries) * 1e6]
+
+        start = time.time()
+        materialized = Brain(materialize=True)
+        map(materialized.add, rules)
+        materialized.addFacts(facts)
+        build = time.time() - start
+        row.append(timeQueries(materialized, queries) * 1e6)
+        row.append(build)
+
+        start = time.time()
+        for i in xrange(count):
+            materialized.addFacts([('parent', 'p%d' % random.randrange(size),
+                                    'new%d' % i)])
+        row.append((time.time() - start) / count * 1e6)
+        print '{0:>8} {1:>14.1f} {2:>14.1f} {3:>12.2f} {4:>12.1f}'.format(*row)
+
+
+def benchColumnar(sizes):
+    """
+    Ask which agents could take something someone else owns, with and
+    without a columnar store.  Run it with smaller sizes than the
+    default: it is slow without one.
+    """
+    print 'columnar: (tempted, A, T) over N agents owning and permitting'
+    print '{0:>8} {1:>10} {2:>12} {3:>12}'.format(
+        'agents', 'answers', 'rows s', 'columns s')
+    rule = ('(tempted, A, T) if (owns, O, T) and (permits, O, take, A, T)'
+            ' and (agent, A)')
+    for size in sizes:
+        facts = [('agent', 'a%d' % i) for i in xrange(size)]
+        for i in xrange(size):
+            facts.append(('owns', 'a%d' % i, 'thing%d' % i))
+            for j in xrange(3):
+                facts.append(('permits', 'a%d' % i, 'take',
+                              'a%d' % random.randrange(size), 'thing%d' % i))
+        row = [size]
+        for columnar in [False, True]:
+            brain = Brain(columnar=columnar)
+            brain.add(rule)
+            brain.addFacts(facts)
+            query = parse('(tempted, A, T)')
+            start = time.time()
+            answers = len(list(brain.parsedQuery(query)))
+            row[1:2] = [answers]
+            row.append(time.time() - start)
+        print '{0:>8} {1:>10} {2:>12.3f} {3:>12.3f}'.format(*row)
+
+
+def benchLayers(sizes, count):
+    """
+    Give 1000 agents their own brains on top of a world of facts, and
+    measure how much memory each agent takes and how long queries
+    take.  Run this on its own: it measures the growth of the
+    process's peak memory use.
+    """
+    agents = 1000
+    print 'layers: %d agents with 10 beliefs each over a world of N facts' % (
+        agents,)
+    print '{0:>8} {1:>14} {2:>14} {3:>14}'.format(
+        'facts', 'bytes/agent', 'flat us/q', 'layered us/q')
+    keep = []
+    for size in sizes:
+        world = Brain()
+        world.addFacts(('at', 'thing%d' % i, 'room%d' % (i % 100))
+                       for i in xrange(size))
+        world.add('(near, X, Y) if (at, X, R) and (at, Y, R)')
+        before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        brains = []
+        for i in xrange(agents):
+            brain = Brain(base=world)
+            brain.addFacts(('believes', 'agent%d' % i, 'thing%d' % j)
+                           for j in xrange(10))
+            brains.append(brain)
+        after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        keep.append(brains)
+        queries = [parse('(near, thing%d, X)' % random.randrange(size))
+                   for i in xrange(count)]
+        flat = Brain()
+        flat.addFacts(('at', 'thing%d' % i, 'room%d' % (i % 100))
+                      for i in xrange(size))
+        flat.add('(near, X, Y) if (at, X, R) and (at, Y, R)')
+        print '{0:>8} {1:>14.0f} {2:>14.1f} {3:>14.1f}'.format(
+            size, (after - before) * 1024.0 / agents,
+            timeQueries(flat, queries) * 1e6,
+            timeQueries(brains[0], queries) * 1e6)
+
+
+def benchSlices(sizes, count):
+    """
+    Answer a long query a slice at a time, as a game would between
+    frames, and measure how long the longest slice takes.
+    """
+    steps = 1000
+    print 'slices: (path, n0, X) along a chain of N edges, %d steps a slice' % (
+        steps,)
+    print '{0:>8} {1:>14} {2:>14} {3:>14}'.format(
+        'edges', 'whole ms', 'slices', 'worst slice ms')
+    for size in sizes:
+        brain = Brain(engine='trail')
+        brain.add('(path, X, Y) if (edge, X, Y)')
+        brain.add('(path, X, Y) if (edge, X, Z) and (path, Z, Y)')
+        brain.addFacts(('edge', 'n%d' % i, 'n%d' % (i + 1))
+                       for i in xrange(size))
+        start = time.time()
+        for x in brain.query('(path, n0, X)'):
+            pass
+        whole = time.time() - start
+        task = brain.start('(path, n0, X)')
+        slices = 0
+        worst = 0
+        while not task.done:
+            start = time.time()
+            task.run(steps=steps)
+            worst = max(worst, time.time() - start)
+            slices += 1
+        print '{0:>8} {1:>14.1f} {2:>14} {3:>14.2f}'.format(
+            size, whole * 1e3, slices, worst * 1e3)
+
+
+def benchNegation(sizes, count):
+    """
+    Ask who is stealing what five times, as a game might on each
+    tick, so the same negated goals are proved over and over.
+    """
+    print 'negation: (stealing, T, X) over 50 agents and N/50 things each'
+    print '{0:>8} {1:>14} {2:>14}'.format('facts', 'cached ms/q',
+                                          'uncached ms/q')
+    for size in sizes:
+        row = [size]
+        for cls in [Brain, ForgetfulBrain]:
+            brain = cls()
+            brain.add('(allowed, O, T, X) if (friend, O, T)')
+            brain.add('(allowed, O, T, X) if (lent, O, T, X)')
+            brain.add('(stealing, T, X) if (agent, T) and (wants, T, X) '
+                      'and (owns, O, X) and (not, (allowed, O, T, X))')
+            agents = ['agent%d' % i for i in xrange(50)]
+            brain.addFacts(('agent', x) for x in agents)
+            brain.addFacts(('owns', agents[i % 50], 'thing%d' % i)
+                           for i in xrange(size // 50))
+            brain.addFacts(('wants', agents[i % 50], 'thing%d' % (i // 50))
+                           for i in xrange(size))
+            brain.addFacts(('friend', agents[i], agents[i + 1])
+                           for i in xrange(49))
+            queries = [parse('(stealing, T, X)')] * 5
+            row.append(timeQueries(brain, queries) * 1e3)
+        print '{0:>8} {1:>14.1f} {2:>14.1f}'.format(*row)
+
+
+def benchRange(sizes, count):
+    """
+    Find the people older than some age with a rule that compares the
+    ages it looks up, with and without range scans.
+    """
+    print 'range: (older, X, A) if (age, X, B) and (gt, B, A) over N people'
+    print '{0:>8} {1:>14} {2:>14}'.format('people', 'range us/q',
+                                          'unranged us/q')
+    for size in sizes:
+        queries = [parse('(older, X, %d)' % (size - random.randrange(20)))
+                   for i in xrange(count)]
+        row = [size]
+        for cls in [Brain, UnrangedBrain]:
+            brain = cls()
+            brain.add('(older, X, A) if (age, X, B) and (gt, B, A)')
+            brain.addFacts(('age', 'p%d' % i, i) for i in xrange(size))
+            row.append(timeQueries(brain, queries) * 1e6)
+        print '{0:>8} {1:>14.1f} {2:>14.1f}'.format(*row)
+
+
+def benchSubscribe(sizes, count):
+    """
+    Keep track of who is tempted to steal a car, and of who has moved,
+    over some game ticks, each of which moves an agent and every tenth
+    of which gives one a car, by asking the query every tick or by
+    subscribing to it.  Who is tempted depends on a C{not}, so its
+    subscription asks the whole query again; who has moved is worked
+    out from each new fact.
+    """
+    print 'subscribe: N agents, ticks moving them'
+    print '{0:>8} {1:>20} {2:>14} {3:>14}'.format('agents', 'query',
+                                                  'poll ms/tick',
+                                                  'push ms/tick')
+    for size in sizes:
+        for query in ['(tempted, A, car)', '(moved, A)']:
+            row = [size, query]
+            for subscribe in [False, True]:
+                brain = Brain()
+                brain.add('(tempted, A, T) if (agent, A) and (owns, O, T) '
+                          'and (not, (owns, A, T))')
+                brain.add('(moved, A) if (agent, A) and (at, A, T)')
+                brain.addFacts(('agent', 'a%d' % i) for i in xrange(size))
+                brain.addFacts([('owns', 'a0', 'car')])
+                answers = []
+                if subscribe:
+                    brain.subscribe(query, lambda added, removed:
+                                    answers.append(added))
+                start = time.time()
+                for tick in xrange(count):
+                    brain.add('(at, a%d, %d)' % (tick % size, tick))
+                    if tick % 10 == 0:
+                        brain.add('(owns, a%d, car)' % tick)
+                    if subscribe:
+                        brain.flushSubscriptions()
+                    else:
+                        answers.append(list(brain.query(query)))
+                row.append((time.time() - start) / count * 1e3)
+            print '{0:>8} {1:>20} {2:>14.2f} {3:>14.2f}'.format(*row)
+
+
+def benchProfile(sizes, count):
+    """
+    Answer queries about a family tree with and without a L{Profiler}.
+    """
+    print 'profile: (ancestor, pN, X) over a family tree of N people'
+    print '{0:>8} {1:>10} {2:>14} {3:>14}'.format(
+        'people', 'engine', 'plain ms/q', 'profiled ms/q')
+    for size in sizes:
+        queries = [parse('(ancestor, p%d, X)' % random.randrange(size // 8))
+                   for i in xrange(count)]
+        for engine in ['recursive', 'trail']:
+            row = [size, engine]
+            for profiler in [None, Profiler()]:
+                brain = Brain(engine=engine, profiler=profiler)
+                brain.add('(ancestor, X, Y) if (parent, X, Y)')
+                brain.add('(ancestor, X, Z) if (parent, X, Y) and '
+                          '(ancestor, Y, Z)')
+                brain.addFacts(('parent', 'p%d' % (i // 4), 'p%d' % i)
+                               for i in xrange(1, size))
+                row.append(timeQueries(brain, queries) * 1e3)
+            print '{0:>8} {1:>10} {2:>14.2f} {3:>14.2f}'.format(*row)
+
+
+_STARTUP = r"""
+import time
+start = time.time()
+import prolly
+imported = time.time()
+brain = prolly.Brain()
+brain.add('(parent, mary, joe)')
+list(brain.query('(parent, X, joe)'))
+print repr((imported - start, time.time() - start))
+"""
+
+
+def benchStartup(count):
+    """
+    Time C{import prolly} and the first query in new processes, with
+    the compiled grammar cached on disk and without.
+    """
+    import subprocess
+    import shutil
+    print 'startup: import prolly and answer a first query, in a new process'
+    print '{0:>10} {1:>12} {2:>16}'.format('grammar', 'import ms',
+                                           'first query ms')
+    cache_dir = tempfile.mkdtemp()
+    try:
+        for label in ['compiled', 'cached']:
+            times = []
+            for i in xrange(count):
+                if label == 'compiled':
+                    shutil.rmtree(cache_dir)
+                    os.mkdir(cache_dir)
+                env = dict(os.environ, PROLLY_CACHE=cache_dir)
+                output = subprocess.check_output(
+                    [sys.executable, '-c', _STARTUP], env=env,
+                    cwd=os.path.dirname(os.path.abspath(__file__)))
+                times.append(eval(output))
+            times.sort(key=lambda x: x[1])
+            imported, first = times[len(times) // 2]
+            print '{0:>10} {1:>12.1f} {2:>16.1f}'.format(
+                label, imported * 1e3, first * 1e3)
+    finally:
+        shutil.rmtree(cache_dir)
+
+
+def benchAnswers(sizes):
+    """
+    Enumerate every answer to a query with three variables.
+    """
+    print 'answers: (edge, X, Y, Z) against N facts'
+    print '{0:>8} {1:>14} {2:>14}'.format('facts', 'set ms', 'sorted ms')
+    for size in sizes:
+        row = [size]
+        for cls in [Brain, SortingBrain]:
+            brain = cls()
+            brain.addFacts(('edge', 'n%d' % i, 'n%d' % (i * 7 % size),
+                            i % 10) for i in xrange(size))
+            queries = [parse('(edge, X, Y, Z)')] * 3
+            row.append(timeQueries(brain, queries) * 1e3)
+        print '{0:>8} {1:>14.1f} {2:>14.1f}'.format(*row)
+
+
+def benchParallel(sizes):
+    """
+    Look for murderers among N suspects with a pool of 1, 2, 4...
+    processes, up to the number of cores.
+    """
+    cores = multiprocessing.cpu_count()
+    counts = [1]
+    while counts[-1] * 2 <= cores:
+        counts.append(counts[-1] * 2)
+    print 'parallel: (murderer, X) over N suspects on %d cores' % (cores,)
+    print '{0:>8} {1:>14}'.format('suspects', 'single ms') + ''.join(
+        '{0:>14}'.format('%d procs ms' % x) for x in counts)
+    from prolly_parallel import QueryPool
+    for size in sizes:
+        brain = Brain()
+        brain.add('(murderer, X) if (suspect, X) and (knew, X, V) and '
+                  '(at, X, P) and (at, V, P) and (not, (alibi, X, P))')
+        brain.addFacts(('suspect', 's%d' % i) for i in xrange(size))
+        brain.addFacts(('knew', 's%d' % i, 's%d' % ((i * 7 + j) % size))
+                       for i in xrange(size) for j in xrange(10))
+        brain.addFacts(('at', 's%d' % i, 'place%d' % (i % 20))
+                       for i in xrange(size))
+        brain.addFacts(('alibi', 's%d' % i, 'place%d' % (i % 20))
+                       for i in xrange(0, size, 3))
+        start = time.time()
+        expected = len(list(brain.query('(murderer, X)')))
+        row = ['{0:>8} {1:>14.1f}'.format(size, (time.time() - start) * 1e3)]
+        for count in counts:
+            pool = QueryPool(brain, processes=count)
+            start = time.time()
+            assert len(list(pool.query('(murderer, X)'))) == expected
+            row.append('{0:>14.1f}'.format((time.time() - start) * 1e3))
+            pool.close()
+        print ''.join(row)
+
+
+def benchSnapshot(sizes):
+    """
+    Start a brain from a fact dump with L{Brain.load} and from a
+    snapshot with L{Brain.open}, and answer one query with it.
+    """
+    print 'snapshot: start from N facts and answer (owns, agent3, X)'
+    print '{0:>8} {1:>14} {2:>14} {3:>14}'.format(
+        'facts', 'load ms', 'open ms', 'snapshot KB')
+    fd, path = tempfile.mkstemp()
+    os.close(fd)
+    try:
+        for size in sizes:
+            text = ''.join(factLines(size))
+            row = [size]
+            start = time.time()
+            brain = Brain()
+            brain.load(StringIO(text))
+            list(brain.query('(owns, agent3, X)'))
+            row.append((time.time() - start) * 1e3)
+            brain.save(path)
+            start = time.time()
+            list(Brain.open(path).query('(owns, agent3, X)'))
+            row.append((time.time() - start) * 1e3)
+            row.append(os.path.getsize(path) / 1024.0)
+            print '{0:>8} {1:>14.1f} {2:>14.1f} {3:>14.0f}'.format(*row)
+    finally:
+        os.remove(path)
+
+
+def familyWorkload(size, engine):
+    """
+    A family tree of C{size} people, four generations deep, with the
+    parent, sibling and grandparent rules from the tests.
+    """
+    def build():
+        brain = Brain(engine=engine)
+        for rule in [
+                '(parent, P, C) if (mother, P, C)',
+                '(parent, P, C) if (father, P, C)',
+                '(daughter, P, C) if (parent, P, C) and (female, C)',
+                '(son, P, C) if (parent, P, C) and (male, C)',
+                '(grandparent, G, C) if (parent, G, P) and (parent, P, C)',
+                '(sibling, X, Y) if (parent, P, X) and (parent, P, Y)']:
+            brain.add(rule)
+        facts = []
+        for i in xrange(size):
+            facts.append(('female' if i % 2 else 'male', 'p%d' % i))
+            if i >= 4:
+                facts.append(('mother', 'p%d' % (i // 4 * 2 - 1), 'p%d' % i))
+                facts.append(('father', 'p%d' % (i // 4 * 2 - 2), 'p%d' % i))
+        brain.addFacts(facts)
+        return brain
+    people = random.Random(size)
+    queries = []
+    for template in ['(grandparent, p%d, X)', '(sibling, p%d, X)',
+                     '(daughter, X, p%d)', '(parent, X, p%d)']:
+        queries.extend(template % people.randrange(size) for i in xrange(5))
+    return build, queries
+
+
+def graphWorkload(size, engine):
+    """
+    A graph of C{size} nodes with three edges out of each, some of them
+    back to earlier nodes, and a tabled reachability rule.
+    """
+    def build():
+        brain = Brain(engine=engine, tabling=True)
+        brain.add('(reach, X, Y) if (edge, X, Y)')
+        brain.add('(reach, X, Y) if (reach, X, Z) and (edge, Z, Y)')
+        edges = random.Random(size)
+        brain.addFacts(('edge', 'n%d' % i, 'n%d' % edges.randrange(size))
+                       for i in xrange(size) for j in xrange(3))
+        return brain
+    nodes = random.Random(size + 1)
+    queries = ['(reach, n%d, X)' % nodes.randrange(size) for i in xrange(3)]
+    return build, queries
+
+
+def negationWorkload(size, engine):
+    """
+    The stealing rules from C{taking.pro} over C{size} agents, each
+    owning a thing, with spoken and written permissions for some of
+    them to take others' things.
+    """
+    def build():
+        brain = Brain(engine=engine)
+        for rule in [
+                '(stealing, T, X) if (not, (owns, T, X)) and (owns, O, X) '
+                'and (not, (permitted, O, (take, T, X)))',
+                '(morality, (take, T, X), -1) if (stealing, T, X)',
+                '(permitted, P, A) if (said, P, (allowed, A))',
+                '(permitted, P, A) if (contains, D, (allowed, A)) and '
+                '(signed, P, D)']:
+            brain.add(rule)
+        facts = []
+        for i in xrange(size):
+            owner = 'a%d' % i
+            thing = 'thing%d' % i
+            facts.append(('owns', owner, thing))
+            taker = 'a%d' % ((i * 7 + 1) % size)
+            if i % 3 == 0:
+                facts.append(('said', owner, ('allowed', ('take', taker, thing))))
+            elif i % 3 == 1:
+                doc = 'doc%d' % i
+                facts.append(('contains', doc,
+                              ('allowed', ('take', taker, thing))))
+                if i % 2:
+                    facts.append(('signed', owner, doc))
+        brain.addFacts(facts)
+        return brain
+    agents = random.Random(size)
+    queries = []
+    for i in xrange(10):
+        queries.append('(morality, (take, a%d, thing%d), V)' % (
+            agents.randrange(size), agents.randrange(size)))
+    # the taker is bound, as in taking.pro: (not, (owns, T, X)) comes
+    # first, so with T free it would fail whenever anyone owns X.
+    for i in xrange(10):
+        thing = agents.randrange(size)
+        queries.append('(stealing, a%d, thing%d)' % (
+            (thing * 7 + 1) % size if i % 2 else agents.randrange(size),
+            thing))
+    return build, queries
+
+
+def loadWorkload(size, engine):
+    """
+    Load a dump of C{size} facts with L{Brain.load}.
+    """
+    text = ''.join(factLines(size))
+
+    def build():
+        brain = Brain(engine=engine)
+        brain.load(StringIO(text))
+        return brain
+    return build, ['(owns, agent%d, X)' % (i * 3) for i in xrange(10)]
+
+
+WORKLOADS = [
+    ('family', familyWorkload),
+    ('graph', graphWorkload),
+    ('negation', negationWorkload),
+    ('load', loadWorkload),
+]
+
+
+def _residentKB():
+    """
+    Return how much memory this process is using now, in KB.
+    """
+    with open('/proc/self/statm') as f:
+        pages = int(f.read().split()[1])
+    return pages * resource.getpagesize() // 1024
+
+
+def runWorkload(name, size, engine):
+    """
+    Build a workload's brain and ask its queries, in a process of its
+    own so that its peak memory use is its own.
+
+    @return: A dict of measurements.
+    """
+    build, queries = dict(WORKLOADS)[name](size, engine)
+    resident = _residentKB()
+    start = time.time()
+    brain = build()
+    built = time.time()
+    answers = [0]
+
+    def ask():
+        for query in queries:
+            for x in brain.query(query):
+                answers[0] += 1
+    terms = countTerms(ask)
+    done = time.time()
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {
+        'workload': name,
+        'size': size,
+        'engine': engine,
+        'build_ms': (built - start) * 1e3,
+        'queries': len(queries),
+        'answers': answers[0],
+        'queries_per_s': len(queries) / (done - built),
+        'answers_per_s': answers[0] / (done - built),
+        'peak_kb': max(peak - resident, 0),
+        'terms_built': terms,
+    }
+
+
+def benchSuite(sizes, json_path=None):
+    """
+    Run every workload at every size with each engine and print (and
+    perhaps save as JSON) what was measured.
+    """
+    columns = ['workload', 'size', 'engine', 'build_ms', 'queries_per_s',
+               'answers_per_s', 'peak_kb', 'terms_built']
+    print ''.join('{0:>14}'.format(x) for x in columns)
+    results = []
+    for name, workload in WORKLOADS:
+        for size in sizes:
+            for engine in ['recursive', 'trail']:
+                pool = multiprocessing.Pool(1)
+                try:
+                    result = pool.apply(runWorkload, (name, size, engine))
+                finally:
+                    pool.close()
+                    pool.join()
+                results.append(result)
+                print ''.join(_cell(result[x]) for x in columns)
+    if json_path:
+        with open(json_path, 'w') as f:
+            json.dump({
+                'python': sys.version.split()[0],
+                'platform': platform.platform(),
+                'time': time.time(),
+                'results': results,
+            }, f, indent=2, sort_keys=True)
+
+
+def _cell(value):
+    if isinstance(value, float):
+        return '{0:>14.1f}'.format(value)
+    return '{0:>14}'.format(value)
+
+
+def compareRuns(before_path, after_path):
+    """
+    Show how the measurements in one saved suite run compare with
+    another's, as the ratio of after to before.
+    """
+    with open(before_path) as f:
+        before = json.load(f)['results']
+    with open(after_path) as f:
+        after = json.load(f)['results']
+    keyed = {(x['workload'], x['size'], x['engine']): x for x in before}
+    columns = ['build_ms', 'queries_per_s', 'answers_per_s', 'peak_kb',
+               'terms_built']
+    print '{0:>10} {1:>8} {2:>10}'.format('workload', 'size', 'engine') + \
+        ''.join('{0:>14}'.format(x) for x in columns)
+    for result in after:
+        key = (result['workload'], result['size'], result['engine'])
+        old = keyed.get(key)
+        if old is None:
+            continue
+        row = '{0:>10} {1:>8} {2:>10}'.format(*key)
+        for column in columns:
+            if old[column]:
+                row += '{0:>13.2f}x'.format(result[column] / float(old[column]))
+            else:
+                row += '{0:>14}'.format('-')
+        print row
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('benchmark',
+        choices=['lookup', 'conjunction', 'memory', 'load',
+                 'planning', 'materialize', 'columnar', 'layers',
+                 'slices', 'negation', 'range', 'subscribe', 'profile',
+                 'startup', 'answers', 'parallel', 'snapshot', 'suite',
+                 'compare'])
+    parser.add_argument('files', nargs='*',
+        help='For compare: the JSON files of two suite runs')
+    parser.add_argument('--sizes', default='1000,4000,16000,64000',
+        help='Comma-separated brain sizes (default %(default)s)')
+    parser.add_argument('--count', type=int, default=20,
+        help='Queries per size (default %(default)s)')
+    parser.add_argument('--json',
+        help='For suite: a file to save the results in as JSON')
+    args = parser.parse_args()
+    sizes = [int(x) for x in args.sizes.split(',')]
+    if args.benchmark == 'lookup':
+        benchLookup(sizes, args.count)
+    elif args.benchmark == 'conjunction':
+        benchConjunction(sizes, args.count)
+    elif args.benchmark == 'memory':
+        benchMemory(sizes)
+    elif args.benchmark == 'load':
+        benchLoad(sizes)
+    elif args.benchmark == 'planning':
+        benchPlanning(sizes, args.count)
+    elif args.benchmark == 'materialize':
+        benchMaterialize(sizes, args.count)
+    elif args.benchmark == 'columnar':
+        benchColumnar(sizes)
+    elif args.benchmark == 'layers':
+        benchLayers(sizes, args.count)
+    elif args.benchmark == 'slices':
+        benchSlices(sizes, args.count)
+    elif args.benchmark == 'negation':
+        benchNegation(sizes, args.count)
+    elif args.benchmark == 'range':
+        benchRange(sizes, args.count)
+    elif args.benchmark == 'subscribe':
+        benchSubscribe(sizes, args.count)
+    elif args.benchmark == 'profile':
+        benchProfile(sizes, args.count)
+    elif args.benchmark == 'startup':
+        benchStartup(args.count)
+    elif args.benchmark == 'answers':
+        benchAnswers(sizes)
+    elif args.benchmark == 'parallel':
+        benchParallel(sizes)
+    elif args.benchmark == 'snapshot':
+        benchSnapshot(sizes)
+    elif args.benchmark == 'suite':
+        benchSuite(sizes, args.json)
+    elif args.benchmark == 'compare':
+        if len(args.files) != 2:
+            parser.error('compare needs two files')
+        compareRuns(*args.files)
@@ -4,11 +4,182 @@ Based on http://guineashots.com/2014/09/24/implementing-a-behavior-tree-part-1/
 
 import weakref
 import time
-import termcolor
+import heapq
+import collections
 
 OK, FAIL, RUNNING, ERR = range(4) 
 
 
+class _Missing(object):
+    """
+    I stand for a field of a L{Memory} that hasn't been set.
+    """
+
+    def __nonzero__(self):
+        return False
+
+    def __repr__(self):
+        return '<missing>'
+
+_MISSING = _Missing()
+
+
+class Memory(object):
+    """
+    I am what a blackboard remembers about a tree or a node.  I am a
+    C{collections.MutableMapping}, but keep the keys behavior trees use
+    most in fixed fields, which can also be read and set as attributes
+    (unset fields are L{_MISSING}).  Other keys go in a C{dict} made
+    when one is first set.
+
+    I'm registered as a C{MutableMapping} and take its methods rather
+    than subclassing it, which would give each of me a C{__dict__}.
+    """
+
+    __slots__ = ('_extra',)
+    _fields = frozenset()
+
+    def __init__(self):
+        for name in self._fields:
+            setattr(self, name, _MISSING)
+        self._extra = None
+
+    def __getitem__(self, key):
+        if key in self._fields:
+            value = getattr(self, key)
+            if value is _MISSING:
+                raise KeyError(key)
+            return value
+        if self._extra is None:
+            raise KeyError(key)
+        return self._extra[key]
+
+    def __setitem__(self, key, value):
+        if key in self._fields:
+            setattr(self, key, value)
+        else:
+            if self._extra is None:
+                self._extra = {}
+            self._extra[key] = value
+
+    def __delitem__(self, key):
+        self[key]
+        if key in self._fields:
+            setattr(self, key, _MISSING)
+        else:
+            del self._extra[key]
+
+    def __contains__(self, key):
+        try:
+            self[key]
+        except KeyError:
+            return False
+        return True
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def setdefault(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            self[key] = default
+            return default
+
+    def pop(self, key, *default):
+        try:
+            value = self[key]
+        except KeyError:
+            if default:
+                return default[0]
+            raise
+        del self[key]
+        return value
+
+    def keys(self):
+        ret = sorted(x for x in self._fields if getattr(self, x) is not _MISSING)
+        if self._extra:
+            ret.extend(self._extra)
+        return ret
+
+    def items(self):
+        return [(x, self[x]) for x in self.keys()]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def copy(self):
+        return dict(self.items())
+
+    update = collections.MutableMapping.update.im_func
+    values = collections.MutableMapping.values.im_func
+    iterkeys = collections.MutableMapping.iterkeys.im_func
+    itervalues = collections.MutableMapping.itervalues.im_func
+    iteritems = collections.MutableMapping.iteritems.im_func
+    popitem = collections.MutableMapping.popitem.im_func
+    clear = collections.MutableMapping.clear.im_func
+    __eq__ = collections.MutableMapping.__eq__.im_func
+    __ne__ = collections.MutableMapping.__ne__.im_func
+    __hash__ = None
+
+    def __repr__(self):
+        return '<{0} {1!r}>'.format(self.__class__.__name__, dict(self.items()))
+
+collections.MutableMapping.register(Memory)
+
+
+class NodeMemory(Memory):
+    """
+    I am what a blackboard remembers about a node.
+    """
+
+    __slots__ = ('is_open', 'running_child_idx', 'end_time')
+    _fields = frozenset(__slots__)
+
+
+class TreeMemory(Memory):
+    """
+    I am what a blackboard remembers about a L{BehaviorTree}.  The
+    memories of its nodes are kept in L{nodes} rather than under a
+    C{'_node_memory'} key; use L{Blackboard.memory} to get them.
+
+    @ivar nodes: A L{NodeMemory} for each of the tree's node slots (see
+        L{BehaviorTree.slots}), or C{None} for nodes that haven't
+        needed one yet.
+    """
+
+    __slots__ = ('open_nodes', 'node_count', 'nodes')
+    _fields = frozenset(['open_nodes', 'node_count'])
+
+    def __init__(self):
+        Memory.__init__(self)
+        self.nodes = []
+
+    def reserve(self, size):
+        """
+        Make room in L{nodes} for C{size} slots.
+        """
+        nodes = self.nodes
+        if len(nodes) < size:
+            nodes.extend([None] * (size - len(nodes)))
+
+    def node(self, slot):
+        """
+        Return the memory of the node in C{slot}.
+        """
+        self.reserve(slot + 1)
+        memory = self.nodes[slot]
+        if memory is None:
+            memory = self.nodes[slot] = NodeMemory()
+        return memory
+
+
 class Blackboard(object):
 
     def __init__(self):
@@ -16,13 +187,32 @@ class Blackboard(object):
         self._tree_memories = weakref.WeakKeyDictionary()
 
     def memory(self, tree=None, node=None):
+        """
+        Return what I remember about C{node} of C{tree}, about C{tree},
+        or about everything.
+
+        For a L{BehaviorTree} these are a L{TreeMemory} and
+        L{NodeMemory}s.  Other trees (anything without a C{slot}
+        method) get a C{dict}, with their nodes' L{NodeMemory}s kept by
+        node under its C{'_node_memory'} key.
+        """
         memory = self._global_memory
         if tree:
-            memory = self._tree_memories.setdefault(tree, {
-                '_node_memory': weakref.WeakKeyDictionary(),
-            })
+            if getattr(tree, 'slot', None) is None:
+                memory = self._tree_memories.setdefault(tree, {
+                    '_node_memory': weakref.WeakKeyDictionary(),
+                })
+                if node:
+                    nodes = memory['_node_memory']
+                    memory = nodes.get(node)
+                    if memory is None:
+                        memory = nodes[node] = NodeMemory()
+                return memory
+            memory = self._tree_memories.get(tree)
+            if memory is None:
+                memory = self._tree_memories[tree] = TreeMemory()
             if node:
-                memory = memory['_node_memory'].setdefault(node, {})
+                memory = memory.node(tree.slot(node))
         return memory
 
 def silentDebugger(*args):
@@ -36,9 +226,39 @@ class TickContext(object):
     def __init__(self, tree, target, blackboard, debug=silentDebugger):
         self.open_nodes = []
         self.tree = tree
+        self.debug = debug
+        self.reset(target, blackboard)
+
+    def reset(self, target, blackboard):
+        """
+        Get ready to tick the tree again, for C{target}.
+        """
+        del self.open_nodes[:]
+        self.node_count = 0
         self.target = target
         self.blackboard = blackboard
-        self.debug = debug
+        self.tree_memory = blackboard.memory(self.tree)
+        self.sleepers = None
+        self.waiters = None
+
+    def sleepUntil(self, node, when):
+        """
+        Say that C{node}, which is running, won't have anything new to
+        say before C{when}, so that a L{Scheduler} needn't tick the
+        target again until then.
+        """
+        if self.sleepers is None:
+            self.sleepers = {}
+        self.sleepers[node] = when
+
+    def waitFor(self, node, event):
+        """
+        Say that C{node}, which is running, won't have anything new to
+        say until C{event} is signalled to a L{Scheduler}.
+        """
+        if self.waiters is None:
+            self.waiters = {}
+        self.waiters.setdefault(node, []).append(event)
 
     def nodeEntered(self, node):
         self.node_count += 1
@@ -61,28 +281,135 @@ class TickContext(object):
 
 
 class BehaviorTree(object):
+    """
+    @ivar slots: A number for each of my nodes, which its memory is
+        kept under on blackboards.  Nodes are numbered in the order
+        they're first entered when I'm made, and nodes found later get
+        the next free number.  Numbers aren't reused, so nodes taken
+        out of the tree stay here (and alive) as long as I do; make a
+        new tree rather than swapping many nodes in and out of one.
+
+    @ivar program: My nodes compiled into a L{Program}, or C{None} if I
+        run them by calling each node's C{run}.  Trees that debug are
+        always run node by node.
+    """
 
-    def __init__(self, root, debug=silentDebugger):
+    def __init__(self, root, debug=silentDebugger, compiled=True):
         self.root = root
         self.debug = debug
+        self.slots = {}
+        self.program = None
+        if compiled:
+            self.compile()
+        else:
+            numberNodes(root, self.slots)
+
+    def compile(self):
+        """
+        Compile my nodes again, after nodes have been added to or
+        taken from the tree.
+        """
+        self.program = compileTree(self.root, self.slots)
+
+    def slot(self, node):
+        """
+        Return the number C{node}'s memory is kept under.
+        """
+        try:
+            return self.slots[node]
+        except KeyError:
+            slot = self.slots[node] = len(self.slots)
+            return slot
 
     def tick(self, target, blackboard):
+        """
+        Tick the tree once for C{target}.
+
+        @return: The root node's status.
+        """
         self.debug(self, 'tick', target, blackboard)
         ctx = TickContext(tree=self, target=target, blackboard=blackboard,
             debug=self.debug)
-        self.root.run(ctx)
+        return self._run(ctx)
+
+    def tickMany(self, targets, blackboards, columns=None):
+        """
+        Tick the tree once for each of C{targets}, in order, with the
+        blackboard in the same place in C{blackboards}.
+
+        @param columns: The targets' state as columns (for instance a
+            C{dict} of NumPy arrays), for leaves that can check every
+            target at once.  Such leaves have a
+            C{tickColumns(columns, targets)} method returning a status
+            for each target, which is called once before any target is
+            ticked and used instead of their C{tick}.  So it should
+            only be used for checks that nothing else in the tree
+            changes the outcome of.  Trees that aren't compiled, or
+            that debug, call C{tick} as usual.
+
+        @return: A list of the root node's status for each target.
+        @raise ValueError: If there aren't as many blackboards as
+            targets.
+        """
+        if len(targets) != len(blackboards):
+            raise ValueError('{0} targets but {1} blackboards'.format(
+                len(targets), len(blackboards)))
+        debug = self.debug
+        statuses = None
+        if (columns is not None and self.program is not None
+                and debug is silentDebugger):
+            statuses = self.program.tickColumns(columns, targets)
+        ctx = None
+        ret = []
+        run = self._run
+        for i, (target, blackboard) in enumerate(zip(targets, blackboards)):
+            if debug is not silentDebugger:
+                debug(self, 'tick', target, blackboard)
+            if ctx is None:
+                ctx = TickContext(tree=self, target=target,
+                    blackboard=blackboard, debug=debug)
+            else:
+                ctx.reset(target, blackboard)
+            ret.append(run(ctx, statuses, i))
+        return ret
+
+    def _run(self, ctx, statuses=None, index=0):
+        """
+        Run the tree for C{ctx.target}, then close the nodes left open
+        last time that weren't reached.
+        """
+        memory = ctx.tree_memory
+        memory.reserve(len(self.slots))
+        if self.program is not None and self.debug is silentDebugger:
+            status = self.program.run(ctx, memory.nodes, statuses, index)
+        else:
+            status = self.root.run(ctx)
 
         # close nodes that were open at the beginning, but aren't now
-        memory = blackboard.memory(self)
-        last_open_nodes = memory.get('open_nodes', set())
+        last_open_nodes = memory.open_nodes or set()
         this_open_nodes = set(ctx.open_nodes)
 
         for node in (last_open_nodes - this_open_nodes):
             self.debug(self, 'closing', node)
             node.close(ctx)
 
-        memory['open_nodes'] = this_open_nodes
-        memory['node_count'] = ctx.node_count
+        memory.open_nodes = this_open_nodes
+        memory.node_count = ctx.node_count
+        return status
+
+
+def numberNodes(root, slots):
+    """
+    Give each node under C{root} that doesn't have a number in C{slots}
+    the next free one, in the order the nodes are first entered.
+    """
+    if root not in slots:
+        slots[root] = len(slots)
+    child = getattr(root, 'child', None)
+    if child is not None:
+        numberNodes(child, slots)
+    for child in getattr(root, 'children', None) or []:
+        numberNodes(child, slots)
 
 
 class _BaseNode(object):
@@ -100,16 +427,19 @@ class _BaseNode(object):
         return status
 
     def memory(self, ctx):
-        return ctx.blackboard.memory(ctx.tree, self)
+        slot = getattr(ctx.tree, 'slot', None)
+        if slot is None:
+            return ctx.blackboard.memory(ctx.tree, self)
+        return ctx.tree_memory.node(slot(self))
 
     def _enter(self, ctx):
         ctx.nodeEntered(self)
         self.enter(ctx)
 
     def _open(self, ctx, memory):
-        if not memory.get('is_open', False):
+        if not memory.is_open:
             ctx.nodeOpened(self)
-            memory['is_open'] = True
+            memory.is_open = True
             self.open(ctx)
 
     def _tick(self, ctx):
@@ -118,7 +448,7 @@ class _BaseNode(object):
 
     def _close(self, ctx, memory):
         ctx.nodeClosed(self)
-        memory.pop('is_open', None)
+        memory.is_open = _MISSING
         self.close(ctx)
 
     def _exit(self, ctx):
@@ -175,7 +505,7 @@ class MemSequence(_BaseNode):
         self.children = children or []
 
     def open(self, ctx):
-        self.memory(ctx)['running_child_idx'] = 0
+        self.memory(ctx).running_child_idx = 0
 
     def tick(self, ctx):
         memory = self.memory(ctx)
@@ -184,7 +514,7 @@ class MemSequence(_BaseNode):
             status = c.run(ctx)
             if status != OK:
                 if status == RUNNING:
-                    memory['running_child_idx'] = i + idx
+                    memory.running_child_idx = i + idx
                 return status
         return OK
 
@@ -218,7 +548,7 @@ class MemPriority(_BaseNode):
         self.children = children or []
 
     def open(self, ctx):
-        self.memory(ctx)['running_child_idx'] = 0
+        self.memory(ctx).running_child_idx = 0
 
     def tick(self, ctx):
         memory = self.memory(ctx)
@@ -227,7 +557,7 @@ class MemPriority(_BaseNode):
             status = c.run(ctx)
             if status != FAIL:
                 if status == RUNNING:
-                    memory['running_child_idx'] = i + idx
+                    memory.running_child_idx = i + idx
                 return status
         return FAIL
 
@@ -252,18 +582,20 @@ class Inverter(_BaseNode):
 
 class WaitAction(_BaseNode):
 
-    def __init__(self, seconds):
+    def __init__(self, seconds, clock=time.time):
         self.seconds = seconds
+        self.clock = clock
 
     def open(self, ctx):
-        self.memory(ctx)['end_time'] = time.time() + self.seconds
+        self.memory(ctx).end_time = self.clock() + self.seconds
 
     def tick(self, ctx):
-        now = time.time()
+        now = self.clock()
         end = self.memory(ctx)['end_time']
 
         if now >= end:
             return OK
+        ctx.sleepUntil(self, end)
         return RUNNING
 
 
@@ -277,7 +609,415 @@ class SaySomething(_BaseNode):
         return OK
 
 
+#-----------------------------------------------------------
+# Compiling
+#-----------------------------------------------------------
+
+_OPAQUE, _LEAF, _COLUMN, _SEQUENCE, _MEM_SEQUENCE, _PRIORITY, \
+    _MEM_PRIORITY, _INVERTER = range(8)
+
+_HOOKS = ['enter', 'open', 'close', 'exit']
+_INTERNALS = ['run', 'memory', '_enter', '_open', '_tick', '_close', '_exit']
+
+
+def _override(node, name):
+    """
+    Return C{node}'s bound method C{name} if it isn't the one
+    L{_BaseNode} has, else C{None}.
+    """
+    method = getattr(node, name)
+    if getattr(method, 'im_func', None) is getattr(_BaseNode, name).im_func:
+        return None
+    return method
+
+
+def compileTree(root, slots=None):
+    """
+    Compile the nodes under C{root} into a L{Program}.
+
+    @param slots: The numbers of the nodes' memories (see
+        L{BehaviorTree.slots}).  Nodes without one are numbered with
+        L{numberNodes}.
+    """
+    ops = {
+        Sequence.tick.im_func: _SEQUENCE,
+        MemSequence.tick.im_func: _MEM_SEQUENCE,
+        Priority.tick.im_func: _PRIORITY,
+        MemPriority.tick.im_func: _MEM_PRIORITY,
+        Inverter.tick.im_func: _INVERTER,
+    }
+    stock_opens = set([MemSequence.open.im_func, MemPriority.open.im_func])
+    if slots is None:
+        slots = {}
+    numberNodes(root, slots)
+    code = []
+
+    def emit(node):
+        pc = len(code)
+        code.append(None)
+        if any(_override(node, x) for x in _INTERNALS):
+            code[pc] = (_OPAQUE, node, slots[node], (), None, None, None,
+                        None, None)
+            return pc
+        tick = node.tick
+        op = ops.get(getattr(tick, 'im_func', None), _LEAF)
+        if op == _LEAF and hasattr(node, 'tickColumns'):
+            op = _COLUMN
+        if op == _INVERTER:
+            children = [node.child]
+        elif op == _LEAF or op == _COLUMN:
+            children = []
+        else:
+            children = node.children
+        enter, opener, closer, exiter = [_override(node, x) for x in _HOOKS]
+        if op in (_MEM_SEQUENCE, _MEM_PRIORITY) and \
+                getattr(opener, 'im_func', None) in stock_opens:
+            # the loop sets running_child_idx itself
+            opener = None
+        kids = tuple([emit(x) for x in children])
+        code[pc] = (op, node, slots[node], kids, enter, opener, tick, closer,
+                    exiter)
+        return pc
+
+    emit(root)
+    return Program(code)
+
+
+class Program(object):
+    """
+    I am a behavior tree compiled into a flat list of instructions,
+    one for each node in the order the nodes are first entered.  I run
+    the tree with a loop and a stack instead of by calling each node's
+    C{run}, and only call the hooks a node overrides.
+
+    L{Sequence}, L{MemSequence}, L{Priority}, L{MemPriority} and
+    L{Inverter} are run by the loop.  Other nodes are leaves whose
+    C{tick} (or the status their C{tickColumns} gave, see
+    L{BehaviorTree.tickMany}) is used, except that nodes that change
+    how they're run (by overriding C{run}, C{memory} or one of the
+    C{_enter} family) are run with their own C{run}.
+
+    @ivar code: A tuple for each node of: what sort of node it is, the
+        node, its slot, the numbers of its children's instructions, and its
+        C{enter}, C{open}, C{tick}, C{close} and C{exit} methods (or
+        C{None} for hooks it doesn't override).
+    """
+
+    def __init__(self, code):
+        self.code = code
+
+    def tickColumns(self, columns, targets):
+        """
+        Check every target at once with each leaf that can.
+
+        @return: A list with, for each instruction, C{None} or a list
+            of the statuses its leaf gave each target.
+
+        @raise ValueError: If a leaf doesn't give a status for each
+            target.
+        """
+        ret = [None] * len(self.code)
+        for pc, instruction in enumerate(self.code):
+            if instruction[0] == _COLUMN:
+                statuses = instruction[1].tickColumns(columns, targets)
+                if hasattr(statuses, 'tolist'):
+                    statuses = statuses.tolist()
+                if len(statuses) != len(targets):
+                    raise ValueError('{0!r} gave {1} statuses for {2} '
+                        'targets'.format(instruction[1], len(statuses),
+                                         len(targets)))
+                ret[pc] = statuses
+        return ret
+
+    def run(self, ctx, memories, statuses=None, index=0):
+        """
+        Run the tree once, exactly as C{ctx.tree.root.run(ctx)} would
+        but without calling C{ctx.debug}.
+
+        @param memories: The L{TreeMemory.nodes} of this tree in
+            C{ctx.blackboard}, with room for every slot.
+
+        @param statuses: What L{tickColumns} gave, if it was called.
+
+        @param index: Where C{ctx.target} is in the targets given to
+            L{tickColumns}.
+
+        @return: The root node's status.
+        """
+        code = self.code
+        open_nodes = ctx.open_nodes
+        stack = []
+        pc = 0
+        while True:
+            op, node, slot, kids, enter, opener, tick, closer, exiter = \
+                code[pc]
+            if op == _OPAQUE:
+                status = node.run(ctx)
+            else:
+                memory = memories[slot]
+                if memory is None:
+                    memory = memories[slot] = NodeMemory()
+                ctx.node_count += 1
+                open_nodes.append(node)
+                if enter is not None:
+                    enter(ctx)
+                if not memory.is_open:
+                    memory.is_open = True
+                    if opener is not None:
+                        opener(ctx)
+                    elif op == _MEM_SEQUENCE or op == _MEM_PRIORITY:
+                        memory.running_child_idx = 0
+                if op == _LEAF:
+                    status = tick(ctx)
+                elif op == _COLUMN:
+                    if statuses is None:
+                        status = tick(ctx)
+                    else:
+                        status = statuses[pc][index]
+                else:
+                    if op == _MEM_SEQUENCE or op == _MEM_PRIORITY:
+                        i = memory.running_child_idx
+                        if i is _MISSING:
+                            raise KeyError('running_child_idx')
+                    else:
+                        i = 0
+                    if i < len(kids):
+                        stack.append([pc, i, memory])
+                        pc = kids[i]
+                        continue
+                    if op == _SEQUENCE or op == _MEM_SEQUENCE:
+                        status = OK
+                    else:
+                        status = FAIL
+
+            # finish the node, and each parent it finishes
+            while True:
+                if op != _OPAQUE:
+                    if status != RUNNING:
+                        if open_nodes[-1] is node:
+                            open_nodes.pop()
+                        else:
+                            open_nodes.remove(node)
+                        memory.is_open = _MISSING
+                        if closer is not None:
+                            closer(ctx)
+                    if exiter is not None:
+                        exiter(ctx)
+                if not stack:
+                    return status
+                frame = stack[-1]
+                pc, i, memory = frame
+                op, node, slot, kids, enter, opener, tick, closer, exiter = \
+                    code[pc]
+                if op == _SEQUENCE or op == _MEM_SEQUENCE:
+                    if status == OK:
+                        i += 1
+                        if i < len(kids):
+                            frame[1] = i
+                            pc = kids[i]
+                            break
+                    elif status == RUNNING and op == _MEM_SEQUENCE:
+                        memory.running_child_idx = i
+                elif op == _PRIORITY or op == _MEM_PRIORITY:
+                    if status == FAIL:
+                        i += 1
+                        if i < len(kids):
+                            frame[1] = i
+                            pc = kids[i]
+                            break
+                    elif status == RUNNING and op == _MEM_PRIORITY:
+                        memory.running_child_idx = i
+                elif status == FAIL:
+                    status = OK
+                elif status == OK:
+                    status = FAIL
+                stack.pop()
+
+
+#-----------------------------------------------------------
+# Scheduling
+#-----------------------------------------------------------
+
+_COMPOSITES = (Sequence, MemSequence, Priority, MemPriority, Inverter)
+
+
+class _Sleeper(object):
+    """
+    I am a target a L{Scheduler} ticks a tree for.
+
+    @ivar wake_time: When I'm next to be ticked, if I'm asleep until
+        then, else C{None}.
+    @ivar events: The events I'm waiting on.
+    """
+
+    __slots__ = ('number', 'target', 'blackboard', 'wake_time', 'events',
+                 'removed')
+
+    def __init__(self, number, target, blackboard):
+        self.number = number
+        self.target = target
+        self.blackboard = blackboard
+        self.wake_time = None
+        self.events = ()
+        self.removed = False
+
+
+class Scheduler(object):
+    """
+    I tick a tree for a crowd of targets, skipping each target while
+    all its running leaves are asleep (see L{TickContext.sleepUntil})
+    or waiting on events (see L{TickContext.waitFor}).  Targets that
+    are asleep cost nothing a tick, so idle crowds are cheap.
+
+    A target that's skipped isn't ticked at all, so the conditions
+    above its sleeping leaves aren't checked either: changes that
+    should interrupt a sleeping target need to be made known with
+    L{signal} or L{wake}.
+
+    Composite nodes are those in L{_COMPOSITES}; any other running
+    node has to say it's asleep for its target to be skipped.
+    """
+
+    def __init__(self, tree, clock=time.time):
+        self.tree = tree
+        self.clock = clock
+        self._sleepers = {}
+        self._count = 0
+        self._awake = set()
+        self._timers = []
+        self._waiting = {}
+
+    def add(self, target, blackboard=None):
+        """
+        Start ticking the tree for C{target}.
+
+        @return: C{target}'s blackboard.
+        """
+        if blackboard is None:
+            blackboard = Blackboard()
+        sleeper = _Sleeper(self._count, target, blackboard)
+        self._count += 1
+        self._sleepers[target] = sleeper
+        self._awake.add(sleeper)
+        return blackboard
+
+    def remove(self, target):
+        """
+        Stop ticking the tree for C{target}.
+        """
+        sleeper = self._sleepers.pop(target)
+        self._unwait(sleeper)
+        self._awake.discard(sleeper)
+        sleeper.removed = True
+
+    def isAwake(self, target):
+        """
+        Return whether C{target} will be ticked next tick.
+        """
+        return self._sleepers[target] in self._awake
+
+    def wake(self, target):
+        """
+        Tick the tree for C{target} next tick, even if it's asleep.
+        """
+        self._wake(self._sleepers[target])
+
+    def signal(self, event):
+        """
+        Wake the targets waiting on C{event}.
+        """
+        for sleeper in list(self._waiting.pop(event, ())):
+            self._wake(sleeper)
+
+    def _wake(self, sleeper):
+        self._unwait(sleeper)
+        sleeper.wake_time = None
+        self._awake.add(sleeper)
+
+    def _unwait(self, sleeper):
+        for event in sleeper.events:
+            waiting = self._waiting.get(event)
+            if waiting is not None:
+                waiting.discard(sleeper)
+                if not waiting:
+                    del self._waiting[event]
+        sleeper.events = ()
+
+    def tick(self, now=None):
+        """
+        Tick the tree once for each target that's awake, in the order
+        they were added, after waking those whose time has come.
+
+        @param now: The time, if not my clock's.
+
+        @return: A list of C{(target, status)} for the targets ticked.
+        """
+        if now is None:
+            now = self.clock()
+        timers = self._timers
+        while timers and timers[0][0] <= now:
+            when, number, sleeper = heapq.heappop(timers)
+            if sleeper.wake_time == when and not sleeper.removed:
+                self._wake(sleeper)
+        if not self._awake:
+            return []
+        awake = sorted(self._awake, key=lambda x: x.number)
+        self._awake = set()
+        tree = self.tree
+        ctx = None
+        ret = []
+        for sleeper in awake:
+            target = sleeper.target
+            blackboard = sleeper.blackboard
+            if tree.debug is not silentDebugger:
+                tree.debug(tree, 'tick', target, blackboard)
+            if ctx is None:
+                ctx = TickContext(tree=tree, target=target,
+                    blackboard=blackboard, debug=tree.debug)
+            else:
+                ctx.reset(target, blackboard)
+            status = tree._run(ctx)
+            ret.append((target, status))
+            if status == RUNNING:
+                self._sleep(sleeper, ctx)
+            else:
+                self._awake.add(sleeper)
+        return ret
+
+    def _sleep(self, sleeper, ctx):
+        """
+        Put C{sleeper} to sleep if all its running leaves are, else
+        keep it awake.
+        """
+        sleepers = ctx.sleepers or {}
+        waiters = ctx.waiters or {}
+        wake_time = None
+        events = []
+        for node in ctx.open_nodes:
+            if isinstance(node, _COMPOSITES):
+                continue
+            if node in waiters:
+                events.extend(waiters[node])
+            if node in sleepers:
+                if wake_time is None or sleepers[node] < wake_time:
+                    wake_time = sleepers[node]
+            elif node not in waiters:
+                self._awake.add(sleeper)
+                return
+        if wake_time is None and not events:
+            self._awake.add(sleeper)
+            return
+        if wake_time is not None:
+            sleeper.wake_time = wake_time
+            heapq.heappush(self._timers, (wake_time, sleeper.number, sleeper))
+        if events:
+            sleeper.events = events
+            for event in events:
+                self._waiting.setdefault(event, set()).add(sleeper)
+
+
 def debugPrinter(*args):
+    import termcolor
     print termcolor.colored(' '.join(map(str, args)), attrs=['dark'])
 
 
@@ -1,7 +1,15 @@
-import parsley
+import os
+import re
+import math
+import heapq
+import bisect
+import weakref
+import sys
 import itertools
+import time
+import marshal
 from decimal import Decimal
-from termcolor import colored
+from collections import OrderedDict
 
 grammar = '''
 tchar = letterOrDigit:x ?(x in 'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789_-') -> x
@@ -40,13 +48,6 @@ rule = term:head ws 'if' ws and_list:body -> Rule(head, And(body))
 '''
 
 
-from functools import wraps
-
-call_count = 0
-
-def log(*args):
-    print ' '.join(map(str, args))
-
 def reverseDict(d):
     return {v:k for k,v in d.items()}
 
@@ -72,33 +73,271 @@ def _mergeWithoutOverwriting(a, b):
     return a_copy
 
 
-def logTruthy(method):
-    @wraps(method)
-    def func(self, *args, **kwargs):
-        global call_count
-        call = '{cls}.{method} {self} {args}'.format(
-            cls=self.__class__.__name__,
-            method=method.__name__,
-            self=self,
-            args=args)
-        this_count = call_count
-        call_count += 1
-        print colored('{0}: {1}'.format(this_count, call), 'yellow', attrs=['dark'])
-        r = method(self, *args, **kwargs)
-        ret_string = '{count}: {call}\n  -> {r}'.format(
-            count=this_count, call=call, r=r)
-        if r:
-            print colored(ret_string, 'green')
+class Tracer(object):
+    """
+    I am told what a L{Brain} does while it answers queries.  Give me
+    to a brain as its C{tracer}.
+
+    Each kind of event has a method, which calls L{event} with the
+    event's name and arguments.  Override L{event} to see them all or
+    the other methods to see some of them.
+    """
+
+    def event(self, name, *args):
+        pass
+
+    def goal(self, goal):
+        """
+        C{goal} is about to be proved.
+        """
+        self.event('goal', goal)
+
+    def rule(self, goal, rule):
+        """
+        C{rule}'s head is about to be matched against C{goal}.
+        """
+        self.event('rule', goal, rule)
+
+    def binding(self, goal, rule, bindings):
+        """
+        C{rule}'s head matched C{goal}, binding variables as in the dict
+        C{bindings}.
+        """
+        self.event('binding', goal, rule, bindings)
+
+    def answer(self, goal, answer):
+        """
+        C{goal} was proved with the variable values in C{answer}.
+        """
+        self.event('answer', goal, answer)
+
+    def conflict(self, match, other):
+        """
+        Two answers for parts of a conjunction disagreed.
+        """
+        self.event('conflict', match, other)
+
+
+class RecordingTracer(Tracer):
+    """
+    I keep every event as a tuple of its name and arguments in
+    C{events}.
+    """
+
+    def __init__(self):
+        self.events = []
+
+    def event(self, name, *args):
+        self.events.append((name,) + args)
+
+
+class PrintTracer(Tracer):
+    """
+    I write events to C{stream} (standard out by default) as they
+    happen, in colour if C{color} is C{True}.
+    """
+
+    colors = {
+        'goal': ('white', ['bold']),
+        'rule': (None, ['dark']),
+        'binding': ('green', []),
+        'answer': ('cyan', []),
+        'conflict': ('red', []),
+    }
+
+    def __init__(self, stream=None, color=True):
+        self.stream = stream
+        self.colored = None
+        if color:
+            from termcolor import colored
+            self.colored = colored
+
+    def event(self, name, *args):
+        line = '{0:<9}{1}'.format(name, ' '.join(map(repr, args)))
+        if self.colored is not None:
+            color, attrs = self.colors.get(name, (None, []))
+            line = self.colored(line, color, attrs=attrs)
+        (self.stream or sys.stdout).write(line + '\n')
+
+
+class RuleStats(object):
+    """
+    I am what a L{Profiler} found out about one rule, or about the
+    facts for one predicate.
+
+    @ivar name: The rule, or which facts, as text.
+    @ivar tried: How many times a goal was matched against the head.
+    @ivar unified: How many of those times it matched.
+    @ivar failed: How many of those times it didn't.
+    @ivar conflicts: How many times answers to parts of the body
+        disagreed (see L{Conflict}).
+    @ivar answers: How many answers were given.
+    @ivar seconds: How long was spent finding answers to the body,
+        including the time spent in the rules it used.
+    """
+
+    __slots__ = ('name', 'tried', 'unified', 'failed', 'conflicts',
+                 'answers', 'seconds')
+
+    def __init__(self, name):
+        self.name = name
+        self.tried = 0
+        self.unified = 0
+        self.failed = 0
+        self.conflicts = 0
+        self.answers = 0
+        self.seconds = 0.0
+
+    def __repr__(self):
+        return '<RuleStats {0} tried={1} answers={2} seconds={3:.6f}>'.format(
+            self.name, self.tried, self.answers, self.seconds)
+
+
+class Profiler(object):
+    """
+    I keep a L{RuleStats} for each rule a L{Brain} uses, to find the
+    rules that need reordering or indexing.  Give me to a brain as its
+    C{profiler}:
+
+        brain.profiler = profiler = Profiler()
+        list(brain.query('(murderer, X)'))
+        print profiler.table()
+
+    Facts are counted together for each predicate.  The trail engine
+    only counts tries and unifications, and brains that materialize
+    aren't profiled.
+
+    @ivar stats: A dict of rules (or predicate keys, for facts) to
+        L{RuleStats}.
+    """
+
+    columns = ('tried', 'unified', 'failed', 'conflicts', 'answers',
+               'seconds')
+
+    def __init__(self):
+        self.stats = {}
+        self._current = []
+
+    def rule(self, rule):
+        """
+        Return the L{RuleStats} for a rule, or for the facts of its
+        predicate if it's a fact.
+        """
+        key = predicateKey(rule.head) if isinstance(rule.body, _TRUE) \
+            else rule
+        try:
+            return self.stats[key]
+        except KeyError:
+            pass
+        if key is rule:
+            name = str(rule)
+        elif key is None or key[1] is None:
+            name = 'other facts'
         else:
-            print colored(ret_string, attrs=['dark'])
-        return r
-    return func
+            name = 'facts ({0})'.format(
+                ', '.join([str(key[1])] + ['_'] * (key[0] - 1)))
+        stats = self.stats[key] = RuleStats(name)
+        return stats
+
+    def watch(self, stats, answers):
+        """
+        Generate the answers to a rule's body, counting them and the
+        time spent finding them in C{stats}.
+        """
+        current = self._current
+        clock = time.time
+        answers = iter(answers)
+        while True:
+            current.append(stats)
+            start = clock()
+            try:
+                answer = next(answers)
+            except StopIteration:
+                return
+            finally:
+                stats.seconds += clock() - start
+                current.pop()
+            stats.answers += 1
+            yield answer
+
+    def conflict(self):
+        """
+        Two answers for parts of the body of the rule being proved
+        disagreed.
+        """
+        if self._current:
+            self._current[-1].conflicts += 1
+
+    def reset(self):
+        """
+        Forget everything counted so far.
+        """
+        self.stats.clear()
+
+    def report(self, sort='seconds'):
+        """
+        Return the L{RuleStats}, biggest first by the attribute named
+        C{sort}.
+        """
+        return sorted(self.stats.itervalues(),
+                      key=lambda x: getattr(x, sort), reverse=True)
+
+    def table(self, sort='seconds', limit=None):
+        """
+        Return L{report} as a table of text, one line per rule, with at
+        most C{limit} rules.
+        """
+        lines = ['{0:>9} {1:>9} {2:>9} {3:>9} {4:>9} {5:>9}  {6}'.format(
+            'tried', 'unified', 'failed', 'conflicts', 'answers', 'ms',
+            'rule')]
+        for stats in self.report(sort)[:limit]:
+            lines.append('{0:>9} {1:>9} {2:>9} {3:>9} {4:>9} {5:>9.2f}  '
+                         '{6}'.format(stats.tried, stats.unified,
+                                      stats.failed, stats.conflicts,
+                                      stats.answers, stats.seconds * 1e3,
+                                      stats.name))
+        return '\n'.join(lines)
+
+    def brain(self):
+        """
+        Return a brain that knows a fact like C{(profile, Name, Tried,
+        Unified, Failed, Conflicts, Answers, Microseconds)} for each
+        rule, so the report can be queried.
+        """
+        ret = Brain()
+        ret.addFacts(('profile', x.name, x.tried, x.unified, x.failed,
+                      x.conflicts, x.answers, int(x.seconds * 1e6))
+                     for x in self.stats.itervalues())
+        return ret
 
 
 class Atom(object):
+    """
+    There is only ever one L{Atom} for each value, so atoms can be
+    compared by identity.  Values that are equal share an atom, as
+    numbers of different types with the same value do (C{2}, C{2.0}
+    and C{Decimal('2.0')}, which are all kept as the integer C{2}),
+    and strings and unicode strings with the same text.  C{True} and
+    C{False} have atoms of their own rather than sharing C{1}'s and
+    C{0}'s.  Atoms nothing uses any more are forgotten.
+    """
 
-    def __init__(self, value):
-        self.value = value
+    __slots__ = ('value', '_hash', '__weakref__')
+    ground = True
+    _interned = weakref.WeakValueDictionary()
+
+    def __new__(cls, value):
+        key = (value.__class__ is bool, value)
+        self = Atom._interned.get(key)
+        if self is None:
+            self = object.__new__(cls)
+            self.value = value = _integral(value)
+            self._hash = hash(value)
+            Atom._interned[key] = self
+        return self
+
+    def __reduce__(self):
+        return (Atom, (self.value,))
 
     def __repr__(self):
         return '<{0}>'.format(self.value)
@@ -107,15 +346,13 @@ class Atom(object):
         return repr(self)
 
     def __eq__(self, other):
-        if isinstance(other, Atom):
-            return self.value == other.value
-        return NotImplemented
+        return self is other
 
     def __ne__(self, other):
-        return not(self == other)
+        return self is not other
 
     def __hash__(self):
-        return hash(self.value)
+        return self._hash
 
     def matches(self, other, brain):
         """
@@ -151,9 +388,34 @@ def combineDicts(dicts):
 
 
 class Term(object):
+    """
+    Terms whose arguments are all atoms or ground terms are ground
+    themselves, and there is only ever one ground term of each class
+    with the same arguments, so ground terms can be compared by
+    identity too.
+    """
+
+    __slots__ = ('args', 'ground', '__weakref__')
+    _interned = weakref.WeakValueDictionary()
+
+    def __new__(cls, *args):
+        for arg in args:
+            if not arg.ground:
+                self = object.__new__(cls)
+                self.args = args
+                self.ground = False
+                return self
+        key = (cls,) + args
+        self = Term._interned.get(key)
+        if self is None:
+            self = object.__new__(cls)
+            self.args = args
+            self.ground = True
+            Term._interned[key] = self
+        return self
 
-    def __init__(self, *args):
-        self.args = args
+    def __reduce__(self):
+        return (self.__class__, self.args)
 
     @property
     def arity(self):
@@ -192,6 +454,8 @@ class Term(object):
         the mapping.  Typically, the mapping is something
         returned by my C{match} function.
         """
+        if self.ground:
+            return self
         return self.__class__(*[x.substitute(mapping) for x in self.args])
 
     def query(self, brain):
@@ -205,6 +469,8 @@ class Term(object):
             self.__class__(*[x.convertSpecialTerms(brain) for x in self.args]))
 
     def listVars(self):
+        if self.ground:
+            return []
         ret = []
         for arg in self.args:
             ret.extend(arg.listVars())
@@ -222,6 +488,8 @@ class Term(object):
 
 class Var(object):
 
+    __slots__ = ('name', 'number')
+    ground = False
     count = 0
 
     def __init__(self, name):
@@ -229,6 +497,9 @@ class Var(object):
         Var.count += 1
         self.number = Var.count
 
+    def __reduce__(self):
+        return (Var, (self.name,))
+
     def __repr__(self):
         return '<{0}.{1}>'.format(self.name, self.number)
 
@@ -257,11 +528,42 @@ class Var(object):
 class Conflict(Exception):
     pass
 
+
+class UnsafeRule(Exception):
+    """
+    A rule can't be materialized because facts derived from it would
+    have variables in them.
+    """
+
+
+class Unstratifiable(Exception):
+    """
+    Rules can't be materialized because a predicate depends on its own
+    negation.
+    """
+
+
+class FrozenBrain(Exception):
+    """
+    Something was added to a brain that is the base of other brains.
+    """
+
+
+class InstantiationError(Exception):
+    """
+    A builtin was asked about variables it needs the values of.
+    """
+
 class And(object):
 
+    __slots__ = ('parts',)
+
     def __init__(self, parts):
         self.parts = parts
 
+    def __reduce__(self):
+        return (And, (self.parts,))
+
     def __repr__(self):
         return 'And({0!r})'.format(self.parts)
 
@@ -284,23 +586,56 @@ class And(object):
         """
         Find all the matches for a query.
         """
-        return self._partialQuery(self.parts, brain)
+        parts = self.parts
+        if brain.planning and len(parts) > 1:
+            parts = brain._plan(parts, describeGoal)
+        if brain._columns is not None and brain._base is None:
+            count = brain._factGoals(parts)
+            if count > 1:
+                return self._columnarQuery(parts, count, brain)
+        return self._partialQuery(parts, brain)
+
+    def _columnarQuery(self, parts, count, brain):
+        """
+        Answer the first C{count} goals, which are only answered by
+        facts in the brain's columnar store, all at once, and the rest
+        one answer at a time.
+        """
+        if brain._table_stack:
+            brain._table_stack[-1].deps.update(
+                predicateKey(x) for x in parts[:count])
+        tail = parts[count:]
+        for match in brain._columns.join(parts[:count]).dicts():
+            if tail:
+                mapped_tail = [x.substitute(match) for x in tail]
+                for tail_match in self._partialQuery(mapped_tail, brain):
+                    full_match = dict(match)
+                    full_match.update(tail_match)
+                    yield full_match
+            else:
+                yield match
 
     def _partialQuery(self, args, brain):
         head = args[0]
         tail = args[1:]
-        print 'AND head', head
-        print 'AND tail', tail
-        for match in head.query(brain):
+        ranges = None
+        if tail and head.__class__ is Term:
+            ranges = numberRanges(head, tail)
+        if ranges is None:
+            matches = head.query(brain)
+        else:
+            matches = brain.parsedQuery(head, ranges)
+        for match in matches:
             if tail:
                 mapped_tail = [x.substitute(match) for x in tail]
                 for tail_match in self._partialQuery(mapped_tail, brain):
                     try:
                         full_match = _mergeWithoutOverwriting(match, tail_match)
                     except Conflict:
-                        log('  conflict')
-                        log('  match', match)
-                        log('  tail ', tail_match)
+                        if brain.tracer is not None:
+                            brain.tracer.conflict(match, tail_match)
+                        if brain.profiler is not None:
+                            brain.profiler.conflict()
                         continue
                     yield full_match
             else:
@@ -315,10 +650,15 @@ class And(object):
 
 class Rule(object):
 
+    __slots__ = ('head', 'body', 'matcher', '_variables', '_clause')
+
     def __init__(self, head, body):
         self.head = head
         self.body = body
 
+    def __reduce__(self):
+        return (Rule, (self.head, self.body))
+
     def __repr__(self):
         return 'Rule({0!r}, {1!r})'.format(self.head, self.body)
 
@@ -339,11 +679,178 @@ class Rule(object):
     def listVars(self):
         return self.head.listVars() + self.body.listVars()
 
+    def variables(self):
+        """
+        Return the set of variables used in this rule.
+        """
+        try:
+            return self._variables
+        except AttributeError:
+            self._variables = frozenset(self.listVars())
+            return self._variables
+
+    def rename(self):
+        """
+        Make a copy of myself with brand new variables so that I can
+        be used to answer a query that shares some of my variables.
+        """
+        mapping = {v: Var(v.name) for v in self.variables()}
+        rule = Rule(self.head.substitute(mapping),
+                    self.body.substitute(mapping))
+        rule.compile()
+        return rule
+
+    def compile(self):
+        """
+        Compile my head into C{self.matcher}, a function that takes a
+        query and returns the bindings that unify my head with it (or
+        C{None} if they don't unify).  It's C{None} for ground heads,
+        which are all matched with L{matchGround}.
+        """
+        self.matcher = compileHead(self.head)
+        return self.matcher
+
+#------------------------------------------------------
+# compiled matching
+
+def unify(a, b, bindings):
+    """
+    Unify C{a} with C{b}, adding to C{bindings} (a dict of variables
+    to what they stand for).  When a variable on either side could be
+    bound, the one from C{a} is.
+
+    @return: C{True} if they unify.  If they don't, C{bindings} may
+        have been partly changed.
+    """
+    while a.__class__ is Var and a in bindings:
+        a = bindings[a]
+    while b.__class__ is Var and b in bindings:
+        b = bindings[b]
+    if a is b:
+        return True
+    elif isinstance(a, Var):
+        bindings[a] = b
+        return True
+    elif isinstance(b, Var):
+        bindings[b] = a
+        return True
+    elif isinstance(a, Term) and isinstance(b, Term):
+        if len(a.args) != len(b.args) or (a.ground and b.ground):
+            return False
+        for x, y in zip(a.args, b.args):
+            if not unify(x, y, bindings):
+                return False
+        return True
+    return False
+
+
+def resolve(thing, bindings):
+    """
+    Replace the variables in C{thing} with what they're bound to.
+    """
+    while thing.__class__ is Var:
+        if thing not in bindings:
+            return thing
+        thing = bindings[thing]
+    if isinstance(thing, Term) and thing.args:
+        args = [resolve(x, bindings) for x in thing.args]
+        for new, old in zip(args, thing.args):
+            if new is not old:
+                return thing.__class__(*args)
+    return thing
+
+
+def matchGround(head, query):
+    """
+    Unify a ground C{head} with a query, returning the bindings for the
+    query's variables or C{None} if they don't unify.  Ground terms are
+    interned, so this is mostly identity checks.
+    """
+    if head is query:
+        return {}
+    elif query.__class__ is Var:
+        return {query: head}
+    elif not isinstance(query, Term) or query.ground:
+        return None
+    args = query.args
+    if len(args) != len(head.args):
+        return None
+    bindings = {}
+    for mine, theirs in zip(head.args, args):
+        if mine is not theirs and not theirs.ground:
+            if not unify(theirs, mine, bindings):
+                return None
+        elif mine is not theirs:
+            return None
+    return bindings
+
+
+def compileHead(head):
+    """
+    Make a function that unifies C{head} with a query, checking
+    C{head}'s constant arguments before binding anything.  It returns
+    a dict of bindings for the variables of both C{head} and the query,
+    or C{None} if they don't unify.
+
+    Ground heads don't get a function of their own; use L{matchGround}
+    for them.
+    """
+    if head.ground:
+        return None
+    elif isinstance(head, Term):
+        arity = len(head.args)
+        consts = []
+        others = []
+        for i, arg in enumerate(head.args):
+            if isinstance(arg, Atom):
+                consts.append((i, arg))
+            else:
+                others.append((i, arg))
+        consts = tuple(consts)
+        others = tuple(others)
+
+        def matchTerm(query):
+            if not isinstance(query, Term):
+                if isinstance(query, Var):
+                    return {query: head}
+                return None
+            args = query.args
+            if len(args) != arity:
+                return None
+            unbound = None
+            for i, atom in consts:
+                arg = args[i]
+                if arg is atom:
+                    continue
+                elif isinstance(arg, Var):
+                    if unbound is None:
+                        unbound = []
+                    unbound.append(i)
+                else:
+                    return None
+            bindings = {}
+            if unbound:
+                head_args = head.args
+                for i in unbound:
+                    if not unify(head_args[i], args[i], bindings):
+                        return None
+            for i, arg in others:
+                if not unify(arg, args[i], bindings):
+                    return None
+            return bindings
+        return matchTerm
+
+    def matchVar(query):
+        return {head: query}
+    return matchVar
+
 #------------------------------------------------------
 # special terms
 
 class _TRUE(Term):
 
+    __slots__ = ()
+
     def __str__(self):
         return 'true/0'
 
@@ -358,6 +865,8 @@ class _TRUE(Term):
 
 class SpecialTerm(Term):
 
+    __slots__ = ()
+
     @classmethod
     def createFromTerm(cls, term):
         return cls(*term.args)
@@ -367,124 +876,3046 @@ class Not(SpecialTerm):
     Negate stuff.
     """
 
+    __slots__ = ()
+
     def query(self, brain):
-        gen = brain.parsedQuery(self.args[1])
-        try:
-            gen.next()
-            return
-        except StopIteration:
+        if not brain._provable(self.args[1]):
             yield {}
-        
 
 
-TRUE = _TRUE()
+def _number(thing):
+    """
+    Return the number an atom stands for, or C{None} if it isn't a
+    number.
+    """
+    if thing.__class__ is Atom:
+        value = thing.value
+        if isinstance(value, (int, long, float, Decimal)) and \
+                not isinstance(value, bool):
+            return value
+    return None
 
-grammar_bindings = {
-    'Atom': Atom,
-    'Term': Term,
-    'Var': Var,
-    'Rule': Rule,
-    'And': And,
-    'TRUE': TRUE,
-    'Decimal': Decimal,
-}
-PARSER = parsley.makeGrammar(grammar, grammar_bindings)
 
+def _integral(number):
+    """
+    Return C{number} as an integer if it is a whole number, or as it is
+    if it isn't, so that C{(plus, 1.5, 0.5, X)} binds X to 2.
+    """
+    if isinstance(number, (Decimal, float)):
+        try:
+            whole = int(number)
+        except (ValueError, OverflowError):
+            return number
+        if whole == number:
+            return whole
+    return number
 
-def humanize(d):
-    return {k.humanValue():v.humanValue() for k,v in d.items()}
 
+class Builtin(SpecialTerm):
+    """
+    I am a special term that the brain works out rather than looks up,
+    once enough of my arguments are known.
+
+    @cvar arity: How many arguments I take, counting my name.  Terms
+        with my name and a different number of arguments are left as
+        they are.
+    @cvar binds: Whether I can bind my variables, so that goals that
+        use them should be planned after me.
+    """
 
-class Brain(object):
+    __slots__ = ()
+    arity = None
+    binds = False
 
-    def __init__(self):
-        self._rules = []
-        self._terms = {
-            'not': Not.createFromTerm,
-        }
+    @classmethod
+    def createFromTerm(cls, term):
+        if len(term.args) != cls.arity:
+            return term
+        return cls(*term.args)
 
-    def add(self, rule):
+    def bounds(self, var):
         """
-        Add a fact to this brain.
+        Return the C{(low, high)} bounds I put on the number C{var}
+        stands for, with C{None} for no bound, or C{None} if I don't
+        bound it.  The bounds are inclusive even if I'm not.
         """
-        rule = PARSER(rule).rule()\
-            .normalizeVars()\
-            .convertSpecialTerms(self)
-        self._rules.append(rule)
+        return None
 
-    def addTermType(self, name, constructor):
+    def binding(self, known):
         """
-        Add a special kind of term type by name.
+        Return the set of variables I bind when those in C{known} are
+        already bound, or C{None} if that isn't enough to work me out.
         """
-        self._terms[name] = constructor
+        if known.issuperset(self.listVars()):
+            return set()
+        return None
 
-    def convertToSpecialTerm(self, term):
+    def _numbers(self, *things):
         """
-        Convert a Term to a special Term known to this Brain.
-        """
-        if not term.args:
-            return term
-        first_arg = term.args[0]
-        if isinstance(first_arg, Atom):
-            constructor = self._terms.get(first_arg.value, None)
-            if constructor is not None:
-                return constructor(term)
-        return term
+        Return the numbers C{things} stand for, or C{None} for those
+        that aren't numbers.
 
-    def query(self, query):
-        """
-        Query the brain.
+        @raise InstantiationError: If one of them isn't ground.
         """
-        log('query', query)
-        query = PARSER(query).rule().normalizeVars().head
-        log('parsed -> ', repr(query))
-        for match in self.parsedQuery(query):
-            log(colored('** {0}'.format(humanize(match)), 'cyan'))
-            ret = humanize(match)
-            yield ret
+        for thing in things:
+            if not thing.ground:
+                raise InstantiationError('{0} needs {1} to be known'.format(
+                    self, thing))
+        return [_number(x) for x in things]
 
-    def unique(self, gen):
-        encountered = set()
-        for x in gen:
-            h = hash(tuple(sorted(x.items())))
-            if h in encountered:
-                continue
-            encountered.add(h)
-            yield x
 
-    def parsedQuery(self, query):
-        """
-        Query the brain using an already-parsed-into-python-objects
-        query.
-        """
-        return self.unique(self._parsedQuery(query))
+class _Comparison(Builtin):
 
-    def _parsedQuery(self, query):
-        for rule in self._rules:
-            for mapping in rule.head.matches(query, self):
-                log('\nQUERY', repr(query))
-                log('  MATCHES', repr(rule))
-                log('  FOR', mapping)
-                if isinstance(rule.body, _TRUE):
-                    log('  TRUE', mapping)
-                    ret = reverseDict(mapping)
-                    log('   ret', ret)
-                    yield ret
-                else:
-                    mapped_body = rule.body.substitute(mapping)
-                    log('  MAKING', repr(mapped_body))
-                    for match in mapped_body.query(self):
-                        log(colored('\nQUERY {0!r}'.format(query), attrs=['dark']))
-                        log(colored('  RULE  {0!r}'.format(rule), attrs=['dark']))
-                        log(colored('  BODY  {0!r}'.format(mapped_body), attrs=['dark']))
-                        log(colored('  mapping {0}'.format(mapping), attrs=['dark']))
-                        log('  match  ', match)
-                        rev_map = reverseDict(mapping)
-                        log('  rev    ', rev_map)
-                        
-                        mapped_vars = [x for x in rev_map if isinstance(x, Var)]
-                        ret = {}
-                        for var in mapped_vars:
-                            ret[var] = match.get(var, rev_map[var])
-                        yield ret
+    __slots__ = ()
+    arity = 3
+
+    def query(self, brain):
+        a, b = self._numbers(self.args[1], self.args[2])
+        if a is not None and b is not None and self.compare(a, b):
+            yield {}
+
+    def bounds(self, var):
+        a, b = self.args[1:]
+        if a is var and _number(b) is not None:
+            return self.below(_number(b))
+        elif b is var and _number(a) is not None:
+            return self.above(_number(a))
+        return None
+
+
+class Lt(_Comparison):
+    """
+    C{(lt, A, B)} is true if A is less than B.
+    """
+
+    __slots__ = ()
+
+    def compare(self, a, b):
+        return a < b
 
+    def below(self, b):
+        return (None, b)
+
+    def above(self, a):
+        return (a, None)
+
+
+class Gt(_Comparison):
+    """
+    C{(gt, A, B)} is true if A is greater than B.
+    """
+
+    __slots__ = ()
+
+    def compare(self, a, b):
+        return a > b
+
+    def below(self, b):
+        return (b, None)
+
+    def above(self, a):
+        return (None, a)
+
+
+class Between(Builtin):
+    """
+    C{(between, Low, High, X)} is true if X is a number from Low to
+    High, inclusive.  If X is a variable, it's bound to each integer in
+    that range in turn.
+    """
+
+    __slots__ = ()
+    arity = 4
+    binds = True
+
+    def query(self, brain):
+        low, high = self._numbers(self.args[1], self.args[2])
+        x = self.args[3]
+        if low is None or high is None:
+            return
+        if x.__class__ is Var:
+            # the bounds' atoms may have been made as 1.0 or Decimal('1')
+            for i in xrange(int(math.ceil(low)), int(math.floor(high)) + 1):
+                yield {x: Atom(i)}
+            return
+        value = _number(x)
+        if value is not None and low <= value <= high:
+            yield {}
+
+    def bounds(self, var):
+        low, high, x = self.args[1:]
+        if x is var and _number(low) is not None \
+                and _number(high) is not None:
+            return (_number(low), _number(high))
+        return None
+
+    def binding(self, known):
+        low, high, x = self.args[1:]
+        if not known.issuperset(low.listVars() + high.listVars()):
+            return None
+        return set(x.listVars())
+
+
+class _Arithmetic(Builtin):
+    """
+    I relate three numbers, C{(name, A, B, C)}, and can work out any one
+    of them from the other two.
+    """
+
+    __slots__ = ()
+    arity = 4
+    binds = True
+
+    def binding(self, known):
+        unknown = [x for x in self.args[1:]
+                   if not known.issuperset(x.listVars())]
+        if not unknown:
+            return set()
+        elif len(unknown) == 1 and unknown[0].__class__ is Var:
+            return set(unknown)
+        return None
+
+    def query(self, brain):
+        args = self.args[1:]
+        unknown = None
+        values = []
+        for i, arg in enumerate(args):
+            if arg.__class__ is Var:
+                if unknown is not None:
+                    raise InstantiationError('{0} needs two of its numbers '
+                                             'to be known'.format(self))
+                unknown = i
+                values.append(None)
+            else:
+                value = self._numbers(arg)[0]
+                if value is None:
+                    return
+                values.append(value)
+        a, b, c = values
+        if unknown is None:
+            if self.combine(a, b) == c:
+                yield {}
+            return
+        elif unknown == 2:
+            result = self.combine(a, b)
+        elif unknown == 1:
+            result = self.solve(c, a)
+        else:
+            result = self.solve(c, b)
+        if result is not None:
+            yield {args[unknown]: Atom(_integral(result))}
+
+
+class Plus(_Arithmetic):
+    """
+    C{(plus, A, B, C)} is true if A + B = C.
+    """
+
+    __slots__ = ()
+
+    def combine(self, a, b):
+        return a + b
+
+    def solve(self, c, known):
+        return c - known
+
+
+class Times(_Arithmetic):
+    """
+    C{(times, A, B, C)} is true if A * B = C.  Integers are only divided
+    if the answer is an integer.
+    """
+
+    __slots__ = ()
+
+    def combine(self, a, b):
+        return a * b
+
+    def solve(self, c, known):
+        if known == 0:
+            if c == 0:
+                raise InstantiationError('{0} is true for any number'.format(
+                    self))
+            return None
+        if isinstance(c, (int, long)) and isinstance(known, (int, long)):
+            if c % known:
+                return None
+            return c // known
+        return Decimal(c) / Decimal(known)
+
+
+BUILTINS = {
+    'lt': Lt,
+    'gt': Gt,
+    'between': Between,
+    'plus': Plus,
+    'times': Times,
+}
+
+
+def numberRanges(goal, parts):
+    """
+    Find the bounds the builtins in C{parts} put on the numbers that
+    the variables among C{goal}'s arguments stand for.
+
+    @return: A dict of argument positions to C{(low, high)} bounds, or
+        C{None} if there aren't any.
+    """
+    ranges = None
+    for part in parts:
+        if not isinstance(part, Builtin):
+            continue
+        for i, arg in enumerate(goal.args):
+            if arg.__class__ is not Var:
+                continue
+            bounds = part.bounds(arg)
+            if bounds is None:
+                continue
+            if ranges is None:
+                ranges = {}
+            low, high = ranges.get(i, (None, None))
+            if bounds[0] is not None and (low is None or bounds[0] > low):
+                low = bounds[0]
+            if bounds[1] is not None and (high is None or bounds[1] < high):
+                high = bounds[1]
+            ranges[i] = (low, high)
+    return ranges
+
+
+TRUE = _TRUE()
+
+grammar_bindings = {
+    'Atom': Atom,
+    'Term': Term,
+    'Var': Var,
+    'Rule': Rule,
+    'And': And,
+    'TRUE': TRUE,
+    'Decimal': Decimal,
+}
+
+
+def parserCacheDir():
+    """
+    Return the directory compiled grammars are kept in: C{$PROLLY_CACHE}
+    or C{~/.cache/prolly}.
+    """
+    return os.environ.get('PROLLY_CACHE') or \
+        os.path.join(os.path.expanduser('~'), '.cache', 'prolly')
+
+
+def compileGrammar(source, bindings, cache_dir=None):
+    """
+    Make a Parsley parser for a grammar.  The Python code Parsley
+    generates for the grammar (which takes much longer than anything
+    else) is kept in C{cache_dir} and used again by later processes
+    with the same grammar and versions of Python and Parsley.  If the
+    cache can't be read or written, the code is generated each time.
+
+    @param cache_dir: The directory to keep the code in.  Defaults to
+        L{parserCacheDir}.
+    """
+    import hashlib
+    import parsley
+    from ometa.runtime import OMetaBase
+    if cache_dir is None:
+        cache_dir = parserCacheDir()
+    key = hashlib.sha1('\0'.join([source, parsley.__version__,
+                                  sys.version])).hexdigest()
+    path = os.path.join(cache_dir, 'grammar-{0}.code'.format(key))
+    try:
+        with open(path, 'rb') as f:
+            code = marshal.load(f)
+    except (IOError, EOFError, ValueError, TypeError):
+        code = None
+    if code is None:
+        from ometa.grammar import OMeta
+        from ometa.builder import writePython
+        tree = OMeta(source).parseGrammar('Grammar')
+        code = compile(writePython(tree, source), '<grammar>', 'exec')
+        try:
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir)
+            tmp = '{0}.{1}'.format(path, os.getpid())
+            with open(tmp, 'wb') as f:
+                marshal.dump(code, f)
+            os.rename(tmp, path)
+        except (IOError, OSError):
+            pass
+    namespace = {}
+    exec code in namespace
+    return parsley.wrapGrammar(
+        namespace['createParserClass'](OMetaBase, bindings))
+
+
+class _LazyParser(object):
+    """
+    I am L{PARSER}.  The grammar is only compiled (see
+    L{compileGrammar}) the first time I'm called, so that processes
+    that never parse anything don't have to.
+    """
+
+    def __init__(self, source, bindings):
+        self.source = source
+        self.bindings = bindings
+        self._parser = None
+
+    def __call__(self, text):
+        parser = self._parser
+        if parser is None:
+            parser = self._parser = compileGrammar(self.source, self.bindings)
+        return parser(text)
+
+
+PARSER = _LazyParser(grammar, grammar_bindings)
+
+
+def humanize(d):
+    return {k.humanValue():v.humanValue() for k,v in d.items()}
+
+
+def dehumanize(value):
+    """
+    Do the opposite of C{humanValue}: turn a string or number into an
+    L{Atom} and a tuple into a L{Term}.  Atoms and terms are returned
+    as they are.
+    """
+    if isinstance(value, (Atom, Term, Var)):
+        return value
+    elif isinstance(value, (tuple, list)):
+        return Term(*[dehumanize(x) for x in value])
+    return Atom(value)
+
+
+_FACT_TOKENS = re.compile(
+    r'\(|\)| *, *|-?(?:[1-9][0-9]*|0)(?:\.[0-9]*)?|[a-z][a-zA-Z0-9]*|.')
+
+
+def _factAtom(token):
+    if token[0] in '-0123456789':
+        if '.' in token:
+            return Atom(Decimal(token))
+        return Atom(int(token))
+    return Atom(token)
+
+
+def parseFact(line, special=()):
+    """
+    Parse a ground term like C{(parent, mary, (child, 2))} without the
+    grammar.
+
+    @param special: Names of special term types.  Terms starting with
+        one of these need the L{Brain} to convert them.
+
+    @return: A L{Term}, or C{None} if C{line} is anything else (a rule,
+        something with variables or a syntax error), in which case it
+        should be given to L{PARSER}.
+    """
+    stack = []
+    args = None
+    want_arg = True
+    ret = None
+    for token in _FACT_TOKENS.findall(line):
+        if ret is not None:
+            return None
+        elif token == '(':
+            if not want_arg:
+                return None
+            stack.append(args)
+            args = []
+        elif token == ')':
+            if args is None or (want_arg and args):
+                return None
+            if args and isinstance(args[0], Atom) and args[0].value in special:
+                return None
+            term = Term(*args)
+            args = stack.pop()
+            if args is None:
+                ret = term
+            else:
+                args.append(term)
+            want_arg = False
+        elif token.strip() == ',':
+            if want_arg or args is None:
+                return None
+            want_arg = True
+        elif want_arg and args is not None and (
+                token[0].islower() or token[0].isdigit() or
+                (token[0] == '-' and len(token) > 1)):
+            args.append(_factAtom(token))
+            want_arg = False
+        else:
+            return None
+    return ret
+
+
+class LRUCache(object):
+    """
+    I remember up to C{size} things, forgetting the least recently used
+    ones first.
+
+    @param evicted: A function to call with the key and value of each
+        thing I forget to make room, or C{None}.
+    """
+
+    def __init__(self, size, evicted=None):
+        self.size = size
+        self.evicted = evicted
+        self._data = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        try:
+            value = self._data.pop(key)
+        except KeyError:
+            return default
+        self._data[key] = value
+        return value
+
+    def __setitem__(self, key, value):
+        self._data.pop(key, None)
+        self._data[key] = value
+        while len(self._data) > self.size:
+            old = self._data.popitem(last=False)
+            if self.evicted is not None:
+                self.evicted(*old)
+
+    def pop(self, key, default=None):
+        return self._data.pop(key, default)
+
+    def clear(self):
+        self._data.clear()
+
+    def keys(self):
+        return self._data.keys()
+
+
+class PreparedQuery(object):
+    """
+    I am a query that has already been parsed.  Call me with values for
+    some of my variables (by name) to get the answers for the rest.
+
+        q = brain.prepare('(parent, P, C)')
+        q(P='mary')
+    """
+
+    def __init__(self, brain, query):
+        self.brain = brain
+        self.query = query
+        self.vars = uniqueVars(query)
+        self._by_name = {v.name: v for v in self.vars}
+
+    def __call__(self, **params):
+        mapping = {}
+        for name, value in params.items():
+            try:
+                var = self._by_name[name]
+            except KeyError:
+                raise TypeError('{0} is not a variable in {1}'.format(
+                    name, self.query))
+            mapping[var] = dehumanize(value)
+        query = self.query.substitute(mapping)
+        return self.brain._humanAnswers(query,
+            [v for v in self.vars if v not in mapping])
+
+
+class QueryTask(object):
+    """
+    I am a query answered a slice at a time, so that a long search can
+    be spread over several game ticks.
+
+        task = brain.start('(path, home, X)')
+        while not task.done:
+            answers = task.run(steps=500)
+
+    A step is trying one rule or fact against a goal.  Special terms
+    and tabled goals are answered by the brain all at once, so each of
+    their answers counts as one step however long it took to find;
+    brains that materialize count a step per answer.
+
+    @ivar done: C{True} once every answer has been found.
+    @ivar steps: How many steps I've taken so far.
+    """
+
+    chunk = 100
+
+    def __init__(self, brain, query):
+        self.brain = brain
+        self.query = query
+        self.query_vars = uniqueVars(query)
+        self.done = False
+        self.steps = 0
+        self._seen = AnswerSet()
+        if brain._materialized is None and not (
+                brain.tabling and brain._isTabled(query)):
+            self._machine = _Machine(brain, query)
+            self._answers = self._machine.answers()
+        else:
+            self._machine = None
+            self._answers = iter(brain.parsedQuery(query))
+
+    def run(self, steps=None, seconds=None):
+        """
+        Look for more answers until I've taken C{steps} more steps,
+        C{seconds} have passed or there are no more answers.  Without
+        either limit I run to the end.  The clock is only checked
+        every L{chunk} steps.
+
+        @return: A list of the answers found, as dicts like those
+            L{Brain.query} generates.
+        """
+        found = []
+        if self.done:
+            return found
+        stop = None if steps is None else self.steps + steps
+        deadline = None if seconds is None else time.time() + seconds
+        machine = self._machine
+        while True:
+            if machine is not None:
+                limit = stop
+                if deadline is not None:
+                    limit = self.steps + self.chunk
+                    if stop is not None:
+                        limit = min(limit, stop)
+                machine.limit = limit
+            try:
+                answer = next(self._answers)
+            except StopIteration:
+                self.done = True
+                break
+            if machine is None:
+                self.steps += 1
+            else:
+                self.steps = machine.steps
+            if answer is not _PAUSE:
+                self._keep(answer, found)
+            if stop is not None and self.steps >= stop:
+                break
+            if deadline is not None and time.time() >= deadline:
+                break
+        return found
+
+    def _keep(self, answer, found):
+        if not self._seen.add(tuple([answer.get(v, v)
+                                     for v in self.query_vars])):
+            return
+        ret = {}
+        for var in self.query_vars:
+            if var in answer:
+                ret[var.humanValue()] = answer[var].humanValue()
+        found.append(ret)
+
+    def cooperate(self, steps=100, cooperator=None):
+        """
+        Find the rest of the answers C{steps} at a time, letting the
+        reactor get on with other things between slices.  This is
+        handy in a behavior tree L{Action}, which may return a
+        L{Deferred}.
+
+        @param cooperator: The L{twisted.internet.task.Cooperator} to
+            schedule the slices with.  Defaults to Twisted's global one.
+
+        @return: A L{Deferred} that fires with a list of the answers.
+        """
+        from twisted.internet import task
+        if cooperator is None:
+            cooperator = task
+        found = []
+
+        def slices():
+            while not self.done:
+                found.extend(self.run(steps=steps))
+                yield
+        d = cooperator.cooperate(slices()).whenDone()
+        return d.addCallback(lambda ignored: found)
+
+
+class Subscription(object):
+    """
+    I am a query whose answers a L{Brain} keeps up to date, telling a
+    callback which answers appeared and which disappeared after rules
+    or facts are added or retracted.
+
+        def changed(added, removed):
+            ...
+        subscription = brain.subscribe('(hungry, X)', changed)
+
+    Changes are collected as they are made and the callback is called
+    once for all of them when the brain is flushed (see
+    L{Brain.flushSubscriptions}), which L{Brain.addFacts} and
+    L{Brain.load} do when they finish.  Only changes to predicates the
+    query depends on (by the brain's graph of which predicates are
+    derived from which) are collected.
+
+    If only facts changed, and the query depends on them only through
+    rules without a C{not} that don't depend on themselves, the
+    answers that might have appeared or disappeared are found from the
+    changed facts alone (see L{Brain._deltaAnswers}), and are checked
+    one by one if any fact was retracted.  Otherwise the whole query is
+    asked again.
+
+    @ivar answers: The answers as of the last flush, as dicts like those
+        L{Brain.query} generates.
+    """
+
+    def __init__(self, brain, query, callback):
+        self.brain = brain
+        self.query = query
+        self.callback = callback
+        self.answers = []
+        self._vars = uniqueVars(query)
+        self._answers = OrderedDict()
+        self._incremental = False
+        self._stale = False
+        self._added = []
+        self._candidates = {}
+        self._retracted = False
+
+    def _values(self, match):
+        return tuple([match.get(v, v) for v in self._vars])
+
+    def _human(self, values):
+        ret = {}
+        for var, value in zip(self._vars, values):
+            if value is not var:
+                ret[var.humanValue()] = value.humanValue()
+        return ret
+
+    def _changed(self, rules, retracting=False):
+        """
+        Note that some already-parsed L{Rule}s, which might change my
+        answers, are being added or retracted.  Retracted facts must be
+        given before they are gone.
+        """
+        if self._stale:
+            return
+        if not self._incremental or not all(
+                isinstance(x.body, _TRUE) and x.head.ground for x in rules):
+            self._stale = True
+            return
+        if not retracting:
+            self._added.extend(x.head for x in rules)
+            return
+        self._retracted = True
+        for rule in rules:
+            for match in self.brain._deltaAnswers(self.query, rule.head):
+                values = self._values(match)
+                self._candidates[AnswerSet.key(values)] = values
+
+    def flush(self):
+        """
+        Tell the callback how my answers have changed since the last
+        flush, if they have.
+        """
+        if self._stale:
+            self.refresh()
+        elif self._added or self._candidates:
+            self._update()
+
+    def refresh(self):
+        """
+        Ask the query again and call the callback if the answers
+        changed.
+        """
+        brain = self.brain
+        answers = OrderedDict()
+        for match in brain.parsedQuery(self.query):
+            values = self._values(match)
+            answers[AnswerSet.key(values)] = self._human(values)
+        old = self._answers
+        added = [x for key, x in answers.items() if key not in old]
+        removed = [x for key, x in old.items() if key not in answers]
+        self._answers = answers
+        self.answers = answers.values()
+        self._incremental = brain._incremental(self.query)
+        self._stale = False
+        self._added = []
+        self._candidates = {}
+        self._retracted = False
+        if added or removed:
+            self.callback(added, removed)
+
+    def _update(self):
+        """
+        Work out how my answers have changed from the facts added and
+        retracted since the last flush.
+        """
+        brain = self.brain
+        candidates = self._candidates
+        for fact in self._added:
+            for match in brain._deltaAnswers(self.query, fact):
+                values = self._values(match)
+                key = AnswerSet.key(values)
+                if key not in self._answers:
+                    candidates[key] = values
+        if self._retracted:
+            if not all(x.ground for values in candidates.values()
+                       for x in values):
+                self.refresh()
+                return
+            found = {}
+            for key, values in candidates.items():
+                goal = self.query.substitute(dict(zip(self._vars, values)))
+                for match in brain.parsedQuery(goal):
+                    found[key] = values
+                    break
+        else:
+            found = candidates
+        added = []
+        removed = []
+        for key, values in candidates.items():
+            if key in found and key not in self._answers:
+                self._answers[key] = answer = self._human(values)
+                added.append(answer)
+            elif key not in found and key in self._answers:
+                removed.append(self._answers.pop(key))
+        self._added = []
+        self._candidates = {}
+        self._retracted = False
+        self.answers = self._answers.values()
+        if added or removed:
+            self.callback(added, removed)
+
+    def cancel(self):
+        """
+        Stop keeping my answers up to date.
+        """
+        self.brain._subscriptions.remove(self)
+
+#------------------------------------------------------
+# indexing
+
+_ANY = object()
+_VAR_HEADS = ('var',)
+
+
+class RuleIndex(object):
+    """
+    I find the rules whose heads might match a query so that the
+    L{Brain} doesn't have to try every rule it knows.
+
+    Rules are identified by the order in which they were added.  A
+    L{Term} head is filed under its arity and then, for each argument
+    position, under what is at that position: an atom value, a nested
+    term of some arity or a variable (which could match anything).
+    """
+
+    def __init__(self):
+        self._postings = {}
+        self._count = 0
+        self._numbers = {}
+        self._removed = set()
+
+    def __len__(self):
+        return self._count - len(self._removed)
+
+    def _post(self, key, rule_id):
+        try:
+            self._postings[key].append(rule_id)
+        except KeyError:
+            self._postings[key] = [rule_id]
+
+    def add(self, rule_id, head):
+        """
+        File a rule's head.  Rules must be added in order.
+        """
+        self._count = rule_id + 1
+        if isinstance(head, Term):
+            arity = len(head.args)
+            self._post(('arity', arity), rule_id)
+            for i, arg in enumerate(head.args):
+                self._post((arity, i, self.argKey(arg)), rule_id)
+            if self._numbers:
+                self._noteNumbers(rule_id, head)
+        elif isinstance(head, Atom):
+            self._post(('atom', head), rule_id)
+        else:
+            self._post(_VAR_HEADS, rule_id)
+
+    def extend(self, start, heads):
+        """
+        File the heads of many rules at once, the first of which has id
+        C{start}.
+        """
+        postings = {}
+        for rule_id, head in enumerate(heads, start):
+            for key in self.keys(head):
+                try:
+                    postings[key].append(rule_id)
+                except KeyError:
+                    postings[key] = [rule_id]
+            if self._numbers and isinstance(head, Term):
+                self._noteNumbers(rule_id, head)
+            self._count = rule_id + 1
+        for key, rule_ids in postings.iteritems():
+            try:
+                self._postings[key].extend(rule_ids)
+            except KeyError:
+                self._postings[key] = rule_ids
+
+    def keys(self, head):
+        """
+        Return the keys a rule's head is filed under.
+        """
+        if isinstance(head, Term):
+            arity = len(head.args)
+            keys = [('arity', arity)]
+            for i, arg in enumerate(head.args):
+                keys.append((arity, i, self.argKey(arg)))
+            return keys
+        elif isinstance(head, Atom):
+            return [('atom', head)]
+        return [_VAR_HEADS]
+
+    def remove(self, rule_id, head):
+        """
+        Stop finding a rule.  Its id isn't used again.
+        """
+        for key in self.keys(head):
+            rule_ids = self._postings[key]
+            i = bisect.bisect_left(rule_ids, rule_id)
+            if i < len(rule_ids) and rule_ids[i] == rule_id:
+                del rule_ids[i]
+        self._removed.add(rule_id)
+        self._numbers = {}
+
+    def argKey(self, arg):
+        """
+        Return the key an argument is filed under, or C{_ANY} for
+        a variable.
+        """
+        if isinstance(arg, Atom):
+            return arg
+        elif isinstance(arg, Term):
+            return ('term', len(arg.args))
+        return _ANY
+
+    def _noteNumbers(self, rule_id, head):
+        """
+        Add a head's numbers to the number columns that have been made
+        for its arity.
+        """
+        arity = len(head.args)
+        for i, arg in enumerate(head.args):
+            column = self._numbers.get((arity, i))
+            if column is not None:
+                value = _number(arg)
+                if value is not None:
+                    column.pending.append((value, rule_id))
+
+    def _numberColumn(self, arity, i):
+        """
+        Return the L{_NumberColumn} of the numbers at position C{i} of
+        heads with C{arity} arguments, making it the first time.
+        """
+        column = self._numbers.get((arity, i))
+        if column is None:
+            column = self._numbers[(arity, i)] = _NumberColumn()
+            for key in self._postings.iterkeys():
+                if len(key) == 3 and key[0] == arity and key[1] == i:
+                    value = _number(key[2])
+                    if value is not None:
+                        column.pending.extend(
+                            (value, x) for x in self._postings[key])
+        return column
+
+    def rangeIds(self, arity, i, low, high, limit=None):
+        """
+        Return, in order, the ids of the rules whose heads have
+        C{arity} arguments and a number from C{low} to C{high} at
+        position C{i}.  Either bound may be C{None}.
+
+        @param limit: If there are at least this many, return C{None}
+            instead.
+        """
+        column = self._numberColumn(arity, i)
+        values = column.values()
+        start = 0 if low is None else bisect.bisect_left(values, low)
+        end = len(values) if high is None else \
+            bisect.bisect_right(values, high)
+        if limit is not None and end - start >= limit:
+            return None
+        return sorted(column.ids[start:end])
+
+    def candidates(self, query, ranges=None):
+        """
+        Generate, in the order they were added, the ids of the rules
+        whose heads might match C{query}.
+        """
+        if isinstance(query, Term):
+            return self.termCandidates(len(query.args), query.args, ranges)
+        elif isinstance(query, Atom):
+            postings = self._postings
+            return self._merge([postings.get(('atom', query), []),
+                                postings.get(_VAR_HEADS, [])])
+        elif self._removed:
+            removed = self._removed
+            return (x for x in xrange(self._count) if x not in removed)
+        return iter(xrange(self._count))
+
+    def termCandidates(self, arity, args, ranges=None):
+        """
+        Generate, in the order they were added, the ids of the rules
+        whose heads might match a term with the given C{args}.
+
+        @param ranges: A dict of argument positions to C{(low, high)}
+            bounds on the numbers there.  If it's cheaper, the rules
+            are found by a scan of the numbers in those bounds.  Rules
+            with something other than a number there are left out.
+        """
+        postings = self._postings
+        best = [postings.get(('arity', arity), [])]
+        best_len = len(best[0])
+        for i, arg in enumerate(args):
+            key = self.argKey(arg)
+            if key is _ANY:
+                continue
+            exact = postings.get((arity, i, key), [])
+            anything = postings.get((arity, i, _ANY), [])
+            if len(exact) + len(anything) < best_len:
+                best = [exact, anything]
+                best_len = len(exact) + len(anything)
+        if ranges and best_len:
+            for i, (low, high) in ranges.iteritems():
+                anything = postings.get((arity, i, _ANY), [])
+                exact = self.rangeIds(arity, i, low, high,
+                                      best_len - len(anything))
+                if exact is not None:
+                    best = [exact, anything]
+                    best_len = len(exact) + len(anything)
+        return self._merge(best + [postings.get(_VAR_HEADS, [])])
+
+    def _merge(self, lists):
+        lists = [x for x in lists if x]
+        if len(lists) == 1:
+            return iter(lists[0])
+        return heapq.merge(*lists)
+
+
+class _NumberColumn(object):
+    """
+    I hold the numbers at one argument position of a L{RuleIndex}'s
+    heads, in order, with the id of the rule each came from.
+    """
+
+    def __init__(self):
+        self._values = []
+        self.ids = []
+        self.pending = []
+
+    def values(self):
+        if self.pending:
+            pairs = sorted(zip(self._values, self.ids) + self.pending)
+            self._values = [x[0] for x in pairs]
+            self.ids = [x[1] for x in pairs]
+            self.pending = []
+        return self._values
+
+#------------------------------------------------------
+# tabling
+
+def predicateKey(term):
+    """
+    Return the C{(arity, functor)} of a term, where the functor is the
+    value of the first argument or C{None} if that isn't an atom.
+    Return C{None} for things that aren't terms.
+    """
+    if not isinstance(term, Term):
+        return None
+    functor = None
+    if term.args and isinstance(term.args[0], Atom):
+        functor = term.args[0].value
+    return (len(term.args), functor)
+
+
+def keysOverlap(a, b):
+    """
+    Return C{True} if terms with predicate keys C{a} and C{b} might
+    match each other.
+    """
+    if a is None or b is None:
+        return True
+    return a[0] == b[0] and (a[1] is None or b[1] is None or a[1] == b[1])
+
+
+def bodyKeys(rule):
+    """
+    Return the predicate keys of the goals in a rule's body that might
+    be answered by rules, and of those under a C{not}.  Other special
+    terms are left out.
+
+    @return: A C{(reads, negates)} pair of lists.
+    """
+    reads = []
+    negates = []
+    for goal in rule.body.parts:
+        negated = False
+        while isinstance(goal, Not):
+            goal = goal.args[1]
+            negated = True
+        if negated:
+            negates.append(predicateKey(goal))
+        elif not isinstance(goal, SpecialTerm):
+            reads.append(predicateKey(goal))
+    return reads, negates
+
+
+def variantKey(thing, numbers=None):
+    """
+    Return a hashable key that is the same for any two terms that are
+    the same except for the names of their variables.
+    """
+    if numbers is None:
+        numbers = {}
+    if isinstance(thing, Atom) or thing.ground:
+        return thing
+    elif isinstance(thing, Var):
+        return ('v', numbers.setdefault(thing, len(numbers)))
+    return ('t',) + tuple(variantKey(x, numbers) for x in thing.args)
+
+
+def ruleKey(rule):
+    """
+    Return a hashable key that is the same for any two rules that are
+    the same except for the names of their variables.
+    """
+    numbers = {}
+    head = variantKey(rule.head, numbers)
+    if isinstance(rule.body, _TRUE):
+        return head, ()
+    return head, tuple(variantKey(x, numbers) for x in rule.body.parts)
+
+
+def uniqueVars(term):
+    """
+    List the variables in a term in the order they first appear.
+    """
+    seen = set()
+    ret = []
+    for v in term.listVars():
+        if v not in seen:
+            seen.add(v)
+            ret.append(v)
+    return ret
+
+
+class _Table(object):
+    """
+    I hold the answers found so far for a tabled goal (and all its
+    variants).
+
+    @ivar vars: The variables of the goal, in order.  Each answer is a
+        tuple of values for these variables.
+    @ivar deps: The predicate keys the answers depend on.
+    @ivar complete: C{True} once every answer has been found.
+    @ivar evaluating: C{True} while the goal is being evaluated.
+    @ivar depth: Where I am on the brain's table stack while evaluating.
+    @ivar low: The lowest stack depth of any table I read from while it
+        was still being evaluated.  If this is below my own depth,
+        I'm part of a recursive cluster led by that table and can't
+        be complete until it is.
+    """
+
+    def __init__(self, goal):
+        self.goal = goal
+        self.vars = uniqueVars(goal)
+        self.answers = []
+        self.seen = AnswerSet()
+        self.deps = set()
+        self.complete = False
+        self.evaluating = False
+        self.depth = None
+        self.low = None
+        self.epoch = None
+
+    def addAnswer(self, match):
+        """
+        Record an answer from a mapping of my variables.
+
+        @return: C{True} if the answer is new.
+        """
+        values = tuple([match.get(v, v) for v in self.vars])
+        if not self.seen.add(values):
+            return False
+        self.answers.append(values)
+        return True
+
+
+class AnswerSet(object):
+    """
+    I remember answers given as tuples of values for some variables in
+    a fixed order.  Ground values are interned, so checking an answer
+    hashes one tuple of them without sorting anything.
+
+    Answers with values that aren't ground are kept as their
+    L{variantKey}s, with the variables numbered across the whole
+    answer, so answers that differ only in the names of their unbound
+    variables are the same.
+    """
+
+    def __init__(self):
+        self._seen = set()
+
+    def __len__(self):
+        return len(self._seen)
+
+    def add(self, values):
+        """
+        Remember an answer.
+
+        @return: C{True} if it's new.
+        """
+        for value in values:
+            if not value.ground:
+                numbers = {}
+                values = tuple([variantKey(x, numbers) for x in values])
+                break
+        if values in self._seen:
+            return False
+        self._seen.add(values)
+        return True
+
+    @staticmethod
+    def key(values):
+        """
+        Return the key an answer is remembered under.
+        """
+        for value in values:
+            if not value.ground:
+                numbers = {}
+                return tuple([variantKey(x, numbers) for x in values])
+        return values
+
+
+#------------------------------------------------------
+# planning
+
+class PredicateStats(object):
+    """
+    I count the clauses for one predicate and the different values at
+    each of its argument positions, so that a planner can guess how
+    many answers a goal will have.
+
+    Rules (clauses with a body) count as C{rule_weight} facts, since
+    there's no telling how many answers they give.
+    """
+
+    rule_weight = 10
+
+    def __init__(self, arity):
+        self.facts = 0
+        self.rules = 0
+        self.distinct = [set() for i in xrange(arity)]
+
+    def add(self, rule):
+        if isinstance(rule.body, _TRUE):
+            self.facts += 1
+        else:
+            self.rules += 1
+        for values, arg in zip(self.distinct, rule.head.args):
+            values.add(arg if arg.ground else _ANY)
+
+    def remove(self, rule):
+        """
+        Stop counting a clause.  Its values are still counted, since
+        other clauses might have them too.
+        """
+        if isinstance(rule.body, _TRUE):
+            self.facts -= 1
+        else:
+            self.rules -= 1
+
+    def estimate(self, bound):
+        """
+        Guess how many answers a goal will have.
+
+        @param bound: A list saying for each argument position whether
+            the goal has a value there.
+        """
+        cost = float(self.facts + self.rule_weight * self.rules)
+        for values, is_bound in zip(self.distinct[1:], bound[1:]):
+            if is_bound and values:
+                cost /= len(values)
+        return cost
+
+
+def describeGoal(goal):
+    """
+    Describe a goal for L{Brain._plan}: return its predicate key,
+    whether it is a special term and the set of variables in each of
+    its arguments.
+    """
+    if isinstance(goal, Term):
+        return (predicateKey(goal), isinstance(goal, SpecialTerm),
+                [set(x.listVars()) for x in goal.args])
+    return None, False, [set(goal.listVars())]
+
+#------------------------------------------------------
+# materialization
+
+class _Relation(object):
+    """
+    I hold the materialized facts for one predicate key, with the
+    stratum each was derived in (-1 for facts that were added).
+    """
+
+    def __init__(self):
+        self.facts = []
+        self.index = RuleIndex()
+        self.levels = {}
+        self.top = -1
+
+    def add(self, fact, level):
+        self.index.add(len(self.facts), fact)
+        self.facts.append(fact)
+        self.levels[fact] = level
+        self.top = max(self.top, level)
+
+    def candidates(self, goal):
+        return itertools.imap(self.facts.__getitem__,
+                              self.index.candidates(goal))
+
+    def forget(self, level):
+        """
+        Forget the facts derived in stratum C{level} or above.
+        """
+        if self.top < level:
+            return
+        self.top = level - 1
+        facts = [x for x in self.facts if self.levels[x] < level]
+        if len(facts) == len(self.facts):
+            return
+        self.facts = facts
+        self.index = RuleIndex()
+        self.index.extend(0, facts)
+        self.levels = {x: self.levels[x] for x in facts}
+
+
+class _DerivationRule(object):
+    """
+    A rule with a body, as used by a L{Materializer}.
+
+    @ivar goals: The parts of the body.
+    @ivar positive: The indexes of the goals that are looked up in the
+        materialized facts.
+    @ivar reads: The predicate keys of the positive goals.
+    @ivar negates: The predicate keys of the C{not} goals' terms.
+    @ivar level: The rule's stratum.
+    """
+
+    def __init__(self, rule):
+        self.rule = rule
+        self.head = rule.head
+        self.goals = list(rule.body.parts)
+        self.positive = []
+        self.reads = []
+        self.negates = []
+        self.level = 0
+        bound = set()
+        builtins = []
+        for i, goal in enumerate(self.goals):
+            if isinstance(goal, Not):
+                self.negates.append(predicateKey(goal.args[1]))
+                continue
+            elif isinstance(goal, Builtin):
+                builtins.append(goal)
+                continue
+            if not isinstance(goal, SpecialTerm):
+                self.positive.append(i)
+                self.reads.append(predicateKey(goal))
+            # other special terms are trusted to bind their variables
+            bound.update(goal.listVars())
+        # builtins bind their variables once enough of them are bound
+        while builtins:
+            for goal in builtins:
+                binds = goal.binding(bound)
+                if binds is not None:
+                    bound.update(binds)
+                    builtins.remove(goal)
+                    break
+            else:
+                raise UnsafeRule('{0} has a {1} goal that too few of the '
+                                 'variables of are bound by other goals'
+                                 .format(rule, builtins[0].args[0].value))
+        if not bound.issuperset(self.head.listVars()):
+            raise UnsafeRule('{0} has variables in its head that no goal '
+                             'in its body binds'.format(rule))
+
+
+def stratify(rules):
+    """
+    Work out which stratum each of some L{_DerivationRule}s belongs in:
+    a rule must be in a stratum at least as high as the rules whose
+    heads its goals might match, and higher than the rules whose heads
+    its C{not} goals might match.  Rules with C{not} goals are never in
+    the bottom stratum, so that adding facts they ask about doesn't
+    mean deriving the bottom stratum again.
+
+    @return: A list of the strata, in the same order as C{rules}.
+    @raise Unstratifiable: If a rule depends on its own negation.
+    """
+    deps = []
+    for rule in rules:
+        mine = []
+        for j, other in enumerate(rules):
+            key = predicateKey(other.head)
+            if any(keysOverlap(key, x) for x in rule.reads):
+                mine.append((j, 0))
+            if any(keysOverlap(key, x) for x in rule.negates):
+                mine.append((j, 1))
+        deps.append(mine)
+    levels = [1 if x.negates else 0 for x in rules]
+    changed = True
+    while changed:
+        changed = False
+        for i, mine in enumerate(deps):
+            for j, negative in mine:
+                level = levels[j] + negative
+                if level > levels[i]:
+                    if level > len(rules) + 1:
+                        raise Unstratifiable('{0} depends on its own '
+                                             'negation'.format(rules[i].rule))
+                    levels[i] = level
+                    changed = True
+    return levels
+
+
+class Materializer(object):
+    """
+    I hold every fact that can be derived from a L{Brain}'s rules, so
+    that queries can be answered by looking them up.
+
+    The rules are split into strata so that the facts a C{not} asks
+    about are all derived before the rules that ask.  The facts for
+    each stratum are found by semi-naive evaluation: after a first
+    pass, rules are only tried with at least one goal matched by a fact
+    found in the pass before.  New facts and rules are dealt with the
+    same way, starting from what they add.  If they change something
+    a C{not} asks about, everything from the stratum of the rule that
+    asks is derived again.
+
+    Rules that build terms can go on deriving bigger and bigger terms
+    forever.
+    """
+
+    def __init__(self, brain):
+        self.brain = brain
+        self.relations = {}
+        self.rules = []
+
+    def add(self, rules):
+        """
+        Derive what follows from some new L{Rule}s.
+
+        @raise UnsafeRule: If a fact has variables or a rule could
+            derive a fact with variables.
+        @raise Unstratifiable: If a rule depends on its own negation.
+            In both cases, and if deriving raises anything else, nothing
+            is added.
+        """
+        facts = []
+        new_rules = []
+        for rule in rules:
+            if isinstance(rule.body, _TRUE):
+                if not rule.head.ground:
+                    raise UnsafeRule('{0} has variables'.format(rule))
+                facts.append(rule.head)
+            else:
+                new_rules.append(_DerivationRule(rule))
+        restratify = False
+        if new_rules:
+            all_rules = self.rules + new_rules
+            levels = stratify(all_rules)
+            restratify = levels[:len(self.rules)] != \
+                [x.level for x in self.rules]
+            for rule, level in zip(all_rules, levels):
+                rule.level = level
+            self.rules = all_rules
+
+        changes = {}
+        inserted = []
+        try:
+            for fact in facts:
+                if self._insert(fact, -1):
+                    inserted.append(Rule(fact, TRUE))
+                    changes.setdefault(predicateKey(fact), []).append(fact)
+            if restratify:
+                self._recompute(0)
+            else:
+                self._propagate(changes, new_rules)
+        except Exception:
+            self.remove([x.rule for x in new_rules] + inserted)
+            raise
+
+    def remove(self, rules):
+        """
+        Forget some L{Rule}s that were added, and derive everything
+        again without them.
+        """
+        removed = set(ruleKey(x) for x in rules)
+        self.rules = [x for x in self.rules if ruleKey(x.rule) not in removed]
+        for rule in rules:
+            if not isinstance(rule.body, _TRUE):
+                continue
+            relation = self.relations.get(predicateKey(rule.head))
+            if relation is not None and \
+                    relation.levels.get(rule.head) == -1:
+                # so that it's forgotten with the derived facts, and
+                # derived again if it still follows from something
+                relation.levels[rule.head] = 0
+                relation.top = max(relation.top, 0)
+        for rule, level in zip(self.rules, stratify(self.rules)):
+            rule.level = level
+        self._recompute(0)
+
+    def query(self, goal):
+        """
+        Generate the bindings for C{goal}'s variables from each fact it
+        matches.
+        """
+        if isinstance(goal, SpecialTerm):
+            return goal.query(self.brain)
+        return self._matches(goal, self._lookup(goal))
+
+    def _matches(self, goal, facts):
+        for fact in facts:
+            bindings = matchGround(fact, goal)
+            if bindings is not None:
+                yield bindings
+
+    def _relationKeys(self, goal, keys):
+        """
+        Return which of C{keys} might have facts matching C{goal}.
+        """
+        if isinstance(goal, Term):
+            key = predicateKey(goal)
+            if key[1] is not None:
+                return [x for x in [key, (key[0], None)] if x in keys]
+            return [x for x in keys if x is not None and x[0] == key[0]]
+        elif isinstance(goal, Atom):
+            return [None] if None in keys else []
+        return list(keys)
+
+    def _lookup(self, goal):
+        relations = self.relations
+        return itertools.chain.from_iterable(
+            relations[x].candidates(goal)
+            for x in self._relationKeys(goal, relations))
+
+    def _insert(self, fact, level):
+        """
+        Add a fact unless it's already known.
+
+        @return: C{True} if it's new.
+        """
+        key = predicateKey(fact)
+        relation = self.relations.get(key)
+        if relation is None:
+            relation = self.relations[key] = _Relation()
+        known = relation.levels.get(fact)
+        if known is None:
+            relation.add(fact, level)
+            return True
+        elif level < known:
+            relation.levels[fact] = level
+        return False
+
+    def _strata(self):
+        return sorted(set(x.level for x in self.rules))
+
+    def _propagate(self, changes, new_rules):
+        """
+        Derive what follows from new facts (C{changes}, a dict of
+        predicate keys to lists of facts) and new rules.
+        """
+        new_rules = set(new_rules)
+        for level in self._strata():
+            rules = [x for x in self.rules if x.level == level]
+            for rule in rules:
+                if any(keysOverlap(x, y) for x in rule.negates
+                       for y in changes):
+                    self._recompute(level)
+                    return
+            found = self._evaluate(level, rules, changes,
+                                   [x for x in rules if x in new_rules])
+            for key, facts in found.items():
+                changes.setdefault(key, []).extend(facts)
+
+    def _recompute(self, level):
+        """
+        Derive the facts for stratum C{level} and above from scratch.
+        """
+        for relation in self.relations.values():
+            relation.forget(level)
+        for stratum in self._strata():
+            if stratum >= level:
+                rules = [x for x in self.rules if x.level == stratum]
+                self._evaluate(stratum, rules, {}, rules)
+
+    def _evaluate(self, level, rules, delta, fresh):
+        """
+        Derive facts with the rules of stratum C{level} until no more
+        turn up.
+
+        @param delta: New facts, as a dict of predicate keys to lists
+            of facts.  Rules are first tried with one of their goals
+            matched against these.
+        @param fresh: Rules to try against all the facts first.
+
+        @return: The facts derived, in the same form as C{delta}.
+        """
+        derived = {}
+        first = True
+        while delta or first:
+            found = []
+            for rule in rules:
+                if first and rule in fresh:
+                    found.extend(self._derive(rule, None, None))
+                    continue
+                for i in rule.positive:
+                    keys = self._relationKeys(rule.goals[i], delta)
+                    if keys:
+                        facts = itertools.chain.from_iterable(
+                            delta[x] for x in keys)
+                        found.extend(self._derive(rule, i, facts))
+            first = False
+            delta = {}
+            for fact in found:
+                if self._insert(fact, level):
+                    delta.setdefault(predicateKey(fact), []).append(fact)
+            for key, facts in delta.items():
+                derived.setdefault(key, []).extend(facts)
+        return derived
+
+    def _derive(self, rule, first, facts):
+        """
+        Generate the facts a rule derives.
+
+        @param first: The index of a goal to match against C{facts}
+            (rather than against everything) before the other goals,
+            or C{None}.
+        """
+        goals = rule.goals
+        if first is None:
+            plan = self.brain._plan(goals, describeGoal)
+            solutions = self._solve(plan, 0, {})
+        else:
+            bound = set(goals[first].listVars())
+
+            def describe(goal):
+                key, special, arg_vars = describeGoal(goal)
+                return key, special, [x - bound for x in arg_vars]
+            plan = self.brain._plan(
+                [x for i, x in enumerate(goals) if i != first], describe)
+            solutions = itertools.chain.from_iterable(
+                self._solve(plan, 0, bindings)
+                for bindings in self._matches(goals[first], facts))
+        for bindings in solutions:
+            fact = resolve(rule.head, bindings)
+            if not fact.ground:
+                raise UnsafeRule('{0} derived {1}'.format(rule.rule, fact))
+            yield fact
+
+    def _solve(self, goals, i, bindings):
+        """
+        Generate the bindings that satisfy C{goals[i:]} as well as
+        C{bindings}.
+        """
+        if i == len(goals):
+            yield bindings
+            return
+        goal = goals[i]
+        if bindings:
+            goal = resolve(goal, bindings)
+        if isinstance(goal, Not):
+            for x in self._matches(goal.args[1], self._lookup(goal.args[1])):
+                return
+            matches = [{}]
+        elif isinstance(goal, SpecialTerm):
+            matches = goal.query(self.brain)
+        else:
+            matches = self._matches(goal, self._lookup(goal))
+        for found in matches:
+            if found:
+                merged = dict(bindings)
+                merged.update(found)
+            else:
+                merged = bindings
+            for x in self._solve(goals, i + 1, merged):
+                yield x
+
+#------------------------------------------------------
+# trail engine
+
+class _Slot(object):
+    """
+    I stand for the variable at some offset from the start of a frame
+    in a L{_Machine}'s cells.
+    """
+
+    __slots__ = ('index', 'name')
+    ground = False
+
+    def __init__(self, index, name):
+        self.index = index
+        self.name = name
+
+    def __repr__(self):
+        return '<{0}@{1}>'.format(self.name, self.index)
+
+    def substitute(self, mapping):
+        return self
+
+    def listVars(self):
+        return []
+
+
+def _clause(rule):
+    """
+    Return a rule compiled for a L{_Machine}: a tuple of its head and
+    body goals with each variable replaced by a L{_Slot}, and the
+    number of slots a frame for it needs.
+    """
+    try:
+        return rule._clause
+    except AttributeError:
+        pass
+    variables = uniqueVars(rule.head)
+    seen = set(variables)
+    for v in rule.body.listVars():
+        if v not in seen:
+            seen.add(v)
+            variables.append(v)
+    mapping = {v: _Slot(i, v.name) for i, v in enumerate(variables)}
+    head = rule.head
+    if variables:
+        head = head.substitute(mapping)
+    body = None
+    if not isinstance(rule.body, _TRUE):
+        body = tuple(x.substitute(mapping) for x in rule.body.parts)
+    rule._clause = (head, body, len(variables))
+    return rule._clause
+
+
+_FAIL = object()
+_PAUSE = object()
+
+
+class _Machine(object):
+    """
+    I answer a query by resolution without copying terms.
+
+    Rules are used as skeletons (see L{_clause}) paired with the offset
+    of a frame in C{cells}, so using a rule means reserving a frame
+    rather than renaming its variables.  A cell is C{None} while its
+    variable is unbound, or a C{(skeleton, frame)} pair.  Every binding
+    is recorded on the trail so that backtracking can undo it.
+
+    Goals waiting to be proved are a linked list of
+    C{(goal, frame, rest)}.  Each choice point remembers what to try
+    next for a goal and how to put the cells back before trying it.
+
+    Trying a clause (or an answer to a special term) is a step.  When
+    C{steps} reaches C{limit}, L{solve} and L{answers} yield C{_PAUSE}
+    and carry on from where they were when they're resumed.
+    """
+
+    def __init__(self, brain, query):
+        self.brain = brain
+        self.tracer = brain.tracer
+        self.profiler = brain.profiler
+        self.planning = brain.planning
+        self.cells = []
+        self.trail = []
+        self.query_vars = uniqueVars(query)
+        mapping = {}
+        for i, v in enumerate(self.query_vars):
+            mapping[v] = _Slot(i, v.name)
+            self.cells.append(None)
+        if isinstance(query, Var):
+            query = mapping[query]
+        elif mapping:
+            query = query.substitute(mapping)
+        self.goals = (query, 0, None)
+        self._exported = {}
+        self.steps = 0
+        self.limit = None
+
+    def answers(self):
+        """
+        Generate a dict of bindings for the query's variables for each
+        way the query can be proved.
+        """
+        for paused in self.solve():
+            if paused is _PAUSE:
+                yield _PAUSE
+                continue
+            self._exported = {}
+            ret = {}
+            for i, v in enumerate(self.query_vars):
+                value = self.export(_Slot(i, v.name), 0)
+                if value.__class__ is not Var:
+                    ret[v] = value
+            if self.tracer is not None:
+                self.tracer.answer(self.goals[0], ret)
+            yield ret
+
+    def solve(self):
+        """
+        Yield each time the goals are all proved, leaving the bindings
+        in my cells.
+        """
+        choices = []
+        goals = self.goals
+        while True:
+            if goals is None:
+                yield
+                goals = self._backtrack(choices)
+            else:
+                goal, frame, rest = goals
+                choices.append(self._choicePoint(goal, frame, rest))
+                goals = self._backtrack(choices)
+            while goals is _PAUSE:
+                yield _PAUSE
+                goals = self._backtrack(choices)
+            if goals is _FAIL:
+                return
+
+    def _choicePoint(self, goal, frame, rest):
+        goal, frame = self.deref(goal, frame)
+        if self.tracer is not None:
+            self._exported = {}
+            self.tracer.goal(self.export(goal, frame))
+        brain = self.brain
+        if isinstance(goal, SpecialTerm) or (
+                brain.tabling and brain._isTabled(goal)):
+            return [self._tryAnswer, self._bridge(goal, frame),
+                    goal, frame, rest, len(self.trail), len(self.cells)]
+        elif isinstance(goal, Term):
+            args = [self.deref(x, frame)[0] for x in goal.args]
+            if brain._table_stack:
+                # as Brain._parsedQuery does, so the table is forgotten
+                # when what this goal reads changes
+                functor = None
+                if args and isinstance(args[0], Atom):
+                    functor = args[0].value
+                brain._table_stack[-1].deps.add((len(args), functor))
+            alternatives = brain._termCandidates(len(args), args)
+        else:
+            if brain._table_stack:
+                brain._table_stack[-1].deps.add(predicateKey(goal))
+            alternatives = brain._candidates(goal)
+        return [self._tryClause, alternatives,
+                goal, frame, rest, len(self.trail), len(self.cells)]
+
+    def _backtrack(self, choices):
+        """
+        Find the next alternative that works, starting with the newest
+        choice point.
+
+        @return: The goals left to prove, C{_FAIL}, or C{_PAUSE} if I
+            ran out of steps first.
+        """
+        cells = self.cells
+        limit = self.limit
+        if limit is not None and self.steps >= limit:
+            return _PAUSE
+        while choices:
+            attempt, alternatives, goal, frame, rest, trail_len, cells_len = \
+                choices[-1]
+            for alternative in alternatives:
+                self.undo(trail_len)
+                del cells[cells_len:]
+                self.steps += 1
+                goals = attempt(alternative, goal, frame, rest)
+                if goals is not _FAIL:
+                    return goals
+                if limit is not None and self.steps >= limit:
+                    return _PAUSE
+            self.undo(trail_len)
+            del cells[cells_len:]
+            choices.pop()
+        return _FAIL
+
+    def _tryClause(self, rule, goal, frame, rest):
+        head, body, size = _clause(rule)
+        new_frame = len(self.cells)
+        if size:
+            self.cells.extend([None] * size)
+        tracer = self.tracer
+        if tracer is not None:
+            self._exported = {}
+            shown = self.export(goal, frame)
+            variables = dict(self._exported)
+            tracer.rule(shown, rule)
+        profiler = self.profiler
+        if profiler is not None:
+            stats = profiler.rule(rule)
+            stats.tried += 1
+        if not self.unify(head, new_frame, goal, frame):
+            if profiler is not None:
+                stats.failed += 1
+            return _FAIL
+        if profiler is not None:
+            stats.unified += 1
+        if tracer is not None:
+            bindings = {}
+            for address, var in variables.items():
+                value = self.export(_Slot(address, var.name), 0)
+                if value is not var:
+                    bindings[var] = value
+            tracer.binding(shown, rule, bindings)
+        if body:
+            if self.planning and len(body) > 1:
+                body = self.brain._plan(
+                    body, lambda part: self._describe(part, new_frame))
+            for part in reversed(body):
+                rest = (part, new_frame, rest)
+        return rest
+
+    def _describe(self, goal, frame):
+        """
+        Describe a goal like L{describeGoal} does, with the addresses
+        of unbound cells instead of variables.
+        """
+        goal, frame = self.deref(goal, frame)
+        if isinstance(goal, Term):
+            return (predicateKey(goal), isinstance(goal, SpecialTerm),
+                    [self._unbound(x, frame) for x in goal.args])
+        return None, False, [self._unbound(goal, frame)]
+
+    def _unbound(self, thing, frame):
+        """
+        Return the set of addresses of the unbound cells in a skeleton.
+        """
+        thing, frame = self.deref(thing, frame)
+        if thing.__class__ is _Slot:
+            return set([frame + thing.index])
+        ret = set()
+        if isinstance(thing, Term) and not thing.ground:
+            for arg in thing.args:
+                ret |= self._unbound(arg, frame)
+        return ret
+
+    def _bridge(self, goal, frame):
+        """
+        Answer a goal I can't resolve myself (a special term or a
+        tabled goal) by asking it to query the brain.
+        """
+        self._exported = {}
+        term = self.export(goal, frame)
+        addresses = {v: a for a, v in self._exported.items()}
+        for match in term.query(self.brain):
+            yield [(addresses[k], v) for k, v in match.items()
+                   if k in addresses]
+
+    def _tryAnswer(self, bindings, goal, frame, rest):
+        for address, value in bindings:
+            value, value_frame = self.load(value)
+            if not self.unify(_Slot(address, ''), 0, value, value_frame):
+                return _FAIL
+        return rest
+
+    def deref(self, thing, frame):
+        """
+        Follow bound variables until reaching a value or an unbound
+        variable.
+        """
+        cells = self.cells
+        while thing.__class__ is _Slot:
+            cell = cells[frame + thing.index]
+            if cell is None:
+                break
+            thing, frame = cell
+        return thing, frame
+
+    def bind(self, address, thing, frame):
+        self.cells[address] = (thing, frame)
+        self.trail.append(address)
+
+    def undo(self, trail_len):
+        """
+        Unbind everything bound since the trail was C{trail_len} long.
+        """
+        cells = self.cells
+        trail = self.trail
+        while len(trail) > trail_len:
+            cells[trail.pop()] = None
+
+    def unify(self, a, a_frame, b, b_frame):
+        a, a_frame = self.deref(a, a_frame)
+        b, b_frame = self.deref(b, b_frame)
+        if a.__class__ is _Slot:
+            address = a_frame + a.index
+            if b.__class__ is not _Slot or b_frame + b.index != address:
+                self.bind(address, b, b_frame)
+            return True
+        elif b.__class__ is _Slot:
+            self.bind(b_frame + b.index, a, a_frame)
+            return True
+        elif a is b:
+            return True
+        elif isinstance(a, Term) and isinstance(b, Term):
+            if len(a.args) != len(b.args) or (a.ground and b.ground):
+                return False
+            for x, y in zip(a.args, b.args):
+                if not self.unify(x, a_frame, y, b_frame):
+                    return False
+            return True
+        return False
+
+    def export(self, thing, frame):
+        """
+        Build an ordinary term from a skeleton and its frame.  Unbound
+        variables become L{Var}s (the same one for the same cell).
+        """
+        thing, frame = self.deref(thing, frame)
+        if thing.__class__ is _Slot:
+            address = frame + thing.index
+            if address not in self._exported:
+                self._exported[address] = Var(thing.name)
+            return self._exported[address]
+        elif isinstance(thing, Term) and thing.args:
+            args = [self.export(x, frame) for x in thing.args]
+            for new, old in zip(args, thing.args):
+                if new is not old:
+                    return thing.__class__(*args)
+        return thing
+
+    def load(self, term):
+        """
+        Turn an ordinary term into a skeleton and a new frame for its
+        variables.
+        """
+        variables = uniqueVars(term)
+        if not variables:
+            return term, 0
+        frame = len(self.cells)
+        self.cells.extend([None] * len(variables))
+        mapping = {v: _Slot(i, v.name) for i, v in enumerate(variables)}
+        if isinstance(term, Var):
+            return mapping[term], frame
+        return term.substitute(mapping), frame
+
+
+def _factRule(term):
+    """
+    Make a L{Rule} for a fact from a columnar store.
+    """
+    rule = Rule(term, TRUE)
+    rule.matcher = None
+    return rule
+
+
+class Brain(object):
+    """
+    I know facts and rules and can answer queries about them.
+
+    @param tabling: If C{True}, remember the answers to goals that are
+        answered by rules and reuse them for later calls of the same
+        goal (with any variable names).  This makes recursive rules
+        (even left-recursive ones) terminate for rules without
+        nested terms, and stops the same sub-goals being proved over
+        and over.  The answers are forgotten when a rule that might
+        change them is added.
+    @param compiled: If C{False}, use each rule head's C{matches}
+        method instead of the unifier compiled when the rule was
+        added.  This is slower and only kept to check the compiled
+        unifiers against.
+    @param engine: C{'recursive'} to answer queries with nested
+        generators that substitute bindings into copies of rule
+        bodies, or C{'trail'} to use a L{_Machine}, which binds
+        variables in place and undoes the bindings when it backtracks.
+    @param parse_cache_size: How many parsed query strings to remember.
+    @param negation_cache_size: How many ground goals under a C{not} to
+        remember whether they are provable.
+    @param tracer: A L{Tracer} to tell about goals, rules and answers,
+        or C{None}.  It can be changed later with the C{tracer}
+        attribute.
+    @param profiler: A L{Profiler} to count what each rule costs, or
+        C{None}.  It can be changed later with the C{profiler}
+        attribute.
+    @param planning: If C{True}, prove the goals of a rule's body in
+        the order that is expected to be cheapest given the variables
+        bound so far, using the L{PredicateStats} kept for each
+        predicate, instead of from left to right.
+    @param materialize: If C{True}, derive every fact that follows from
+        the rules as they are added (see L{Materializer}) and answer
+        queries by looking facts up.  Rules must be safe and
+        stratifiable, or adding them raises L{UnsafeRule} or
+        L{Unstratifiable}.
+    @param columnar: If C{True}, keep ground facts in a
+        L{prolly_columnar.ColumnarStore} (which needs NumPy) instead of
+        as rules, and answer the goals of a rule's body that only
+        facts can answer with NumPy joins.
+    @param base: Another brain to build on.  I know everything it knows
+        as well as what is added to me, without copying it, and it is
+        frozen (see L{freeze}) so that it can be shared by many brains.
+        A brain with a base can't be materialized, and doesn't use
+        NumPy joins.
+    """
+
+    def __init__(self, tabling=False, compiled=True, engine='recursive',
+                 parse_cache_size=256, tracer=None, planning=False,
+                 materialize=False, columnar=False, base=None,
+                 profiler=None, negation_cache_size=65536):
+        if base is not None and materialize:
+            raise ValueError("A brain with a base can't be materialized")
+        self._base = base
+        self._frozen = False
+        self.tracer = tracer
+        self.profiler = profiler
+        self.planning = planning
+        self._materialized = Materializer(self) if materialize else None
+        self._columns = None
+        if columnar:
+            from prolly_columnar import ColumnarStore
+            self._columns = ColumnarStore()
+        self._rule_keys = set()
+        self._fact_goals = {}
+        self._stats = {}
+        self._rules = []
+        self._index = RuleIndex()
+        self._terms = {
+            'not': Not.createFromTerm,
+        }
+        for name, cls in BUILTINS.items():
+            self._terms[name] = cls.createFromTerm
+        self.tabling = tabling
+        self.compiled = compiled
+        self.engine = engine
+        self._parse_cache = LRUCache(parse_cache_size)
+        self._derived = set()
+        self._bodies = []
+        self._negators = {}
+        self._unstratified = set()
+        self._closures = {}
+        self._negations = LRUCache(negation_cache_size,
+                                   self._negationEvicted)
+        self._negation_deps = {}
+        self._subscriptions = []
+        if base is not None:
+            base.freeze()
+            self._terms.update(base._terms)
+            self._rule_keys.update(base._rule_keys)
+            self._derived.update(base._derived)
+            self._bodies.extend(base._bodies)
+            for key, heads in base._negators.items():
+                self._negators[key] = list(heads)
+            self._unstratified.update(base._unstratified)
+        self._tabled_keys = {}
+        self._tables = {}
+        self._table_deps = {}
+        self._table_stack = []
+        self._incomplete = []
+        self._epoch = 0
+        self._answer_count = 0
+        self._in_progress_reads = 0
+
+    def add(self, rule):
+        """
+        Add a fact to this brain.
+        """
+        rule = PARSER(rule).rule()\
+            .normalizeVars()\
+            .convertSpecialTerms(self)
+        self._addRule(rule)
+
+    def retract(self, rule):
+        """
+        Remove a fact or rule from this brain: every copy of it that was
+        added to me, not to my base.  Variables may be named
+        differently than when it was added.
+
+        @return: How many copies were removed.
+        """
+        rule = PARSER(rule).rule()\
+            .normalizeVars()\
+            .convertSpecialTerms(self)
+        return self._retractRules([rule])
+
+    def save(self, path):
+        """
+        Write a snapshot of my rules and index to a file, which
+        L{open} can start a brain from without parsing anything.
+        """
+        from prolly_snapshot import saveSnapshot
+        saveSnapshot(self, path)
+
+    @classmethod
+    def open(cls, path, **kwargs):
+        """
+        Start a brain from a snapshot written by L{save}.  Keyword
+        arguments are given to the constructor.
+
+        @return: A brain with the snapshot's rules, which can be added
+            to like any other.
+        """
+        from prolly_snapshot import openSnapshot
+        return openSnapshot(cls, path, **kwargs)
+
+    def freeze(self):
+        """
+        Stop anything more being added to me, which would raise
+        L{FrozenBrain}.
+        """
+        self._frozen = True
+
+    def _addRule(self, rule):
+        """
+        Add an already-parsed L{Rule} to this brain.
+        """
+        if self._frozen:
+            raise FrozenBrain('{0} is frozen'.format(self))
+        key = predicateKey(rule.head)
+        if self._negations:
+            self._forgetNegations(key)
+        if self._materialized is not None:
+            self._materialized.add([rule])
+        if self._columns is not None and self._columns.canStore(rule):
+            self._columns.add(rule.head)
+        else:
+            rule.compile()
+            self._index.add(len(self._rules), rule.head)
+            self._rules.append(rule)
+            self._noteRuleKey(key)
+        self._countRule(key, rule)
+        if not isinstance(rule.body, _TRUE):
+            self._stratify([rule])
+            if key not in self._derived:
+                self._derived.add(key)
+                self._tabled_keys = {}
+        if self._tables:
+            self._invalidateTables(key)
+        if self._subscriptions:
+            self._notify([rule])
+
+    def load(self, fileobj):
+        """
+        Add the facts and rules in a file, one per line.  Ground facts
+        are read without the grammar, so this is much faster than
+        calling L{add} for each line.  Blank lines are skipped.
+        """
+        special = self._terms
+        rules = []
+        for line in fileobj:
+            line = line.strip()
+            if not line:
+                continue
+            head = parseFact(line, special)
+            if head is None:
+                rules.append(PARSER(line).rule()
+                             .normalizeVars()
+                             .convertSpecialTerms(self))
+            else:
+                rules.append(Rule(head, TRUE))
+        self._addRules(rules)
+
+    def addFacts(self, facts):
+        """
+        Add many facts given as tuples of strings, numbers and tuples,
+        like C{('parent', 'mary', 'joe')}.
+        """
+        convert = self.convertToSpecialTerm
+        self._addRules([Rule(convert(dehumanize(x)), TRUE) for x in facts])
+
+    def _addRules(self, rules):
+        """
+        Add many already-parsed L{Rule}s, filing them in the index all
+        at once.
+        """
+        if self._frozen:
+            raise FrozenBrain('{0} is frozen'.format(self))
+        if self._negations:
+            for key in set(predicateKey(rule.head) for rule in rules):
+                self._forgetNegations(key)
+        if self._materialized is not None:
+            self._materialized.add(rules)
+        start = len(self._rules)
+        keys = set()
+        columns = self._columns
+        for rule in rules:
+            key = predicateKey(rule.head)
+            if columns is not None and columns.canStore(rule):
+                columns.add(rule.head)
+            else:
+                rule.compile()
+                self._rules.append(rule)
+                self._noteRuleKey(key)
+            keys.add(key)
+            self._countRule(key, rule)
+            if not isinstance(rule.body, _TRUE) and key not in self._derived:
+                self._derived.add(key)
+                self._tabled_keys = {}
+        self._stratify([x for x in rules if not isinstance(x.body, _TRUE)])
+        self._index.extend(start,
+                           [rule.head for rule in self._rules[start:]])
+        if self._tables:
+            for key in keys:
+                self._invalidateTables(key)
+        if self._subscriptions:
+            self._notify(rules)
+            self.flushSubscriptions()
+
+    def _retractRules(self, rules):
+        """
+        Remove every copy of some already-parsed L{Rule}s.
+
+        @return: How many copies were removed.
+        """
+        if self._frozen:
+            raise FrozenBrain('{0} is frozen'.format(self))
+        if self._subscriptions:
+            # while what the retracted facts prove can still be found
+            self._notify(rules, retracting=True)
+        count = 0
+        removed = []
+        columns = self._columns
+        for rule in rules:
+            key = predicateKey(rule.head)
+            target = ruleKey(rule)
+            found = []
+            if columns is not None and columns.canStore(rule):
+                found = [rule] * columns.remove(rule.head)
+            else:
+                for rule_id in list(self._index.candidates(rule.head)):
+                    old = self._rules[rule_id]
+                    if ruleKey(old) == target:
+                        self._index.remove(rule_id, old.head)
+                        found.append(old)
+            if not found:
+                continue
+            count += len(found)
+            removed.append(rule)
+            stats = self._stats.get(key)
+            for old in found:
+                if stats is not None:
+                    stats.remove(old)
+                if not isinstance(old.body, _TRUE):
+                    self._bodies.remove((key,) + bodyKeys(old))
+        if not removed:
+            return 0
+        keys = set(predicateKey(x.head) for x in removed)
+        if any(not isinstance(x.body, _TRUE) for x in removed):
+            self._findUnstratified()
+        if self._materialized is not None:
+            self._materialized.remove(removed)
+        for key in keys:
+            if self._negations:
+                self._forgetNegations(key)
+            if self._tables:
+                self._invalidateTables(key)
+        return count
+
+    def _noteRuleKey(self, key):
+        if key not in self._rule_keys:
+            self._rule_keys.add(key)
+            self._fact_goals = {}
+
+    def _factGoals(self, parts):
+        """
+        Count how many of the goals at the start of C{parts} can only
+        be answered by facts in my columnar store.
+        """
+        count = 0
+        for goal in parts:
+            if goal.__class__ is not Term or not goal.args or \
+                    not isinstance(goal.args[0], Atom):
+                break
+            elif not all(x.ground or x.__class__ is Var for x in goal.args):
+                break
+            key = predicateKey(goal)
+            try:
+                facts_only = self._fact_goals[key]
+            except KeyError:
+                facts_only = self._fact_goals[key] = not any(
+                    keysOverlap(key, x) for x in self._rule_keys)
+            if not facts_only:
+                break
+            count += 1
+        return count
+
+    def _countRule(self, key, rule):
+        if key is None:
+            return
+        try:
+            stats = self._stats[key]
+        except KeyError:
+            stats = self._stats[key] = PredicateStats(key[0])
+        stats.add(rule)
+
+    def _estimate(self, key, bound):
+        """
+        Guess how many answers a goal with predicate key C{key} will
+        have.  See L{PredicateStats.estimate}.
+        """
+        cost = 0.0
+        if self._base is not None:
+            cost = self._base._estimate(key, bound)
+        if key is None or key[1] is None:
+            return cost + len(self._rules)
+        stats = self._stats.get(key)
+        if stats is None:
+            return cost
+        return cost + stats.estimate(bound)
+
+    def _plan(self, parts, describe):
+        """
+        Order the goals of a conjunction, each time picking the goal
+        expected to have the fewest answers given the variables bound
+        by the goals picked before it.  Special terms (like C{not})
+        are picked as soon as no other goal could bind their
+        variables, counting builtins like C{plus} that can.
+
+        @param describe: A function like L{describeGoal}.
+        """
+        remaining = [(part,) + describe(part) for part in parts]
+        bound = set()
+        ordered = []
+        while remaining:
+            best = 0
+            best_cost = None
+            for i, (part, key, special, arg_vars) in enumerate(remaining):
+                free = [x - bound for x in arg_vars]
+                if special:
+                    others = set()
+                    for j, other in enumerate(remaining):
+                        if j != i and (not other[2] or
+                                       getattr(other[0], 'binds', False)):
+                            for x in other[3]:
+                                others.update(x)
+                    if any(not x.isdisjoint(others) for x in free):
+                        continue
+                    cost = 0.0
+                else:
+                    cost = self._estimate(key, [not x for x in free])
+                if best_cost is None or cost < best_cost:
+                    best, best_cost = i, cost
+            part, key, special, arg_vars = remaining.pop(best)
+            ordered.append(part)
+            for x in arg_vars:
+                bound.update(x)
+        return ordered
+
+    def _candidates(self, query, ranges=None):
+        """
+        Generate the rules whose heads might match C{query}.  See
+        L{RuleIndex.termCandidates} for C{ranges}.
+        """
+        rules = itertools.imap(self._rules.__getitem__,
+                               self._index.candidates(query, ranges))
+        if self._base is not None:
+            rules = itertools.chain(self._base._candidates(query, ranges),
+                                    rules)
+        if self._columns is None or isinstance(query, Atom):
+            return rules
+        elif isinstance(query, Term):
+            facts = self._columns.facts(len(query.args), query.args)
+        else:
+            facts = itertools.chain.from_iterable(
+                self._columns.facts(arity, (query,))
+                for arity in set(x[0] for x in self._columns.tables))
+        return itertools.chain(rules, itertools.imap(_factRule, facts))
+
+    def _termCandidates(self, arity, args):
+        """
+        Generate the rules whose heads might match a term with the
+        given C{args}.
+        """
+        rules = itertools.imap(self._rules.__getitem__,
+                               self._index.termCandidates(arity, args))
+        if self._base is not None:
+            rules = itertools.chain(self._base._termCandidates(arity, args),
+                                    rules)
+        if self._columns is None:
+            return rules
+        return itertools.chain(rules, itertools.imap(
+            _factRule, self._columns.facts(arity, args)))
+
+    def addTermType(self, name, constructor):
+        """
+        Add a special kind of term type by name.  Query strings parsed
+        before are parsed again, but L{PreparedQuery}s and L{QueryTask}s
+        keep the terms they were made with.
+        """
+        self._terms[name] = constructor
+        self._parse_cache.clear()
+
+    def convertToSpecialTerm(self, term):
+        """
+        Convert a Term to a special Term known to this Brain.
+        """
+        if not term.args:
+            return term
+        first_arg = term.args[0]
+        if isinstance(first_arg, Atom):
+            constructor = self._terms.get(first_arg.value, None)
+            if constructor is not None:
+                return constructor(term)
+        return term
+
+    def query(self, query):
+        """
+        Query the brain.
+        """
+        query = self._parseQuery(query)
+        return self._humanAnswers(query, uniqueVars(query))
+
+    def prepare(self, query):
+        """
+        Parse a query to be asked over and over, perhaps with different
+        values for some of its variables.
+
+        @return: A L{PreparedQuery}.
+        """
+        return PreparedQuery(self, self._parseQuery(query))
+
+    def start(self, query):
+        """
+        Start answering a query without finding all the answers at
+        once.
+
+        @return: A L{QueryTask}.
+        """
+        return QueryTask(self, self._parseQuery(query))
+
+    def _parseQuery(self, query):
+        parsed = self._parse_cache.get(query)
+        if parsed is None:
+            parsed = PARSER(query).rule().normalizeVars()\
+                .convertSpecialTerms(self).head
+            self._parse_cache[query] = parsed
+        return parsed
+
+    def _humanAnswers(self, query, query_vars):
+        """
+        Generate the answers to a parsed query as dicts of the names of
+        C{query_vars} to their human values.
+        """
+        for match in self.parsedQuery(query):
+            ret = {}
+            for var in query_vars:
+                if var in match:
+                    ret[var.humanValue()] = match[var].humanValue()
+            yield ret
+
+    def unique(self, gen, query_vars):
+        """
+        Generate the answers from C{gen} that it hasn't generated
+        before.  Variables missing from an answer are unbound.
+        """
+        seen = AnswerSet()
+        add = seen.add
+        for x in gen:
+            if add(tuple([x.get(v, v) for v in query_vars])):
+                yield x
+
+    def parsedQuery(self, query, ranges=None):
+        """
+        Query the brain using an already-parsed-into-python-objects
+        query.
+
+        @param ranges: Bounds on the numbers at some of the query's
+            argument positions, as found by L{numberRanges}, which
+            rules may be looked up by.  Answers outside them aren't
+            left out.
+        """
+        if isinstance(query, SpecialTerm):
+            return self.unique(query.query(self), uniqueVars(query))
+        if self._materialized is not None:
+            return self._materialized.query(query)
+        if self.tabling and self._isTabled(query):
+            return self._tabledQuery(query)
+        if self.engine == 'trail':
+            machine = _Machine(self, query)
+            return self.unique(machine.answers(), machine.query_vars)
+        return self.unique(self._parsedQuery(query, ranges), uniqueVars(query))
+
+    def _parsedQuery(self, query, ranges=None):
+        if self._table_stack:
+            self._table_stack[-1].deps.add(predicateKey(query))
+        query_vars = uniqueVars(query)
+        tracer = self.tracer
+        if tracer is not None:
+            tracer.goal(query)
+        if not self.compiled:
+            for x in self._referenceQuery(query, set(query_vars)):
+                yield x
+            return
+        var_set = set(query_vars)
+        profiler = self.profiler
+        for rule in self._candidates(query, ranges):
+            if profiler is not None:
+                stats = profiler.rule(rule)
+                stats.tried += 1
+            if var_set and not var_set.isdisjoint(rule.variables()):
+                rule = rule.rename()
+            if tracer is not None:
+                tracer.rule(query, rule)
+            if rule.matcher is None:
+                bindings = matchGround(rule.head, query)
+            else:
+                bindings = rule.matcher(query)
+            if bindings is None:
+                if profiler is not None:
+                    stats.failed += 1
+                continue
+            if tracer is not None:
+                tracer.binding(query, rule, bindings)
+            if isinstance(rule.body, _TRUE):
+                ret = {}
+                for var in query_vars:
+                    if var in bindings:
+                        ret[var] = resolve(var, bindings)
+                if tracer is not None:
+                    tracer.answer(query, ret)
+                if profiler is not None:
+                    stats.unified += 1
+                    stats.answers += 1
+                yield ret
+            else:
+                mapping = {k: resolve(k, bindings) for k in bindings}
+                mapped_body = rule.body.substitute(mapping)
+                matches = mapped_body.query(self)
+                if profiler is not None:
+                    stats.unified += 1
+                    matches = profiler.watch(stats, matches)
+                for match in matches:
+                    ret = {}
+                    for var in query_vars:
+                        if var in bindings:
+                            ret[var] = resolve(var, bindings).substitute(match)
+                        elif var in match:
+                            ret[var] = match[var]
+                    if tracer is not None:
+                        tracer.answer(query, ret)
+                    yield ret
+
+    def _referenceQuery(self, query, query_vars):
+        """
+        Do what L{_parsedQuery} does using each rule head's C{matches}
+        method, the way it was done before heads were compiled.
+        """
+        tracer = self.tracer
+        for rule in self._candidates(query):
+            if query_vars and not query_vars.isdisjoint(rule.variables()):
+                rule = rule.rename()
+            if tracer is not None:
+                tracer.rule(query, rule)
+            for mapping in rule.head.matches(query, self):
+                if tracer is not None:
+                    tracer.binding(query, rule, mapping)
+                if isinstance(rule.body, _TRUE):
+                    ret = reverseDict(mapping)
+                    yield ret
+                else:
+                    mapped_body = rule.body.substitute(mapping)
+                    for match in mapped_body.query(self):
+                        rev_map = reverseDict(mapping)
+                        mapped_vars = [x for x in rev_map if isinstance(x, Var)]
+                        ret = {}
+                        for var in mapped_vars:
+                            ret[var] = match.get(var, rev_map[var])
+                        yield ret
+
+
+    #--------------------------------------------------
+    # negation
+
+    def _stratify(self, rules):
+        """
+        Add the dependencies of some rules with bodies to my graph of
+        which predicates depend on which, and find the predicates that
+        now depend on their own negation.
+
+        Only the closures that reach the new rules' heads are worked out
+        again, and only the negations whose closures those are (or that
+        the new rules make) are checked.
+        """
+        if not rules:
+            return
+        heads = []
+        check = set()
+        for rule in rules:
+            head = predicateKey(rule.head)
+            reads, negates = bodyKeys(rule)
+            self._bodies.append((head, reads, negates))
+            heads.append(head)
+            for negated in negates:
+                self._negators.setdefault(negated, []).append(head)
+                check.add(negated)
+        for key, keys in self._closures.items():
+            if any(keysOverlap(x, y) for x in keys for y in heads):
+                del self._closures[key]
+                check.add(key)
+        for negated in check:
+            negators = self._negators.get(negated)
+            if negators:
+                self._checkNegation(negated, negators)
+
+    def _findUnstratified(self):
+        """
+        Find the predicates that depend on their own negation, starting
+        over (as when rules are removed).
+        """
+        self._closures = {}
+        self._negators = {}
+        self._unstratified = set()
+        for head, reads, negates in self._bodies:
+            for negated in negates:
+                self._negators.setdefault(negated, []).append(head)
+        for negated, negators in self._negators.items():
+            self._checkNegation(negated, negators)
+
+    def _checkNegation(self, negated, heads):
+        """
+        Mark those of C{heads} whose rules negate goals with predicate key
+        C{negated} as unstratified if the answers to those goals depend
+        on them.
+        """
+        closure = self._closure(negated)
+        for head in heads:
+            if head not in self._unstratified and any(
+                    keysOverlap(head, x) for x in closure):
+                self._unstratified.add(head)
+
+    def _closure(self, key):
+        """
+        Return the set of predicate keys that the answers to goals with
+        predicate key C{key} depend on, including C{key}.
+        """
+        try:
+            return self._closures[key]
+        except KeyError:
+            pass
+        keys = set([key])
+        todo = [key]
+        while todo:
+            current = todo.pop()
+            for head, reads, negates in self._bodies:
+                if keysOverlap(head, current):
+                    for x in reads + negates:
+                        if x not in keys:
+                            keys.add(x)
+                            todo.append(x)
+        self._closures[key] = keys
+        return keys
+
+    def _provable(self, goal):
+        """
+        Return C{True} if C{goal} has an answer.
+
+        Whether a ground goal is provable is remembered until a rule
+        or fact it depends on is added, unless it depends on a
+        predicate that depends on its own negation.  Only the most
+        recently used C{negation_cache_size} goals are remembered.
+        """
+        deps = None
+        if (goal.__class__ is Term and goal.ground
+                and self._materialized is None):
+            entry = self._negations.get(goal)
+            if entry is None:
+                deps = self._closure(predicateKey(goal))
+                if any(keysOverlap(x, y) for x in deps
+                       for y in self._unstratified):
+                    deps = None
+            else:
+                if self._table_stack:
+                    self._table_stack[-1].deps.update(entry[1])
+                return entry[0]
+        reads = self._in_progress_reads
+        ret = False
+        for match in self.parsedQuery(goal):
+            ret = True
+            break
+        if deps is not None and reads == self._in_progress_reads:
+            # answers read from unfinished tables might not be all of
+            # them yet, so those aren't remembered.
+            self._negations[goal] = (ret, deps)
+            for dep in deps:
+                self._negation_deps.setdefault(dep, set()).add(goal)
+        return ret
+
+    def _negationEvicted(self, goal, entry):
+        """
+        Stop tracking what a goal forgotten by my negation cache depends
+        on.
+        """
+        for dep in entry[1]:
+            goals = self._negation_deps.get(dep)
+            if goals is not None:
+                goals.discard(goal)
+                if not goals:
+                    del self._negation_deps[dep]
+
+    def _forgetNegations(self, key):
+        """
+        Forget whether the goals that depend on predicates matching
+        C{key} are provable.
+        """
+        for dep in list(self._negation_deps):
+            if keysOverlap(dep, key):
+                for goal in self._negation_deps.pop(dep, ()):
+                    entry = self._negations.pop(goal)
+                    if entry is not None:
+                        self._negationEvicted(goal, entry)
+
+    #--------------------------------------------------
+    # subscriptions
+
+    def subscribe(self, query, callback):
+        """
+        Keep the answers to a query up to date as rules and facts are
+        added and retracted.
+
+        @param callback: Called with a list of the answers that
+            appeared and a list of those that disappeared (as dicts
+            like those L{query} generates): first straight away with
+            the answers there are now, if there are any, and then
+            each time they have changed when I'm flushed (see
+            L{flushSubscriptions}).
+
+        @return: A L{Subscription}.
+        """
+        subscription = Subscription(self, self._parseQuery(query), callback)
+        self._subscriptions.append(subscription)
+        subscription.refresh()
+        return subscription
+
+    def flushSubscriptions(self):
+        """
+        Tell subscriptions how their answers have changed since I was
+        last flushed.  L{addFacts} and L{load} do this when they finish;
+        call it after L{add}s and L{retract}s.
+        """
+        for subscription in list(self._subscriptions):
+            subscription.flush()
+
+    def _notify(self, rules, retracting=False):
+        """
+        Tell the subscriptions whose answers might depend on some
+        L{Rule}s that they are being added or retracted.
+        """
+        keys = set(predicateKey(x.head) for x in rules)
+        for subscription in self._subscriptions:
+            goal = subscription.query
+            while isinstance(goal, Not):
+                goal = goal.args[1]
+            if isinstance(goal, SpecialTerm):
+                continue
+            deps = self._closure(predicateKey(goal))
+            relevant = [x for x in rules
+                        if any(keysOverlap(y, predicateKey(x.head))
+                               for y in deps)]
+            if relevant:
+                subscription._changed(relevant, retracting)
+
+    def _incremental(self, goal):
+        """
+        Return C{True} if the answers to C{goal} only depend on facts
+        through rules without a C{not} that don't depend on themselves,
+        so that L{_deltaAnswers} finds every answer a new fact brings.
+        """
+        if goal.__class__ is not Term:
+            return False
+        return self._acyclic(predicateKey(goal), [])
+
+    def _acyclic(self, key, path):
+        path = path + [key]
+        for head, reads, negates in self._bodies:
+            if not keysOverlap(head, key):
+                continue
+            if negates:
+                return False
+            for read in reads:
+                if read is None or any(keysOverlap(read, x) for x in path):
+                    return False
+                if not self._acyclic(read, path):
+                    return False
+        return True
+
+    def _deltaAnswers(self, goal, fact):
+        """
+        Generate bindings for C{goal}'s variables from the answers to it
+        that C{fact} is used to prove, by matching C{fact} against one
+        goal of each rule body that might read it (through other rules
+        as needed) and answering the rest of the body as usual.  Answers
+        may come more than once.
+
+        Only answers proven through rules that L{_incremental} allows
+        are found.
+        """
+        bindings = matchGround(fact, goal)
+        if bindings is not None:
+            yield bindings
+        key = predicateKey(fact)
+        goal_vars = uniqueVars(goal)
+        var_set = set(goal_vars)
+        for rule in self._candidates(goal):
+            if isinstance(rule.body, _TRUE):
+                continue
+            if var_set and not var_set.isdisjoint(rule.variables()):
+                rule = rule.rename()
+            if rule.matcher is None:
+                bindings = matchGround(rule.head, goal)
+            else:
+                bindings = rule.matcher(goal)
+            if bindings is None:
+                continue
+            mapping = {k: resolve(k, bindings) for k in bindings}
+            goals = rule.body.substitute(mapping).parts
+            for i, part in enumerate(goals):
+                if isinstance(part, SpecialTerm) or not any(
+                        keysOverlap(x, key)
+                        for x in self._closure(predicateKey(part))):
+                    continue
+                rest = goals[:i] + goals[i + 1:]
+                for first in self._deltaAnswers(part, fact):
+                    for match in self._deltaRest(first, rest):
+                        answer = {}
+                        for var in goal_vars:
+                            if var in bindings:
+                                answer[var] = resolve(
+                                    var, bindings).substitute(match)
+                            elif var in match:
+                                answer[var] = match[var]
+                        yield answer
+
+    def _deltaRest(self, first, rest):
+        """
+        Generate the answers to the goals C{rest}, given an answer to
+        another goal of the same body, merged with that answer.
+        """
+        if not rest:
+            yield first
+            return
+        mapped = And([x.substitute(first) for x in rest])
+        for match in mapped.query(self):
+            try:
+                yield _mergeWithoutOverwriting(first, match)
+            except Conflict:
+                if self.tracer is not None:
+                    self.tracer.conflict(first, match)
+
+    #--------------------------------------------------
+    # tabling
+
+    def _isTabled(self, query):
+        """
+        Return C{True} if answers to C{query} should be tabled, which
+        they should be if it might be answered by a rule with a body.
+        """
+        if query.__class__ is not Term:
+            return False
+        key = predicateKey(query)
+        try:
+            return self._tabled_keys[key]
+        except KeyError:
+            ret = any(keysOverlap(key, x) for x in self._derived)
+            self._tabled_keys[key] = ret
+            return ret
+
+    def _tabledQuery(self, goal):
+        """
+        Answer a goal from its table, filling the table first if needed.
+        """
+        key = variantKey(goal)
+        table = self._tables.get(key)
+        stack = self._table_stack
+        if table is None:
+            table = self._tables[key] = _Table(goal)
+            table.key = key
+            self._evaluate(table)
+        elif table.evaluating or (not table.complete
+                                  and table.epoch == self._epoch):
+            # A recursive call; use the answers found so far.  Whoever
+            # is evaluating the cluster will try again if more turn up.
+            self._in_progress_reads += 1
+            if stack:
+                low = table.depth if table.evaluating else table.low
+                stack[-1].low = min(stack[-1].low, low)
+        elif not table.complete:
+            self._evaluate(table)
+        if stack and stack[-1] is not table:
+            stack[-1].deps.update(table.deps)
+
+        goal_vars = uniqueVars(goal)
+        rename = None
+        if goal_vars != table.vars:
+            rename = dict(zip(table.vars, goal_vars))
+        answers = table.answers
+        i = 0
+        while i < len(answers):
+            values = answers[i]
+            i += 1
+            if rename:
+                values = [x.substitute(rename) for x in values]
+            yield dict(zip(goal_vars, values))
+
+    def _evaluate(self, table):
+        """
+        Find answers for a table's goal by resolving it against my rules.
+
+        If the goal (or anything it calls) reads from a table that is
+        still being evaluated further down the stack, one pass is made
+        and the table is left incomplete; the table at the bottom of
+        that recursive cluster repeats its passes until no new answers
+        turn up and then marks the whole cluster complete.
+        """
+        stack = self._table_stack
+        table.evaluating = True
+        table.depth = table.low = len(stack)
+        table.epoch = self._epoch
+        mark = len(self._incomplete)
+        stack.append(table)
+        try:
+            while True:
+                answers_before = self._answer_count
+                reads_before = self._in_progress_reads
+                for match in self.unique(self._parsedQuery(table.goal),
+                                         table.vars):
+                    if table.addAnswer(match):
+                        self._answer_count += 1
+                if table.low < table.depth:
+                    break
+                if self._answer_count == answers_before:
+                    break
+                if self._in_progress_reads == reads_before:
+                    break
+                self._epoch += 1
+                table.epoch = self._epoch
+        except:
+            self._tables.pop(table.key, None)
+            raise
+        finally:
+            stack.pop()
+            table.evaluating = False
+
+        if table.low < table.depth:
+            self._incomplete.append(table)
+            stack[-1].low = min(stack[-1].low, table.low)
+        else:
+            members = self._incomplete[mark:] + [table]
+            del self._incomplete[mark:]
+            deps = set(table.deps)
+            for member in members:
+                deps.update(member.deps)
+            for member in members:
+                member.complete = True
+                member.deps = deps
+                for dep in deps:
+                    self._table_deps.setdefault(dep, set()).add(member.key)
+
+    def _invalidateTables(self, key):
+        """
+        Forget the tables that depend on predicates matching C{key}.
+        """
+        for dep in list(self._table_deps):
+            if keysOverlap(dep, key):
+                for table_key in self._table_deps.pop(dep):
+                    self._tables.pop(table_key, None)
@@ -0,0 +1,358 @@
+"""
+A fact store for L{prolly.Brain} that keeps ground facts as columns of
+numbers and answers conjunctions of fact goals with NumPy joins.
+
+    brain = Brain(columnar=True)
+
+Each atom and ground term is given a number by a L{SymbolTable}.  The
+facts for each predicate (a functor and an arity) are kept in a
+L{FactTable} as one column of numbers per argument after the functor.
+"""
+
+import numpy as np
+
+from prolly import Atom, Term, Var, TRUE, predicateKey
+
+
+class SymbolTable(object):
+    """
+    I give each atom and ground term a number, counting up from 0.
+    """
+
+    def __init__(self):
+        self.values = []
+        self._codes = {}
+        self._array = None
+
+    def __len__(self):
+        return len(self.values)
+
+    def encode(self, value):
+        """
+        Return the number for C{value}, giving it one if it hasn't got
+        one yet.
+        """
+        try:
+            return self._codes[value]
+        except KeyError:
+            code = self._codes[value] = len(self.values)
+            self.values.append(value)
+            return code
+
+    def lookup(self, value):
+        """
+        Return the number for C{value}, or C{None} if it hasn't got one.
+        """
+        return self._codes.get(value)
+
+    def decode(self, codes):
+        """
+        Turn an array of numbers into an array of the things they stand
+        for.
+        """
+        if self._array is None or len(self._array) != len(self.values):
+            self._array = np.empty(len(self.values), dtype=object)
+            for i, value in enumerate(self.values):
+                self._array[i] = value
+        return self._array[codes]
+
+
+class FactTable(object):
+    """
+    I hold the facts for one predicate as a column of symbol numbers
+    for each argument after the functor.  Facts are added to a list
+    and only moved into the columns when the columns are asked for.
+    """
+
+    def __init__(self, functor, arity):
+        self.functor = functor
+        self.width = arity - 1
+        self._columns = [np.zeros(0, dtype=np.int64)
+                         for i in xrange(self.width)]
+        self._pending = []
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def add(self, codes):
+        self._size += 1
+        if self.width:
+            self._pending.append(codes)
+
+    def remove(self, codes):
+        """
+        Remove every copy of a fact.
+
+        @return: How many there were.
+        """
+        if not self.width:
+            count = self._size
+            self._size = 0
+            return count
+        columns = self.columns()
+        mask = np.ones(self._size, dtype=bool)
+        for column, code in zip(columns, codes):
+            mask &= column == code
+        count = int(mask.sum())
+        if count:
+            keep = ~mask
+            self._columns = [x[keep] for x in columns]
+            self._size -= count
+        return count
+
+    def columns(self):
+        if self._pending:
+            new = np.array(self._pending, dtype=np.int64)
+            self._columns = [np.concatenate([column, new[:, i]])
+                             for i, column in enumerate(self._columns)]
+            self._pending = []
+        return self._columns
+
+
+class Batch(object):
+    """
+    I am the bindings of some variables for many answers at once:
+    C{columns} has a column of symbol numbers for each of C{vars} and
+    a row for each answer.
+    """
+
+    def __init__(self, symbols, vars, columns, size):
+        self.symbols = symbols
+        self.vars = vars
+        self.columns = columns
+        self.size = size
+
+    def __len__(self):
+        return self.size
+
+    def dicts(self):
+        """
+        Generate a dict of variables to values for each answer.
+        """
+        if not self.vars:
+            for i in xrange(self.size):
+                yield {}
+            return
+        decoded = [self.symbols.decode(x) for x in self.columns]
+        vars = self.vars
+        for row in zip(*decoded):
+            yield dict(zip(vars, row))
+
+    def join(self, other):
+        """
+        Combine my answers with those of another batch that agree on
+        the variables we share.
+        """
+        shared = [v for v in other.vars if v in self.vars]
+        if not shared:
+            left = np.repeat(np.arange(self.size), other.size)
+            right = np.tile(np.arange(other.size), self.size)
+        else:
+            left_key, right_key = self._keys(other, shared)
+            left, right = sortMergeJoin(left_key, right_key)
+        columns = [x[left] for x in self.columns]
+        vars = list(self.vars)
+        for var, column in zip(other.vars, other.columns):
+            if var not in shared:
+                vars.append(var)
+                columns.append(column[right])
+        return Batch(self.symbols, vars, columns, len(left))
+
+    def _keys(self, other, shared):
+        """
+        Return a number for the values of C{shared} in each of my rows
+        and in each of C{other}'s, the same number for the same values.
+        """
+        mine = [self.columns[self.vars.index(v)] for v in shared]
+        theirs = [other.columns[other.vars.index(v)] for v in shared]
+        if len(shared) == 1:
+            return mine[0], theirs[0]
+        base = max(len(self.symbols), 1)
+        if base ** len(shared) < 2 ** 62:
+            def combine(columns):
+                key = np.zeros(len(columns[0]), dtype=np.int64)
+                for column in columns:
+                    key = key * base + column
+                return key
+            return combine(mine), combine(theirs)
+        both = np.concatenate([np.column_stack(mine),
+                               np.column_stack(theirs)])
+        codes = np.unique(both, axis=0, return_inverse=True)[1]
+        return codes[:self.size], codes[self.size:]
+
+
+def sortMergeJoin(left_key, right_key):
+    """
+    Find the pairs of positions in two arrays that hold the same value.
+
+    @return: Two arrays of positions, one into each of C{left_key} and
+        C{right_key}.
+    """
+    order = np.argsort(right_key, kind='mergesort')
+    ordered = right_key[order]
+    low = np.searchsorted(ordered, left_key, 'left')
+    high = np.searchsorted(ordered, left_key, 'right')
+    counts = high - low
+    left = np.repeat(np.arange(len(left_key)), counts)
+    offsets = np.arange(len(left)) - np.repeat(np.cumsum(counts) - counts,
+                                               counts)
+    right = order[np.repeat(low, counts) + offsets]
+    return left, right
+
+
+class ColumnarStore(object):
+    """
+    I hold ground facts whose first argument is an atom in
+    L{FactTable}s.
+    """
+
+    def __init__(self):
+        self.symbols = SymbolTable()
+        self.tables = {}
+
+    def __len__(self):
+        return sum(len(x) for x in self.tables.values())
+
+    def canStore(self, rule):
+        """
+        Return C{True} if C{rule} is a fact I can hold.
+        """
+        head = rule.head
+        return (head.__class__ is Term and head.ground and bool(head.args)
+                and isinstance(head.args[0], Atom) and rule.body is TRUE)
+
+    def add(self, term):
+        key = predicateKey(term)
+        table = self.tables.get(key)
+        if table is None:
+            table = self.tables[key] = FactTable(term.args[0], len(term.args))
+        encode = self.symbols.encode
+        table.add(tuple([encode(x) for x in term.args[1:]]))
+
+    def remove(self, term):
+        """
+        Remove every copy of a fact.
+
+        @return: How many there were.
+        """
+        table = self.tables.get(predicateKey(term))
+        if table is None:
+            return 0
+        codes = []
+        for arg in term.args[1:]:
+            code = self.symbols.lookup(arg)
+            if code is None:
+                return 0
+            codes.append(code)
+        return table.remove(codes)
+
+    def facts(self, arity, args):
+        """
+        Generate the facts that might match a term with the given
+        C{args}.  Arguments that aren't ground match anything.
+        """
+        first = args[0] if args else None
+        if isinstance(first, Atom):
+            tables = [self.tables.get((arity, first.value))]
+        elif first is not None and not first.ground:
+            tables = [t for k, t in self.tables.items() if k[0] == arity]
+        else:
+            return
+        decode = self.symbols.decode
+        for table in tables:
+            if table is None:
+                continue
+            if not table.width:
+                for i in xrange(len(table)):
+                    yield Term(table.functor)
+                continue
+            columns = table.columns()
+            mask = self._constantMask(columns, args[1:])
+            if mask is False:
+                continue
+            elif mask is not None:
+                columns = [x[mask] for x in columns]
+            functor = table.functor
+            for row in zip(*[decode(x) for x in columns]):
+                yield Term(functor, *row)
+
+    def _constantMask(self, columns, args):
+        """
+        Return a mask of the rows whose values are the same as the
+        ground C{args}, C{None} if there aren't any ground C{args} or
+        C{False} if no row could match.
+        """
+        mask = None
+        for arg, column in zip(args, columns):
+            if arg.ground:
+                code = self.symbols.lookup(arg)
+                if code is None:
+                    return False
+                match = column == code
+                mask = match if mask is None else mask & match
+        return mask
+
+    def select(self, goal):
+        """
+        Find the facts that match a goal whose first argument is an
+        atom and whose other arguments are atoms, ground terms or
+        variables.
+
+        @return: A L{Batch} of the bindings of the goal's variables.
+        """
+        vars = []
+        columns = []
+        table = self.tables.get(predicateKey(goal))
+        if table is None:
+            return self._empty(goal)
+        if not table.width:
+            return Batch(self.symbols, vars, columns, len(table))
+        all_columns = table.columns()
+        mask = self._constantMask(all_columns, goal.args[1:])
+        if mask is False:
+            return self._empty(goal)
+        for arg, column in zip(goal.args[1:], all_columns):
+            if arg.__class__ is not Var:
+                continue
+            elif arg in vars:
+                match = column == columns[vars.index(arg)]
+                mask = match if mask is None else mask & match
+            else:
+                vars.append(arg)
+                columns.append(column)
+        if mask is None:
+            size = len(table)
+        else:
+            columns = [x[mask] for x in columns]
+            size = int(np.count_nonzero(mask))
+        return Batch(self.symbols, vars, columns, size)
+
+    def _empty(self, goal):
+        vars = []
+        for arg in goal.args:
+            if arg.__class__ is Var and arg not in vars:
+                vars.append(arg)
+        return Batch(self.symbols, vars,
+                     [np.zeros(0, dtype=np.int64) for v in vars], 0)
+
+    def join(self, goals):
+        """
+        Find the answers to a conjunction of goals like those
+        L{select} takes.  Each goal is joined with the answers to the
+        goals before it, preferring goals that share a variable with
+        those answers so as not to make every combination.
+
+        @return: A L{Batch}.
+        """
+        remaining = list(goals)
+        batch = self.select(remaining.pop(0))
+        while remaining:
+            index = 0
+            for i, goal in enumerate(remaining):
+                if any(x.__class__ is Var and x in batch.vars
+                       for x in goal.args):
+                    index = i
+                    break
+            batch = batch.join(self.select(remaining.pop(index)))
+        return batch
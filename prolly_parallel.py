@@ -0,0 +1,182 @@
+"""
+OR-parallel queries for L{prolly.Brain}s, for long searches that are
+worth spreading over several processes.
+
+    pool = QueryPool(brain, processes=4)
+    for answer in pool.query('(murderer, X)'):
+        ...
+    pool.close()
+
+The search for a query's answers branches once for each rule that
+matches the query and, within a rule with a body, once for each answer
+to the first goal of its body.  Each worker takes every Nth of these
+branches and finds the answers down them.  Every worker goes through
+the rules and the first goals' answers to count the branches, so the
+split only pays off when the rest of the search is the expensive part.
+
+The workers each get a copy of the brain's rules, pickled once when
+the pool is made.  Anything added to the brain after that isn't seen
+by the pool.
+"""
+
+import pickle
+import multiprocessing
+
+from prolly import Var, And, SpecialTerm, AnswerSet, Conflict, Brain
+from prolly import resolve, matchGround, uniqueVars, describeGoal
+from prolly import _mergeWithoutOverwriting, _TRUE
+
+
+_brain = None
+
+
+def _startWorker(rules, options):
+    """
+    Make the brain a worker process answers queries with.
+    """
+    global _brain
+    _brain = Brain(**options)
+    _brain._addRules(pickle.loads(rules))
+
+
+def _answerPart(args):
+    """
+    Answer a pickled query down every C{parts}th branch of its search,
+    starting with branch C{part}.
+
+    @return: A list of tuples of values for the query's variables, with
+        C{None} for variables left unbound.
+    """
+    query, part, parts = args
+    query = pickle.loads(query)
+    query_vars = uniqueVars(query)
+    ret = []
+    for match in branchAnswers(_brain, query, part, parts):
+        ret.append(tuple([match.get(v) for v in query_vars]))
+    return ret
+
+
+def branchAnswers(brain, query, part, parts):
+    """
+    Generate the answers to C{query} found down every C{parts}th branch
+    of its search, starting with branch C{part}, as dicts like those
+    L{Brain.parsedQuery} generates.
+    """
+    if isinstance(query, SpecialTerm):
+        if part == 0:
+            for match in query.query(brain):
+                yield match
+        return
+    query_vars = uniqueVars(query)
+    var_set = set(query_vars)
+    branch = -1
+    for rule in brain._candidates(query):
+        if var_set and not var_set.isdisjoint(rule.variables()):
+            rule = rule.rename()
+        if rule.matcher is None:
+            bindings = matchGround(rule.head, query)
+        else:
+            bindings = rule.matcher(query)
+        if bindings is None:
+            continue
+        if isinstance(rule.body, _TRUE):
+            branch += 1
+            if branch % parts == part:
+                yield {var: resolve(var, bindings) for var in query_vars
+                       if var in bindings}
+            continue
+        mapping = {k: resolve(k, bindings) for k in bindings}
+        goals = rule.body.substitute(mapping).parts
+        if brain.planning and len(goals) > 1:
+            goals = brain._plan(goals, describeGoal)
+        rest = And(goals[1:])
+        for first in goals[0].query(brain):
+            branch += 1
+            if branch % parts != part:
+                continue
+            for match in _finish(brain, first, rest):
+                answer = {}
+                for var in query_vars:
+                    if var in bindings:
+                        answer[var] = resolve(var, bindings).substitute(match)
+                    elif var in match:
+                        answer[var] = match[var]
+                yield answer
+
+
+def _finish(brain, first, rest):
+    """
+    Generate the answers to the goals after the first of a rule's body,
+    given an answer to the first, merged with that answer.
+    """
+    if not rest.parts:
+        yield first
+        return
+    mapped = [x.substitute(first) for x in rest.parts]
+    for match in rest._partialQuery(mapped, brain):
+        try:
+            yield _mergeWithoutOverwriting(first, match)
+        except Conflict:
+            if brain.tracer is not None:
+                brain.tracer.conflict(first, match)
+
+
+class QueryPool(object):
+    """
+    I answer queries against a snapshot of a L{Brain} with a pool of
+    worker processes.
+
+    @ivar parts: How many pieces each query is split into.  There are
+        more pieces than processes so that a process that gets an easy
+        piece can take another.
+    """
+
+    def __init__(self, brain, processes=None, parts=None):
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+        self.processes = processes
+        self.parts = parts or processes * 4
+        self.brain = brain
+        rules = pickle.dumps(list(brain._candidates(Var('_'))), 2)
+        options = {
+            'tabling': brain.tabling,
+            'compiled': brain.compiled,
+            'engine': brain.engine,
+            'planning': brain.planning,
+        }
+        self._pool = multiprocessing.Pool(processes, _startWorker,
+                                          (rules, options))
+
+    def query(self, query):
+        """
+        Query the brain, generating answers as the workers find them.
+        The answers are those L{Brain.query} would give, though not in
+        the same order.
+        """
+        query = self.brain._parseQuery(query)
+        query_vars = uniqueVars(query)
+        pickled = pickle.dumps(query, 2)
+        seen = AnswerSet()
+        tasks = [(pickled, i, self.parts) for i in xrange(self.parts)]
+        for values in self._answers(tasks):
+            values = tuple([var if value is None else value
+                            for var, value in zip(query_vars, values)])
+            if not seen.add(values):
+                continue
+            ret = {}
+            for var, value in zip(query_vars, values):
+                if value is not var:
+                    ret[var.humanValue()] = value.humanValue()
+            yield ret
+
+    def _answers(self, tasks):
+        for result in self._pool.imap_unordered(_answerPart, tasks):
+            for values in result:
+                yield values
+
+    def close(self):
+        """
+        Stop the worker processes.
+        """
+        self._pool.close()
+        self._pool.join()
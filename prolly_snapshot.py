@@ -0,0 +1,387 @@
+"""
+A binary snapshot of a L{prolly.Brain}'s rules and index, so that a
+brain can be started without parsing anything.
+
+    brain.save('world.brain')
+    brain = Brain.open('world.brain')
+
+The file holds:
+
+  - a pickled table of the atoms, variable names and term classes the
+    rules use, and of what the brain knows about which predicates are
+    derived from which,
+
+  - each rule as an array of 32-bit numbers standing for its atoms,
+    variables and terms, with an array of where each rule starts,
+
+  - the brain's L{prolly.RuleIndex} as an array of rule numbers for
+    each key it files rules under, with a directory of where each key's
+    numbers are.
+
+Opening a snapshot maps the file into memory and decodes the table of
+atoms.  A rule is only decoded the first time it's a candidate for a
+query, and the rule numbers for a key are only read the first time
+the key is looked up, so processes that open the same file share its
+pages until they need them.
+"""
+
+import sys
+import mmap
+import struct
+import marshal
+import cPickle as pickle
+from array import array
+
+from prolly import Atom, Var, Rule, And, TRUE, RuleIndex, predicateKey
+from prolly import _ANY, _VAR_HEADS, _TRUE
+
+
+MAGIC = 'PROLLY\x00\x01'
+_HEADER = struct.Struct('<8s6Q')
+
+_ATOM, _VAR, _TERM, _BODY = range(4)
+
+
+def _littleEndian(numbers):
+    """
+    Return the bytes of an array of 32-bit numbers in little-endian
+    order.
+    """
+    if sys.byteorder == 'big':
+        numbers = array('I', numbers)
+        numbers.byteswap()
+    return numbers.tostring()
+
+
+class _Encoder(object):
+    """
+    I turn rules into arrays of numbers, giving numbers to the atoms,
+    variable names and term classes as I find them.
+
+    Each number's lowest two bits say what it is: an atom, a variable,
+    a term (followed by its arguments) or the start of a body.
+    """
+
+    def __init__(self):
+        self.symbols = []
+        self.names = []
+        self.classes = []
+        self._codes = {}
+        self._name_codes = {}
+        self._class_codes = {}
+
+    def symbol(self, atom):
+        try:
+            return self._codes[atom]
+        except KeyError:
+            code = self._codes[atom] = len(self.symbols)
+            self.symbols.append(atom.value)
+            return code
+
+    def rule(self, rule, out):
+        self.thing(rule.head, out)
+        if isinstance(rule.body, _TRUE):
+            out.append(_BODY)
+        else:
+            out.append(((len(rule.body.parts) + 1) << 2) | _BODY)
+            for part in rule.body.parts:
+                self.thing(part, out)
+
+    def thing(self, thing, out):
+        if isinstance(thing, Atom):
+            out.append((self.symbol(thing) << 2) | _ATOM)
+        elif isinstance(thing, Var):
+            try:
+                code = self._name_codes[thing.name]
+            except KeyError:
+                code = self._name_codes[thing.name] = len(self.names)
+                self.names.append(thing.name)
+            out.append((code << 2) | _VAR)
+        else:
+            cls = thing.__class__
+            try:
+                code = self._class_codes[cls]
+            except KeyError:
+                code = self._class_codes[cls] = len(self.classes)
+                self.classes.append((cls.__module__, cls.__name__))
+            out.append((((code << 16) | len(thing.args)) << 2) | _TERM)
+            for arg in thing.args:
+                self.thing(arg, out)
+
+    def key(self, key):
+        """
+        Encode a L{RuleIndex} key as a tuple of numbers.
+        """
+        if key == _VAR_HEADS:
+            return (5,)
+        elif key[0] == 'arity':
+            return (0, key[1])
+        elif key[0] == 'atom':
+            return (4, self.symbol(key[1]))
+        arity, i, what = key
+        if what is _ANY:
+            return (3, arity, i)
+        elif isinstance(what, Atom):
+            return (1, arity, i, self.symbol(what))
+        return (2, arity, i, what[1])
+
+
+def saveSnapshot(brain, path):
+    """
+    Write a snapshot of every rule C{brain} can use, including those of
+    the brains it's built on and the facts in its columnar store.
+    """
+    rules = list(brain._candidates(Var('_')))
+    encoder = _Encoder()
+    starts = array('I', [0])
+    tokens = array('I')
+    for rule in rules:
+        encoder.rule(rule, tokens)
+        starts.append(len(tokens))
+    index = RuleIndex()
+    index.extend(0, [rule.head for rule in rules])
+    postings = array('I')
+    directory = {}
+    for key, rule_ids in index._postings.iteritems():
+        directory[encoder.key(key)] = (len(postings), len(rule_ids))
+        postings.extend(rule_ids)
+    meta = pickle.dumps({
+        'count': len(rules),
+        'symbols': encoder.symbols,
+        'names': encoder.names,
+        'classes': encoder.classes,
+        'rule_keys': set(predicateKey(x.head) for x in rules),
+        'derived': brain._derived,
+        'bodies': brain._bodies,
+        'unstratified': brain._unstratified,
+    }, 2)
+    sections = [meta, _littleEndian(starts), _littleEndian(tokens),
+                _littleEndian(postings), marshal.dumps(directory)]
+    offsets = []
+    offset = _HEADER.size
+    for section in sections:
+        # keep the arrays of numbers aligned
+        offset += -offset % 8
+        offsets.append(offset)
+        offset += len(section)
+    with open(path, 'wb') as f:
+        f.write(_HEADER.pack(MAGIC, len(rules), *offsets))
+        for section, offset in zip(sections, offsets):
+            f.write('\x00' * (offset - f.tell()))
+            f.write(section)
+
+
+class Snapshot(object):
+    """
+    I am a snapshot file mapped into memory.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        header = _HEADER.unpack_from(self._map, 0)
+        if header[0] != MAGIC:
+            raise ValueError('{0} is not a brain snapshot'.format(path))
+        self.count = header[1]
+        (meta, self._starts, self._tokens, self._postings,
+         directory) = header[2:]
+        self.meta = pickle.loads(self._map[meta:self._starts])
+        self.directory = marshal.loads(self._map[directory:])
+        self.symbols = [Atom(x) for x in self.meta['symbols']]
+        self.codes = {atom: i for i, atom in enumerate(self.symbols)}
+        self.names = self.meta['names']
+        self.classes = []
+        for module, name in self.meta['classes']:
+            __import__(module)
+            self.classes.append(getattr(sys.modules[module], name))
+
+    def rule(self, i):
+        """
+        Decode rule number C{i}.
+        """
+        start, end = struct.unpack_from('<2I', self._map,
+                                        self._starts + 4 * i)
+        tokens = struct.unpack_from('<%dI' % (end - start), self._map,
+                                    self._tokens + 4 * start)
+        variables = {}
+        head, pos = self._thing(tokens, 0, variables)
+        count = tokens[pos] >> 2
+        pos += 1
+        if not count:
+            return Rule(head, TRUE)
+        parts = []
+        for j in xrange(count - 1):
+            part, pos = self._thing(tokens, pos, variables)
+            parts.append(part)
+        return Rule(head, And(parts))
+
+    def _thing(self, tokens, pos, variables):
+        token = tokens[pos]
+        kind = token & 3
+        code = token >> 2
+        if kind == _ATOM:
+            return self.symbols[code], pos + 1
+        elif kind == _VAR:
+            try:
+                return variables[code], pos + 1
+            except KeyError:
+                var = variables[code] = Var(self.names[code])
+                return var, pos + 1
+        pos += 1
+        args = []
+        for j in xrange(code & 0xffff):
+            arg, pos = self._thing(tokens, pos, variables)
+            args.append(arg)
+        return self.classes[code >> 16](*args), pos
+
+    def ruleIds(self, key):
+        """
+        Read the numbers of the rules filed under an encoded index key.
+
+        @raise KeyError: If there aren't any.
+        """
+        start, count = self.directory[key]
+        ret = array('I')
+        offset = self._postings + 4 * start
+        ret.fromstring(self._map[offset:offset + 4 * count])
+        if sys.byteorder == 'big':
+            ret.byteswap()
+        return ret
+
+    def key(self, key):
+        """
+        Encode a L{RuleIndex} key the way L{_Encoder.key} does.
+
+        @raise KeyError: If it has an atom I have no number for.
+        """
+        if key == _VAR_HEADS:
+            return (5,)
+        elif key[0] == 'arity':
+            return (0, key[1])
+        elif key[0] == 'atom':
+            return (4, self.codes[key[1]])
+        arity, i, what = key
+        if what is _ANY:
+            return (3, arity, i)
+        elif isinstance(what, Atom):
+            return (1, arity, i, self.codes[what])
+        return (2, arity, i, what[1])
+
+    def decodeKey(self, key):
+        """
+        Turn an encoded index key back into a L{RuleIndex} key.
+        """
+        kind = key[0]
+        if kind == 5:
+            return _VAR_HEADS
+        elif kind == 0:
+            return ('arity', key[1])
+        elif kind == 4:
+            return ('atom', self.symbols[key[1]])
+        elif kind == 3:
+            return (key[1], key[2], _ANY)
+        elif kind == 1:
+            return (key[1], key[2], self.symbols[key[3]])
+        return (key[1], key[2], ('term', key[3]))
+
+
+class SnapshotRules(object):
+    """
+    I am the list of a L{Brain}'s rules when it was opened from a
+    snapshot.  Each rule is decoded the first time it's asked for.
+    Rules added to the brain afterwards are kept after them.
+    """
+
+    def __init__(self, snapshot):
+        self._snapshot = snapshot
+        self._decoded = [None] * snapshot.count
+        self._added = []
+
+    def __len__(self):
+        return len(self._decoded) + len(self._added)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[x] for x in xrange(*i.indices(len(self)))]
+        size = len(self._decoded)
+        if i < 0:
+            i += len(self)
+        if i >= size:
+            return self._added[i - size]
+        rule = self._decoded[i]
+        if rule is None:
+            rule = self._decoded[i] = self._snapshot.rule(i)
+            rule.compile()
+        return rule
+
+    def __iter__(self):
+        for i in xrange(len(self)):
+            yield self[i]
+
+    def append(self, rule):
+        self._added.append(rule)
+
+
+class SnapshotPostings(dict):
+    """
+    I am a L{RuleIndex}'s postings when its brain was opened from a
+    snapshot.  The rule numbers for a key are read the first time the
+    key is looked up.
+    """
+
+    def __init__(self, snapshot):
+        dict.__init__(self)
+        self._snapshot = snapshot
+
+    def __missing__(self, key):
+        snapshot = self._snapshot
+        ret = self[key] = snapshot.ruleIds(snapshot.key(key))
+        return ret
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def iterkeys(self):
+        """
+        Generate every key, whether or not its rule numbers have been
+        read.
+        """
+        snapshot = self._snapshot
+        seen = set()
+        for key in snapshot.directory:
+            key = snapshot.decodeKey(key)
+            seen.add(key)
+            yield key
+        for key in dict.keys(self):
+            if key not in seen:
+                yield key
+
+
+def openSnapshot(cls, path, **kwargs):
+    """
+    Make a brain of class C{cls} with the rules in a snapshot.  Brains
+    that materialize or have a columnar store are given every rule
+    straight away, and brains that plan decode every rule to count
+    them.
+    """
+    brain = cls(**kwargs)
+    snapshot = Snapshot(path)
+    if brain._materialized is not None or brain._columns is not None:
+        brain._addRules([snapshot.rule(i) for i in xrange(snapshot.count)])
+        return brain
+    meta = snapshot.meta
+    brain._rules = SnapshotRules(snapshot)
+    brain._index = RuleIndex()
+    brain._index._postings = SnapshotPostings(snapshot)
+    brain._index._count = snapshot.count
+    brain._rule_keys.update(meta['rule_keys'])
+    brain._derived.update(meta['derived'])
+    brain._bodies.extend(meta['bodies'])
+    brain._findUnstratified()
+    if brain.planning:
+        for rule in brain._rules:
+            brain._countRule(predicateKey(rule.head), rule)
+    return brain
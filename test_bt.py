@@ -0,0 +1,468 @@
+import collections
+from unittest import TestCase
+
+import bt
+from bt import OK, FAIL, RUNNING
+
+
+class Scripted(bt._BaseNode):
+    """
+    I give the statuses in my script, one a tick, and write down each
+    hook that's called on me.
+    """
+
+    def __init__(self, name, script, log):
+        self.name = name
+        self.script = list(script)
+        self.log = log
+        self.ticks = 0
+
+    def enter(self, ctx):
+        self.log.append((self.name, 'enter'))
+
+    def open(self, ctx):
+        self.log.append((self.name, 'open'))
+
+    def tick(self, ctx):
+        status = self.script[self.ticks % len(self.script)]
+        self.ticks += 1
+        self.log.append((self.name, 'tick', status))
+        return status
+
+    def close(self, ctx):
+        self.log.append((self.name, 'close'))
+
+    def exit(self, ctx):
+        self.log.append((self.name, 'exit'))
+
+
+class LoudSequence(bt.Sequence):
+
+    def __init__(self, name, children, log):
+        bt.Sequence.__init__(self, name, children)
+        self.log = log
+
+    def open(self, ctx):
+        self.log.append((self.name, 'open'))
+
+    def close(self, ctx):
+        self.log.append((self.name, 'close'))
+
+    def exit(self, ctx):
+        self.log.append((self.name, 'exit'))
+
+
+class SelfRunning(bt._BaseNode):
+    """
+    I run my child myself.
+    """
+
+    def __init__(self, child, log):
+        self.child = child
+        self.log = log
+
+    def run(self, ctx):
+        self.log.append(('self-running', 'run'))
+        return self.child.run(ctx)
+
+
+def makeTree(log):
+    def leaf(name, *script):
+        return Scripted(name, script, log)
+    return LoudSequence('top', [bt.Priority('root', [
+        bt.Sequence('seq', [
+            leaf('a', OK, OK, FAIL),
+            bt.Inverter(leaf('b', FAIL, RUNNING, OK, None)),
+        ]),
+        bt.MemSequence('memseq', [
+            leaf('c', OK, RUNNING, OK),
+            leaf('d', RUNNING, RUNNING, OK, FAIL),
+            leaf('e', OK),
+        ]),
+        LoudSequence('loud', [
+            bt.MemPriority('mempri', [
+                leaf('f', FAIL, RUNNING, FAIL),
+                leaf('g', RUNNING, FAIL, OK),
+            ]),
+            SelfRunning(leaf('h', OK, RUNNING), log),
+            bt.WaitAction(0),
+        ], log),
+        bt.Sequence('empty'),
+        bt.Priority('empty too'),
+        leaf('i', RUNNING, OK, None),
+    ])], log)
+
+
+class CompiledTest(TestCase):
+
+    def tickAll(self, compiled, ticks=40):
+        log = []
+        tree = bt.BehaviorTree(makeTree(log), compiled=compiled)
+        blackboard = bt.Blackboard()
+        ret = []
+        for i in xrange(ticks):
+            status = tree.tick('agent', blackboard)
+            memory = blackboard.memory(tree)
+            # nodes left open last tick are closed in no particular order
+            end = log.index(('top', 'exit')) + 1
+            ret.append((status, memory['node_count'],
+                sorted(repr(x) for x in memory['open_nodes']),
+                log[:end], sorted(log[end:])))
+            del log[:]
+        return ret
+
+    def test_same_as_recursive(self):
+        """
+        A compiled tree runs its nodes in the same order, calls the same
+        hooks and gives the same statuses as one that calls each
+        node's C{run}.
+        """
+        compiled = self.tickAll(True)
+        recursive = self.tickAll(False)
+        for i, (x, y) in enumerate(zip(compiled, recursive)):
+            self.assertEqual(x, y, 'tick {0}'.format(i))
+        statuses = set(x[0] for x in compiled)
+        self.assertEqual(statuses, set([OK, RUNNING, None]))
+
+    def test_program(self):
+        """
+        Each node gets an instruction, with the numbers of its
+        children's instructions, and hooks nobody overrides are left
+        out.
+        """
+        seq = bt.Sequence('seq', [bt.WaitAction(1), bt.Inverter(
+            bt.SaySomething('hi'))])
+        program = bt.compileTree(seq)
+        self.assertEqual([x[1] for x in program.code],
+            [seq, seq.children[0], seq.children[1], seq.children[1].child])
+        self.assertEqual([x[2] for x in program.code], [0, 1, 2, 3])
+        self.assertEqual([x[3] for x in program.code], [(1, 2), (), (3,), ()])
+        op, node, slot, kids, enter, opener, tick, closer, exiter = \
+            program.code[1]
+        self.assertEqual((enter, closer, exiter), (None, None, None))
+        self.assertEqual(opener, seq.children[0].open)
+
+    def test_memory(self):
+        """
+        A L{bt.MemSequence} picks up where it left off, keeping the
+        same memory as the one run node by node would.
+        """
+        for compiled in [True, False]:
+            walk = [Scripted(x, [RUNNING, OK], []) for x in 'abc']
+            tree = bt.BehaviorTree(bt.MemSequence('walk', walk),
+                                   compiled=compiled)
+            blackboard = bt.Blackboard()
+            statuses = [tree.tick('agent', blackboard) for i in xrange(4)]
+            self.assertEqual(statuses, [RUNNING, RUNNING, RUNNING, OK])
+            self.assertEqual(dict(blackboard.memory(tree, tree.root)),
+                             {'running_child_idx': 2})
+
+    def test_overridden_tick(self):
+        """
+        A L{bt.MemSequence} whose C{tick} is overridden is ticked as any
+        other node, with its C{open} setting up its memory first.
+        """
+        class Loud(bt.MemSequence):
+            def tick(self, ctx):
+                return bt.MemSequence.tick(self, ctx)
+
+        for compiled in [True, False]:
+            walk = [Scripted(x, [RUNNING, OK], []) for x in 'abc']
+            tree = bt.BehaviorTree(Loud('walk', walk), compiled=compiled)
+            blackboard = bt.Blackboard()
+            statuses = [tree.tick('agent', blackboard) for i in xrange(4)]
+            self.assertEqual(statuses, [RUNNING, RUNNING, RUNNING, OK])
+
+    def test_debug(self):
+        """
+        Trees that debug are run node by node so that every step is
+        seen.
+        """
+        seen = []
+        tree = bt.BehaviorTree(bt.Sequence('seq', [bt.SaySomething('')]),
+            debug=lambda *args: seen.append(args[1]))
+        tree.root.children[0].tick = lambda ctx: OK
+        tree.tick('agent', bt.Blackboard())
+        self.assertEqual(seen.count('nodeTicked'), 2)
+
+
+class MemoryTest(TestCase):
+
+    def test_fields(self):
+        """
+        A L{bt.NodeMemory} works like a C{dict}, whether a key is one of
+        its fields or not.
+        """
+        memory = bt.NodeMemory()
+        self.assertEqual(dict(memory), {})
+        self.assertFalse(memory.is_open)
+        self.assertEqual(memory.get('is_open', False), False)
+        self.assertRaises(KeyError, lambda: memory['end_time'])
+        memory['is_open'] = True
+        memory['spot'] = (1, 2)
+        memory.running_child_idx = 0
+        self.assertEqual(dict(memory),
+            {'is_open': True, 'spot': (1, 2), 'running_child_idx': 0})
+        self.assertTrue('spot' in memory)
+        self.assertEqual(memory.setdefault('spot', None), (1, 2))
+        self.assertEqual(memory.pop('is_open'), True)
+        self.assertEqual(memory.pop('is_open', None), None)
+        self.assertRaises(KeyError, memory.pop, 'is_open')
+        del memory['spot']
+        self.assertEqual(memory.items(), [('running_child_idx', 0)])
+
+    def test_mapping(self):
+        """
+        Memories have the whole interface of a C{dict}, as blackboards'
+        memories did before they had fixed fields.
+        """
+        memory = bt.NodeMemory()
+        self.assertTrue(isinstance(memory, collections.MutableMapping))
+        self.assertFalse(hasattr(memory, '__dict__'))
+        memory.update({'is_open': True, 'spot': (1, 2)}, end_time=3)
+        self.assertEqual(sorted(memory.values()), [True, 3, (1, 2)])
+        self.assertEqual(sorted(memory.iteritems()),
+            [('end_time', 3), ('is_open', True), ('spot', (1, 2))])
+        copy = memory.copy()
+        self.assertEqual(type(copy), dict)
+        self.assertEqual(memory, copy)
+        copy['spot'] = None
+        self.assertNotEqual(memory, copy)
+        memory.clear()
+        self.assertEqual(len(memory), 0)
+        self.assertEqual(memory.is_open, bt._MISSING)
+
+    def test_other_trees(self):
+        """
+        Trees that don't number their nodes get a C{dict}, with their
+        nodes' memories kept by node, and their nodes can be run.
+        """
+        class OtherTree(object):
+            pass
+
+        tree = OtherTree()
+        clock = Clock()
+        wait = bt.WaitAction(1, clock)
+        go = Scripted('go', [OK], [])
+        walk = bt.MemSequence('walk', [go, wait])
+        blackboard = bt.Blackboard()
+        self.assertEqual(wait.run(bt.TickContext(tree, 'agent', blackboard)),
+                         RUNNING)
+        clock.now = 0.5
+        self.assertEqual(walk.run(bt.TickContext(tree, 'agent', blackboard)),
+                         RUNNING)
+        memory = blackboard.memory(tree)
+        self.assertEqual(type(memory), dict)
+        self.assertEqual(dict(memory['_node_memory']), {
+            wait: {'is_open': True, 'end_time': 1},
+            walk: {'is_open': True, 'running_child_idx': 1},
+            go: {},
+        })
+        self.assertTrue(blackboard.memory(tree, wait) is
+                        memory['_node_memory'][wait])
+        clock.now = 1
+        self.assertEqual(walk.run(bt.TickContext(tree, 'agent', blackboard)),
+                         OK)
+        self.assertEqual(dict(blackboard.memory(tree, walk)),
+                         {'running_child_idx': 1})
+
+    def test_slots(self):
+        """
+        Each node of a tree is numbered when the tree is made, and its
+        memory on a blackboard is kept under its number.
+        """
+        wait = bt.WaitAction(10)
+        say = bt.SaySomething('hi')
+        root = bt.Priority('root', [bt.Inverter(wait), say])
+        for compiled in [True, False]:
+            tree = bt.BehaviorTree(root, compiled=compiled)
+            self.assertEqual(tree.slots,
+                {root: 0, root.children[0]: 1, wait: 2, say: 3})
+            blackboard = bt.Blackboard()
+            self.assertEqual(tree.tick('agent', blackboard), RUNNING)
+            nodes = blackboard.memory(tree).nodes
+            self.assertTrue(blackboard.memory(tree, wait) is nodes[2])
+            self.assertEqual(nodes[3], None)
+            self.assertTrue(nodes[2].end_time > 0)
+            self.assertEqual(sorted(dict(nodes[0])), ['is_open'])
+            other = bt.SaySomething('bye')
+            self.assertEqual(tree.slot(other), 4)
+            self.assertEqual(dict(blackboard.memory(tree, other)), {})
+            self.assertEqual(len(nodes), 5)
+
+
+class Healthy(bt._BaseNode):
+    """
+    I check whether my target is healthy, one target at a time or all
+    at once.
+    """
+
+    def __init__(self):
+        self.ticked = []
+
+    def tick(self, ctx):
+        self.ticked.append(ctx.target)
+        if ctx.target >= 50:
+            return OK
+        return FAIL
+
+    def tickColumns(self, columns, targets):
+        return [OK if x >= 50 else FAIL for x in columns['health']]
+
+
+class TickManyTest(TestCase):
+
+    def test_same_as_tick(self):
+        """
+        Ticking many targets at once does what ticking each in turn
+        does.
+        """
+        results = []
+        for many in [False, True]:
+            log = []
+            tree = bt.BehaviorTree(makeTree(log))
+            blackboards = [bt.Blackboard() for i in xrange(3)]
+            targets = ['ann', 'bob', 'cat']
+            frames = []
+            for i in xrange(12):
+                if many:
+                    statuses = tree.tickMany(targets, blackboards)
+                else:
+                    statuses = [tree.tick(x, y)
+                                for x, y in zip(targets, blackboards)]
+                frames.append((statuses, sorted(log),
+                    [x.memory(tree).node_count for x in blackboards]))
+                del log[:]
+            results.append(frames)
+        self.assertEqual(results[0], results[1])
+
+    def test_mismatched(self):
+        """
+        Each target needs a blackboard, and nothing is ticked if one is
+        missing.
+        """
+        log = []
+        tree = bt.BehaviorTree(makeTree(log))
+        self.assertRaises(ValueError, tree.tickMany, ['ann', 'bob'],
+                          [bt.Blackboard()])
+        self.assertEqual(log, [])
+
+    def test_columns(self):
+        """
+        Leaves that can check every target at once are asked to, once,
+        instead of being ticked for each target.
+        """
+        healthy = Healthy()
+        root = bt.Priority('root', [
+            bt.Sequence('fine', [healthy, Scripted('wander', [RUNNING], [])]),
+            bt.Inverter(bt.WaitAction(10)),
+        ])
+        targets = [10, 60, 50, 0]
+        columns = {'health': targets}
+        for compiled in [True, False]:
+            del healthy.ticked[:]
+            tree = bt.BehaviorTree(root, compiled=compiled)
+            blackboards = [bt.Blackboard() for x in targets]
+            self.assertEqual(tree.tickMany(targets, blackboards, columns),
+                             [RUNNING] * 4)
+            self.assertEqual(
+                [sorted(dict(x.memory(tree, root))) for x in blackboards],
+                [['is_open']] * 4)
+            if compiled:
+                self.assertEqual(healthy.ticked, [])
+            else:
+                self.assertEqual(healthy.ticked, targets)
+        self.assertEqual(tree.tickMany(targets, blackboards),
+                         [RUNNING] * 4)
+        self.assertRaises(ValueError, bt.BehaviorTree(root).tickMany,
+                          targets, blackboards, {'health': [1]})
+
+
+class Clock(object):
+
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class Listen(bt._BaseNode):
+    """
+    I wait until my target has heard something.
+    """
+
+    def tick(self, ctx):
+        if ctx.target in ctx.blackboard.memory().get('heard', ()):
+            return OK
+        ctx.waitFor(self, 'noise')
+        return RUNNING
+
+
+class SchedulerTest(TestCase):
+
+    def test_sleep(self):
+        """
+        Targets whose running leaves are all asleep aren't ticked until
+        the earliest of them wakes.
+        """
+        clock = Clock()
+        log = []
+        tree = bt.BehaviorTree(bt.Sequence('nap', [
+            bt.WaitAction(5, clock),
+            Scripted('up', [OK], log),
+        ]))
+        scheduler = bt.Scheduler(tree, clock)
+        for target in ['ann', 'bob', 'cat']:
+            scheduler.add(target)
+        self.assertEqual(scheduler.tick(),
+            [('ann', RUNNING), ('bob', RUNNING), ('cat', RUNNING)])
+        self.assertFalse(scheduler.isAwake('ann'))
+        clock.now = 4.9
+        self.assertEqual(scheduler.tick(), [])
+        scheduler.wake('bob')
+        self.assertEqual(scheduler.tick(), [('bob', RUNNING)])
+        clock.now = 5
+        self.assertEqual(scheduler.tick(),
+            [('ann', OK), ('bob', OK), ('cat', OK)])
+        self.assertEqual(log.count(('up', 'tick', OK)), 3)
+        self.assertTrue(scheduler.isAwake('cat'))
+        scheduler.remove('cat')
+        self.assertEqual(scheduler.tick(), [('ann', RUNNING), ('bob', RUNNING)])
+
+    def test_events(self):
+        """
+        Targets waiting on an event are ticked again once it's
+        signalled.
+        """
+        tree = bt.BehaviorTree(bt.Priority('root', [Listen(),
+                                                    bt.WaitAction(1)]))
+        scheduler = bt.Scheduler(tree)
+        blackboards = [scheduler.add(x) for x in ['ann', 'bob']]
+        self.assertEqual(scheduler.tick(), [('ann', RUNNING), ('bob', RUNNING)])
+        self.assertEqual(scheduler.tick(), [])
+        blackboards[1].memory()['heard'] = ['bob']
+        scheduler.signal('noise')
+        self.assertEqual(scheduler.tick(), [('ann', RUNNING), ('bob', OK)])
+        self.assertEqual(scheduler.tick(), [('bob', OK)])
+        scheduler.signal('noise')
+        self.assertEqual(scheduler.tick(), [('ann', RUNNING), ('bob', OK)])
+
+    def test_busy(self):
+        """
+        Targets with a running leaf that isn't asleep are ticked every
+        time, as are targets whose tree has finished.
+        """
+        tree = bt.BehaviorTree(bt.MemSequence('walk', [
+            Scripted('walk', [RUNNING], []),
+            bt.WaitAction(100),
+        ]))
+        scheduler = bt.Scheduler(tree)
+        scheduler.add('ann')
+        for i in xrange(3):
+            self.assertEqual(scheduler.tick(), [('ann', RUNNING)])
+        tree = bt.BehaviorTree(Scripted('done', [OK], []), compiled=False)
+        scheduler = bt.Scheduler(tree)
+        scheduler.add('ann')
+        for i in xrange(3):
+            self.assertEqual(scheduler.tick(), [('ann', OK)])
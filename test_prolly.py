@@ -1,7 +1,23 @@
+import os
+import sys
+import random
+import pickle
+import shutil
+import tempfile
+import subprocess
+from StringIO import StringIO
 from unittest import TestCase
 from decimal import Decimal
 
-from prolly import Brain, Var
+from prolly import Brain, Var, Atom, Term, Rule, TRUE, PARSER, parseFact
+from prolly import RecordingTracer, PrintTracer, UnsafeRule, Unstratifiable
+from prolly import FrozenBrain, AnswerSet, InstantiationError, Profiler
+from prolly import RuleStats, compileGrammar, grammar, grammar_bindings
+from prolly import SpecialTerm
+
+
+def parse(query):
+    return PARSER(query).rule().normalizeVars().head
 
 
 def assertObjectSubsetIn(testcase, listing, obj):
@@ -224,3 +240,1915 @@ class ScenarioBrainTest(TestCase):
             'X': 'sibling',
             'Y': 'mike',
         })
+
+
+
+class RuleIndexTest(TestCase):
+
+    def setUp(self):
+        Var.count = 0
+
+    def candidates(self, brain, query):
+        return [r.head.humanValue() for r in brain._candidates(parse(query))]
+
+    def test_bound_argument(self):
+        """
+        Only rules whose heads could match a bound argument are
+        candidates.
+        """
+        brain = Brain()
+        map(brain.add, [
+            '(mother, mary, alicia)',
+            '(mother, rita, joseph)',
+            '(father, joseph, alicia)',
+            '(likes, mary)',
+        ])
+        self.assertEqual(self.candidates(brain, '(mother, X, joseph)'),
+            [('mother', 'rita', 'joseph')])
+        self.assertEqual(self.candidates(brain, '(mother, mary, X)'),
+            [('mother', 'mary', 'alicia')])
+        self.assertEqual(self.candidates(brain, '(X, Y)'),
+            [('likes', 'mary')])
+
+    def test_variable_heads(self):
+        """
+        Rules with a variable where the query has a value are still
+        candidates, and candidates come back in the order the rules
+        were added.
+        """
+        brain = Brain()
+        map(brain.add, [
+            '(X, good) if (john, said, X)',
+            '(cats, good)',
+            '(dogs, bad)',
+            '(Y, good) if (mary, said, Y)',
+        ])
+        self.assertEqual(self.candidates(brain, '(cats, good)'), [
+            ('X', 'good'),
+            ('cats', 'good'),
+            ('Y', 'good'),
+        ])
+
+    def test_nested_terms(self):
+        """
+        Nested terms are filed by their arity.
+        """
+        brain = Brain()
+        map(brain.add, [
+            '(john, said, (cats, eat, food))',
+            '(john, said, (hello, there))',
+            '(john, said, hello)',
+        ])
+        self.assertEqual(self.candidates(brain, '(john, said, (A, B))'),
+            [('john', 'said', ('hello', 'there'))])
+        self.assertEqual(len(self.candidates(brain, '(john, said, X)')), 3)
+
+    def test_query(self):
+        """
+        Indexed lookups give the same answers.
+        """
+        brain = Brain()
+        for i in range(50):
+            brain.add('(parent, p{0}, p{1})'.format(i, i + 1))
+        brain.add('(grandparent, G, C) if (parent, G, P) and (parent, P, C)')
+        results = list(brain.query('(grandparent, p10, X)'))
+        self.assertEqual(len(results), 1)
+        self.assertEqual(results[0]['X'], 'p12')
+
+
+class TablingTest(TestCase):
+
+    def setUp(self):
+        Var.count = 0
+
+    def answers(self, brain, query, var='X'):
+        return sorted(x[var] for x in brain.query(query))
+
+    def test_trail_invalidated(self):
+        """
+        Tables are forgotten when facts the trail engine read for them
+        are added or retracted.
+        """
+        for engine in ['recursive', 'trail']:
+            brain = Brain(tabling=True, engine=engine)
+            brain.add('(n, X) if (e, X, X)')
+            self.assertEqual(self.answers(brain, '(n, X)'), [], engine)
+            brain.add('(e, a, a)')
+            self.assertEqual(self.answers(brain, '(n, X)'), ['a'], engine)
+            brain.retract('(e, a, a)')
+            self.assertEqual(self.answers(brain, '(n, X)'), [], engine)
+
+    def test_left_recursion(self):
+        """
+        Left-recursive rules terminate when tabling.
+        """
+        brain = Brain(tabling=True)
+        map(brain.add, [
+            '(path, X, Y) if (path, X, Z) and (edge, Z, Y)',
+            '(path, X, Y) if (edge, X, Y)',
+            '(edge, a, b)',
+            '(edge, b, c)',
+            '(edge, c, d)',
+        ])
+        self.assertEqual(self.answers(brain, '(path, a, X)'), ['b', 'c', 'd'])
+        self.assertEqual(self.answers(brain, '(path, X, d)'), ['a', 'b', 'c'])
+
+    def test_cycle(self):
+        """
+        Reachability in a graph with cycles terminates and finds
+        everything reachable.
+        """
+        brain = Brain(tabling=True)
+        map(brain.add, [
+            '(reachable, X, Y) if (bridge, X, Y)',
+            '(reachable, X, Y) if (bridge, X, Z) and (reachable, Z, Y)',
+            '(bridge, north, south)',
+            '(bridge, south, east)',
+            '(bridge, east, north)',
+            '(bridge, east, west)',
+        ])
+        self.assertEqual(self.answers(brain, '(reachable, west, X)'), [])
+        self.assertEqual(self.answers(brain, '(reachable, north, X)'),
+            ['east', 'north', 'south', 'west'])
+
+    def test_mutual_recursion(self):
+        """
+        Rules that call each other are evaluated together.
+        """
+        brain = Brain(tabling=True)
+        map(brain.add, [
+            '(even, zero)',
+            '(even, X) if (succ, Y, X) and (odd, Y)',
+            '(odd, X) if (succ, Y, X) and (even, Y)',
+            '(succ, zero, one)',
+            '(succ, one, two)',
+            '(succ, two, three)',
+            '(succ, three, four)',
+        ])
+        self.assertEqual(self.answers(brain, '(even, X)'),
+            ['four', 'two', 'zero'])
+        self.assertEqual(self.answers(brain, '(odd, X)'), ['one', 'three'])
+
+    def test_same_answers(self):
+        """
+        Tabling gives the same answers for non-recursive rules.
+        """
+        rules = [
+            '(parent, P, C) if (mother, P, C)',
+            '(parent, P, C) if (father, P, C)',
+            '(grandparent, G, C) if (parent, G, P) and (parent, P, C)',
+            '(sibling, X, Y) if (parent, P, X) and (parent, P, Y)',
+            '(mother, mary, alicia)',
+            '(father, joseph, alicia)',
+            '(mother, mary, mike)',
+            '(father, joseph, mike)',
+            '(mother, rita, joseph)',
+        ]
+        plain = Brain()
+        tabled = Brain(tabling=True)
+        for r in rules:
+            plain.add(r)
+            tabled.add(r)
+        for query in ['(sibling, X, alicia)', '(grandparent, X, mike)',
+                      '(parent, X, alicia)']:
+            self.assertEqual(self.answers(plain, query),
+                             self.answers(tabled, query))
+
+    def test_reuse(self):
+        """
+        Variants of a goal that was already answered reuse its table.
+        """
+        brain = Brain(tabling=True)
+        map(brain.add, [
+            '(parent, P, C) if (mother, P, C)',
+            '(mother, mary, alicia)',
+        ])
+        self.assertEqual(self.answers(brain, '(parent, X, Y)', 'Y'),
+            ['alicia'])
+        self.assertEqual(len(brain._tables), 1)
+        self.assertEqual(self.answers(brain, '(parent, Z, W)', 'W'),
+            ['alicia'])
+        self.assertEqual(len(brain._tables), 1)
+
+    def test_invalidation(self):
+        """
+        Adding a rule that the answers depend on forgets them.
+        """
+        brain = Brain(tabling=True)
+        map(brain.add, [
+            '(reachable, X, Y) if (bridge, X, Y)',
+            '(reachable, X, Y) if (reachable, X, Z) and (bridge, Z, Y)',
+            '(bridge, north, south)',
+        ])
+        self.assertEqual(self.answers(brain, '(reachable, north, X)'),
+            ['south'])
+        brain.add('(likes, north, south)')
+        self.assertEqual(len(brain._tables), 1, 'unrelated facts do not '
+            'invalidate tables')
+        brain.add('(bridge, south, east)')
+        self.assertEqual(self.answers(brain, '(reachable, north, X)'),
+            ['east', 'south'])
+
+
+class CompiledMatchingTest(TestCase):
+
+    rules = [
+        '(parent, P, C) if (mother, P, C)',
+        '(parent, P, C) if (father, P, C)',
+        '(daughter, P, C) if (parent, P, C) and (female, C)',
+        '(grandparent, G, C) if (parent, G, P) and (parent, P, C)',
+        '(sibling, X, Y) if (parent, P, X) and (parent, P, Y)',
+        '(X, good) if (john, said, X)',
+        '(female, alicia)',
+        '(mother, mary, alicia)',
+        '(father, joseph, alicia)',
+        '(mother, mary, mike)',
+        '(mother, rita, joseph)',
+        '(john, said, hello)',
+        '(john, said, (cats, eat, food))',
+        '(age, mike, 12)',
+        '(age, mary, -4.5)',
+    ]
+
+    queries = [
+        '(parent, X, alicia)',
+        '(sibling, X, Y)',
+        '(daughter, mary, X)',
+        '(grandparent, X, Y)',
+        '(X, Y, mike)',
+        '(X, good)',
+        '(john, said, (cats, X, food))',
+        '(age, X, Y)',
+    ]
+
+    def setUp(self):
+        Var.count = 0
+
+    def brain(self, **kwargs):
+        brain = Brain(**kwargs)
+        map(brain.add, self.rules)
+        return brain
+
+    def answers(self, brain, query):
+        return sorted(sorted(x.items()) for x in brain.query(query))
+
+    def test_same_as_reference(self):
+        """
+        The compiled unifiers give the same answers as matching with
+        the C{matches} methods.
+        """
+        compiled = self.brain()
+        reference = self.brain(compiled=False)
+        for query in self.queries:
+            self.assertEqual(self.answers(compiled, query),
+                             self.answers(reference, query), query)
+
+    def test_repeated_values(self):
+        """
+        A value can appear more than once in a fact.
+        """
+        brain = Brain()
+        map(brain.add, [
+            '(likes, alice, alice)',
+            '(likes, alice, bob)',
+        ])
+        self.assertEqual(self.answers(brain, '(likes, X, alice)'),
+            [[('X', 'alice')]])
+        self.assertEqual(self.answers(brain, '(likes, X, Y)'),
+            [[('X', 'alice'), ('Y', 'alice')], [('X', 'alice'), ('Y', 'bob')]])
+        self.assertEqual(self.answers(brain, '(likes, X, X)'),
+            [[('X', 'alice')]])
+
+    def test_repeated_variables(self):
+        """
+        A variable that appears more than once in a head must stand for
+        the same thing each time.
+        """
+        brain = Brain()
+        map(brain.add, [
+            '(same, X, X)',
+            '(narcissist, X) if (loves, X, X)',
+            '(loves, bob, bob)',
+            '(loves, bob, alice)',
+        ])
+        self.assertEqual(self.answers(brain, '(same, a, a)'), [[]])
+        self.assertEqual(self.answers(brain, '(same, a, b)'), [])
+        self.assertEqual(self.answers(brain, '(narcissist, X)'),
+            [[('X', 'bob')]])
+
+    def test_variable_query(self):
+        """
+        A query that is just a variable matches everything, with the
+        variables in rule heads filled in.
+        """
+        results = [x['X'] for x in self.brain().query('X')]
+        self.assertIn(('parent', 'mary', 'alicia'), results)
+        self.assertIn(('hello', 'good'), results)
+        self.assertIn(('age', 'mary', Decimal('-4.5')), results)
+
+
+class TrailEngineTest(TestCase):
+
+    def setUp(self):
+        Var.count = 0
+
+    def answers(self, brain, query):
+        return sorted(sorted(x.items()) for x in brain.query(query))
+
+    def test_same_answers(self):
+        """
+        The trail engine gives the same answers as the recursive one.
+        """
+        rules = CompiledMatchingTest.rules + [
+            '(good, X) if (not, (bad, X))',
+            '(bad, cats)',
+        ]
+        queries = CompiledMatchingTest.queries + [
+            '(good, cats)',
+            '(good, muffins)',
+            'X',
+        ]
+        recursive = Brain()
+        trail = Brain(engine='trail')
+        for r in rules:
+            recursive.add(r)
+            trail.add(r)
+        for query in queries:
+            self.assertEqual(self.answers(trail, query),
+                             self.answers(recursive, query), query)
+
+    def test_deep_recursion(self):
+        """
+        Long chains of rules don't use up the Python stack.
+        """
+        brain = Brain(engine='trail')
+        brain.add('(below, X, Y) if (on, X, Y)')
+        brain.add('(below, X, Z) if (on, X, Y) and (below, Y, Z)')
+        for i in range(2000):
+            brain.add('(on, b{0}, b{1})'.format(i, i + 1))
+        results = list(brain.query('(below, b0, b2000)'))
+        self.assertEqual(results, [{}])
+
+    def test_unbound_answers(self):
+        """
+        Answers can contain variables that nothing bound.
+        """
+        brain = Brain(engine='trail')
+        brain.add('(wrapped, (box, X))')
+        results = list(brain.query('(wrapped, Y)'))
+        self.assertEqual(len(results), 1)
+        self.assertEqual(results[0]['Y'][0], 'box')
+
+    def test_tabling(self):
+        """
+        Tabled goals are answered from their tables.
+        """
+        brain = Brain(engine='trail', tabling=True)
+        map(brain.add, [
+            '(path, X, Y) if (path, X, Z) and (edge, Z, Y)',
+            '(path, X, Y) if (edge, X, Y)',
+            '(edge, a, b)',
+            '(edge, b, a)',
+        ])
+        self.assertEqual(self.answers(brain, '(path, a, X)'),
+            [[('X', 'a')], [('X', 'b')]])
+
+
+
+class PlanningTest(TestCase):
+
+    rules = CompiledMatchingTest.rules + [
+        '(good, X) if (not, (bad, X))',
+        '(bad, cats)',
+        '(loner, X) if (not, (parent, X, Y)) and (female, X)',
+        '(grandchild, C, G) if (parent, P, C) and (parent, G, P)',
+    ]
+
+    queries = CompiledMatchingTest.queries + [
+        '(good, cats)',
+        '(good, muffins)',
+        '(grandchild, X, rita)',
+    ]
+
+    def setUp(self):
+        Var.count = 0
+
+    def answers(self, brain, query):
+        return sorted(sorted(x.items()) for x in brain.query(query))
+
+    def brain(self, **kwargs):
+        brain = Brain(**kwargs)
+        map(brain.add, self.rules)
+        return brain
+
+    def test_same_answers(self):
+        """
+        Reordering conjunctions doesn't change the answers.
+        """
+        for engine in ['recursive', 'trail']:
+            plain = self.brain(engine=engine)
+            planned = self.brain(engine=engine, planning=True)
+            for query in self.queries:
+                self.assertEqual(self.answers(planned, query),
+                                 self.answers(plain, query), query)
+
+    def test_not_waits(self):
+        """
+        A C{not} goal is proved after the goals that bind its
+        variables.
+        """
+        for engine in ['recursive', 'trail']:
+            self.assertEqual(self.answers(self.brain(engine=engine), '(loner, X)'),
+                [], 'Left to right, nobody is a loner')
+            planned = self.brain(engine=engine, planning=True)
+            self.assertEqual(self.answers(planned, '(loner, X)'),
+                [[('X', 'alicia')]])
+
+    def test_stats(self):
+        """
+        Brains count the clauses and the different argument values for
+        each predicate.
+        """
+        brain = self.brain()
+        stats = brain._stats[(3, 'mother')]
+        self.assertEqual((stats.facts, stats.rules), (3, 0))
+        self.assertEqual(map(len, stats.distinct), [1, 2, 3])
+        stats = brain._stats[(3, 'parent')]
+        self.assertEqual((stats.facts, stats.rules), (0, 2))
+        brain.addFacts([('mother', 'jane', 'ann')])
+        self.assertEqual(brain._stats[(3, 'mother')].facts, 4)
+
+    def test_fewer_rules_tried(self):
+        """
+        The most selective goal is proved first.
+        """
+        tried = {}
+        for planning in [False, True]:
+            tracer = RecordingTracer()
+            brain = Brain(tracer=tracer, planning=planning)
+            brain.add('(grandchild, C, G) if (parent, P, C) and (parent, G, P)')
+            brain.addFacts([('parent', 'p%d' % i, 'p%d' % (i + 1))
+                            for i in range(100)])
+            self.assertEqual(list(brain.query('(grandchild, X, p50)')),
+                [{'X': 'p52'}])
+            tried[planning] = len([x for x in tracer.events if x[0] == 'rule'])
+        self.assertLess(tried[True] * 10, tried[False], tried)
+
+class InterningTest(TestCase):
+
+    def test_atoms(self):
+        """
+        There is one atom per value.
+        """
+        self.assertIs(Atom('car'), Atom('car'))
+        self.assertIs(Atom(12), Atom(12))
+        self.assertNotEqual(Atom('car'), Atom('bike'))
+
+    def test_equal_values(self):
+        """
+        Numbers that are equal share an atom whatever their types, as
+        do strings and unicode strings with the same text, so they
+        match each other as they did before atoms were interned.
+        """
+        self.assertIs(Atom(2), Atom(2.0))
+        self.assertIs(Atom(2), Atom(Decimal('2.0')))
+        self.assertIs(Atom(2), Atom(2L))
+        self.assertIs(Atom('x'), Atom(u'x'))
+        self.assertIsNot(Atom(Decimal('0.1')), Atom(0.1))
+        brain = Brain()
+        brain.add('(age, bob, 2)')
+        brain.add('(age, ann, 2.0)')
+        self.assertEqual(sorted(x['P'] for x in brain.query('(age, P, 2)')),
+                         ['ann', 'bob'])
+        self.assertEqual(len(list(brain.query('(age, P, 2.0)'))), 2)
+
+    def test_bools(self):
+        """
+        C{True} and C{False} don't share atoms with C{1} and C{0}, so
+        facts about flags don't turn numbers into them.
+        """
+        self.assertIsNot(Atom(True), Atom(1))
+        self.assertIsNot(Atom(False), Atom(0))
+        brain = Brain()
+        brain.addFacts([('flag', 'x', True)])
+        brain.add('(age, bob, 1)')
+        brain.add('(old, P) if (age, P, A) and (gt, A, 0)')
+        self.assertEqual(list(brain.query('(old, P)')), [{'P': 'bob'}])
+        self.assertIs(Atom(True).value, True)
+        self.assertIs(type(Atom(1).value), int)
+
+    def test_whole_numbers(self):
+        """
+        Whole numbers are kept as integers whatever they were made
+        from, so that which was made first doesn't change answers.
+        """
+        keep = [Atom(Decimal('7001.0')), Atom(7002.0)]
+        for value in [Decimal('7001.0'), 7001.0, 7001, 7002.0]:
+            self.assertIs(type(Atom(value).value), int, value)
+        self.assertIs(type(Atom(Decimal('7001.5')).value), Decimal)
+        brain = Brain()
+        brain.add('(count, y, 7001)')
+        answers = [x['N'] for x in brain.query('(count, y, N)')]
+        self.assertEqual(answers, [7001])
+        self.assertIs(type(answers[0]), int)
+        self.assertIs(keep[0].value, answers[0])
+
+    def test_forgotten(self):
+        """
+        Atoms that aren't used any more aren't kept.
+        """
+        import gc
+        gc.collect()
+        before = len(Atom._interned)
+        atoms = [Atom(('unused', i)) for i in xrange(1000)]
+        self.assertEqual(len(Atom._interned), before + 1000)
+        del atoms
+        gc.collect()
+        self.assertEqual(len(Atom._interned), before)
+
+    def test_ground_terms(self):
+        """
+        There is one ground term per class and arguments.
+        """
+        a = Term(Atom('owns'), Atom('bob'), Term(Atom('red'), Atom('car')))
+        b = Term(Atom('owns'), Atom('bob'), Term(Atom('red'), Atom('car')))
+        self.assertIs(a, b)
+        self.assertTrue(a.ground)
+        self.assertIs(parse('(owns, bob, (red, car))'), a)
+
+    def test_variable_terms(self):
+        """
+        Terms with variables in them aren't shared.
+        """
+        x = Var('X')
+        a = Term(Atom('owns'), x)
+        self.assertFalse(a.ground)
+        self.assertIsNot(a, Term(Atom('owns'), x))
+
+    def test_facts_share_terms(self):
+        """
+        Facts added to different brains share their terms.
+        """
+        one = Brain()
+        two = Brain()
+        one.add('(owns, bob, (red, car))')
+        two.add('(owns, bob, (red, car))')
+        self.assertIs(one._rules[0].head, two._rules[0].head)
+
+    def test_slots(self):
+        """
+        Terms don't have a __dict__.
+        """
+        self.assertFalse(hasattr(Atom('car'), '__dict__'))
+        self.assertFalse(hasattr(Term(Atom('car')), '__dict__'))
+        self.assertFalse(hasattr(Var('X'), '__dict__'))
+
+    def test_pickle(self):
+        """
+        Unpickled atoms and terms are the interned ones.
+        """
+        term = parse('(owns, bob, (red, car))')
+        self.assertIs(pickle.loads(pickle.dumps(term, 2)), term)
+        self.assertIs(pickle.loads(pickle.dumps(Atom(5), 2)), Atom(5))
+
+
+class PreparedQueryTest(TestCase):
+
+    def setUp(self):
+        Var.count = 0
+        self.brain = Brain()
+        map(self.brain.add, [
+            '(parent, P, C) if (mother, P, C)',
+            '(mother, mary, alicia)',
+            '(mother, mary, mike)',
+            '(mother, rita, joseph)',
+            '(age, mike, 12)',
+            '(owns, mike, (red, bike))',
+        ])
+
+    def test_params(self):
+        """
+        Prepared queries are called with values for some of their
+        variables and answer for the rest.
+        """
+        q = self.brain.prepare('(parent, P, C)')
+        self.assertEqual(sorted(x['C'] for x in q(P='mary')),
+            ['alicia', 'mike'])
+        self.assertEqual(list(q(P='rita')), [{'C': 'joseph'}])
+        self.assertEqual(list(q(P='rita', C='joseph')), [{}])
+        self.assertEqual(list(q(P='nobody')), [])
+        self.assertEqual(len(list(q())), 3)
+
+    def test_values(self):
+        """
+        Numbers and tuples can be used as values.
+        """
+        q = self.brain.prepare('(Relation, mike, X)')
+        self.assertEqual(list(q(X=12)), [{'Relation': 'age'}])
+        self.assertEqual(list(q(X=('red', 'bike'))), [{'Relation': 'owns'}])
+
+    def test_unknown_param(self):
+        """
+        Giving a value for a variable the query doesn't have is an error.
+        """
+        q = self.brain.prepare('(parent, P, C)')
+        self.assertRaises(TypeError, q, X='mary')
+
+    def test_parse_cache(self):
+        """
+        Query strings are only parsed once, until they are forgotten.
+        """
+        brain = Brain(parse_cache_size=2)
+        first = brain._parseQuery('(parent, P, C)')
+        self.assertIs(brain._parseQuery('(parent, P, C)'), first)
+        brain._parseQuery('(a, X)')
+        brain._parseQuery('(parent, P, C)')
+        brain._parseQuery('(b, X)')
+        self.assertIs(brain._parseQuery('(parent, P, C)'), first,
+            'Recently used queries are kept')
+        brain._parseQuery('(c, X)')
+        brain._parseQuery('(d, X)')
+        self.assertIsNot(brain._parseQuery('(parent, P, C)'), first)
+        self.assertEqual(len(brain._parse_cache), 2)
+
+    def test_parse_cache_term_types(self):
+        """
+        Query strings parsed before a term type is added are parsed
+        again, with it.
+        """
+        class Always(SpecialTerm):
+            __slots__ = ()
+
+            def query(self, brain):
+                yield {}
+
+        brain = Brain()
+        self.assertEqual(list(brain.query('(always, X)')), [])
+        brain.addTermType('always', Always.createFromTerm)
+        self.assertEqual(list(brain.query('(always, X)')), [{}])
+
+
+class LoaderTest(TestCase):
+
+    lines = [
+        '(parent, mary, alicia)',
+        '',
+        '(parent, mary, (child, -2, 1.5))',
+        '(grandparent, X, Z) if (parent, X, Y) and (parent, Y, Z)',
+        '(parent, alicia, bob)',
+        '(loner, X) if (person, X) and (not, (parent, X, Y))',
+        '(person, jim)',
+    ]
+
+    def test_parseFact(self):
+        """
+        Ground facts are parsed the same way the grammar parses them;
+        anything else is left for the grammar.
+        """
+        for line in ['(a, b)', '(a , b)', '()', '((a), b)', '(x1, 0, 5.)',
+                     '(a, -3, 2.50, (b, (c)), d)']:
+            self.assertIs(parseFact(line), PARSER(line).rule().head, line)
+        for line in ['foo', '(a, X)', '(a, b) if (c)', '( a, b)', '(a b)',
+                     '(a, b,)', '(012, b)', '(a_b, c)', '(a, -)',
+                     '(a, b) junk']:
+            self.assertIsNone(parseFact(line), line)
+        self.assertIsNone(parseFact('(not, (a))', {'not': None}),
+            'Special terms need converting')
+
+    def test_load(self):
+        """
+        Loading a file gives the same answers as adding its lines one
+        by one.
+        """
+        Var.count = 0
+        loaded = Brain()
+        loaded.load(StringIO('\n'.join(self.lines) + '\n'))
+        added = Brain()
+        for line in self.lines:
+            if line:
+                added.add(line)
+        self.assertEqual(len(loaded._rules), len(added._rules))
+        for query in ['(parent, X, Y)', '(grandparent, X, Y)',
+                      '(loner, X)', '(parent, mary, (child, N, M))']:
+            self.assertEqual(
+                sorted(map(sorted, [x.items() for x in loaded.query(query)])),
+                sorted(map(sorted, [x.items() for x in added.query(query)])),
+                query)
+
+    def test_load_error(self):
+        """
+        Lines the grammar can't parse are an error.
+        """
+        brain = Brain()
+        self.assertRaises(Exception, brain.load, StringIO('(a, b\n'))
+
+    def test_addFacts(self):
+        """
+        Facts can be added as tuples.
+        """
+        brain = Brain()
+        brain.addFacts([
+            ('parent', 'mary', 'alicia'),
+            ('age', 'alicia', 7),
+            ('owns', 'alicia', ('red', 'bike')),
+        ])
+        self.assertEqual(list(brain.query('(parent, mary, X)')),
+            [{'X': 'alicia'}])
+        self.assertEqual(list(brain.query('(age, alicia, X)')), [{'X': 7}])
+        self.assertEqual(list(brain.query('(owns, X, (red, Y))')),
+            [{'X': 'alicia', 'Y': 'bike'}])
+
+    def test_invalidates_tables(self):
+        """
+        Loaded facts are seen by tabled goals that were already answered.
+        """
+        brain = Brain(tabling=True)
+        brain.add('(path, X, Y) if (edge, X, Y)')
+        brain.add('(path, X, Z) if (path, X, Y) and (edge, Y, Z)')
+        brain.addFacts([('edge', 'a', 'b')])
+        self.assertEqual(list(brain.query('(path, a, X)')), [{'X': 'b'}])
+        brain.load(StringIO('(edge, b, c)\n'))
+        self.assertEqual(sorted(x['X'] for x in brain.query('(path, a, X)')),
+            ['b', 'c'])
+
+
+class TracingTest(TestCase):
+
+    rules = [
+        '(parent, mary, alicia)',
+        '(parent, alicia, bob)',
+        '(grandparent, X, Z) if (parent, X, Y) and (parent, Y, Z)',
+    ]
+
+    def traced(self, **kwargs):
+        tracer = RecordingTracer()
+        brain = Brain(tracer=tracer, **kwargs)
+        map(brain.add, self.rules)
+        self.assertEqual(list(brain.query('(grandparent, mary, X)')),
+            [{'X': 'bob'}])
+        return tracer.events
+
+    def assertEvents(self, events):
+        names = set(x[0] for x in events)
+        self.assertTrue(set(['goal', 'rule', 'binding', 'answer']) <= names,
+            names)
+        goals = [x[1] for x in events if x[0] == 'goal']
+        self.assertEqual(goals[0].humanValue(), ('grandparent', 'mary', 'X'))
+        bindings = [x for x in events if x[0] == 'binding']
+        self.assertTrue(any(x[2].head.args[0].value == 'grandparent'
+                            for x in bindings))
+
+    def test_recursive(self):
+        """
+        The recursive engine reports goals, rules tried, bindings and
+        answers.
+        """
+        self.assertEvents(self.traced())
+
+    def test_trail(self):
+        """
+        So does the trail engine.
+        """
+        self.assertEvents(self.traced(engine='trail'))
+
+    def test_off(self):
+        """
+        Brains don't trace unless they are given a tracer.
+        """
+        brain = Brain()
+        self.assertIsNone(brain.tracer)
+        brain.tracer = tracer = RecordingTracer()
+        list(brain.query('(a, X)'))
+        self.assertEqual([(x[0], x[1].humanValue()) for x in tracer.events],
+            [('goal', ('a', 'X'))])
+
+    def test_print(self):
+        """
+        L{PrintTracer} writes a line per event.
+        """
+        stream = StringIO()
+        brain = Brain(tracer=PrintTracer(stream, color=False))
+        brain.add('(a, b)')
+        list(brain.query('(a, X)'))
+        lines = stream.getvalue().splitlines()
+        self.assertEqual([x.split()[0] for x in lines],
+            ['goal', 'rule', 'binding', 'answer'])
+
+
+class MaterializationTest(TestCase):
+
+    rules = [x for x in PlanningTest.rules if 'good' not in x] + [
+        '(childless, X) if (female, X) and (not, (parent, X, Y))',
+    ]
+
+    queries = [x for x in PlanningTest.queries if 'good' not in x] + [
+        '(childless, X)',
+    ]
+
+    def setUp(self):
+        Var.count = 0
+
+    def answers(self, brain, query):
+        return sorted(sorted(x.items()) for x in brain.query(query))
+
+    def assertSame(self, materialized, resolved, queries):
+        for query in queries:
+            self.assertEqual(self.answers(materialized, query),
+                             self.answers(resolved, query), query)
+
+    def test_same_answers(self):
+        """
+        Materialized brains give the same answers as ones that resolve
+        queries, whatever order rules and facts are added in.
+        """
+        for rules in [self.rules, list(reversed(self.rules))]:
+            materialized = Brain(materialize=True)
+            resolved = Brain()
+            for rule in rules:
+                materialized.add(rule)
+                resolved.add(rule)
+            self.assertSame(materialized, resolved, self.queries)
+
+    def test_incremental(self):
+        """
+        Adding facts updates what has been derived, including what
+        depends on a C{not}.
+        """
+        materialized = Brain(materialize=True)
+        resolved = Brain()
+        for brain in [materialized, resolved]:
+            map(brain.add, self.rules)
+        self.assertEqual(self.answers(materialized, '(childless, X)'),
+            [[('X', 'alicia')]])
+        for brain in [materialized, resolved]:
+            brain.add('(mother, alicia, zed)')
+            brain.addFacts([('female', 'zoe')])
+        self.assertSame(materialized, resolved, self.queries)
+        self.assertEqual(self.answers(materialized, '(childless, X)'),
+            [[('X', 'zoe')]])
+
+    def test_recursion(self):
+        """
+        Recursive rules are evaluated until nothing new turns up.
+        """
+        brain = Brain(materialize=True)
+        brain.add('(path, X, Y) if (path, X, Z) and (edge, Z, Y)')
+        brain.add('(path, X, Y) if (edge, X, Y)')
+        brain.load(StringIO('(edge, a, b)\n(edge, b, c)\n(edge, c, a)\n'))
+        self.assertEqual(self.answers(brain, '(path, a, X)'),
+            [[('X', 'a')], [('X', 'b')], [('X', 'c')]])
+        brain.add('(edge, c, d)')
+        self.assertEqual(self.answers(brain, '(path, b, X)'),
+            [[('X', 'a')], [('X', 'b')], [('X', 'c')], [('X', 'd')]])
+
+    def test_new_stratum(self):
+        """
+        A rule that changes the strata of the rules already added has
+        everything derived again.
+        """
+        brain = Brain(materialize=True)
+        brain.add('(reachable, X) if (start, X)')
+        brain.add('(reachable, Y) if (reachable, X) and (edge, X, Y)')
+        brain.addFacts([('start', 'a'), ('edge', 'a', 'b'), ('node', 'c')])
+        brain.add('(start, X) if (node, X) and (not, (edge, Y, X))')
+        self.assertEqual(self.answers(brain, '(reachable, X)'),
+            [[('X', 'a')], [('X', 'b')], [('X', 'c')]])
+
+    def test_unsafe(self):
+        """
+        Rules that would derive facts with variables in them can't be
+        materialized, and aren't added.
+        """
+        brain = Brain(materialize=True)
+        self.assertRaises(UnsafeRule, brain.add, '(p, X) if (q, Y)')
+        self.assertRaises(UnsafeRule, brain.add, '(same, X, X)')
+        self.assertRaises(UnsafeRule, brain.add,
+            '(p, X) if (not, (q, X))')
+        self.assertEqual(brain._rules, [])
+
+    def test_unsafe_builtins(self):
+        """
+        Builtins only bind variables once enough of their others are
+        bound, and rules with builtins that can't be worked out aren't
+        added.
+        """
+        brain = Brain(materialize=True)
+        self.assertRaises(UnsafeRule, brain.add, '(small, A) if (lt, A, 5)')
+        self.assertRaises(UnsafeRule, brain.add,
+            '(sum, C) if (num, A) and (plus, A, B, C)')
+        self.assertRaises(UnsafeRule, brain.add,
+            '(n, X) if (num, H) and (between, L, H, X)')
+        self.assertEqual(brain._rules, [])
+        self.assertEqual(brain._materialized.rules, [])
+        brain.add('(num, 2)')
+        brain.add('(next, B) if (plus, A, 1, B) and (num, A)')
+        brain.add('(small, A) if (next, A) and (lt, A, 5)')
+        brain.add('(upto, X) if (num, H) and (between, 1, H, X)')
+        self.assertEqual(self.answers(brain, '(small, A)'), [[('A', 3)]])
+        self.assertEqual(self.answers(brain, '(upto, X)'),
+                         [[('X', 1)], [('X', 2)]])
+
+    def test_failed_derivation(self):
+        """
+        A rule that fails while deriving facts isn't added, and
+        neither is a fact that makes one fail.
+        """
+        brain = Brain(materialize=True)
+        brain.add('(num, 0)')
+        self.assertRaises(InstantiationError, brain.add,
+            '(any, X) if (num, A) and (times, A, X, 0)')
+        self.assertEqual(len(brain._materialized.rules), 0)
+        brain.add('(half, X) if (num, A) and (times, 2, X, A)')
+        brain.add('(any, X) if (big, A) and (times, A, X, 0)')
+        self.assertRaises(InstantiationError, brain.add, '(big, 0)')
+        self.assertEqual(len(brain._materialized.rules), 2)
+        self.assertEqual(self.answers(brain, '(big, X)'), [])
+        brain.add('(num, 4)')
+        self.assertEqual(self.answers(brain, '(half, X)'),
+                         [[('X', 0)], [('X', 2)]])
+
+    def test_unstratifiable(self):
+        """
+        Rules that depend on their own negation can't be materialized.
+        """
+        brain = Brain(materialize=True)
+        brain.add('(q, a)')
+        brain.add('(p, X) if (q, X) and (not, (r, X))')
+        self.assertRaises(Unstratifiable, brain.add,
+            '(r, X) if (q, X) and (not, (p, X))')
+        self.assertEqual(len(brain._rules), 2)
+        self.assertEqual(self.answers(brain, '(p, X)'), [[('X', 'a')]])
+
+
+class LayeredBrainTest(TestCase):
+
+    def setUp(self):
+        Var.count = 0
+        self.world = Brain()
+        map(self.world.add, [
+            '(owns, bob, car)',
+            '(owns, ann, bike)',
+            '(stealing, T, X) if (owns, O, X) and (not, (allowed, O, T, X))',
+        ])
+
+    def answers(self, brain, query):
+        return sorted(sorted(x.items()) for x in brain.query(query))
+
+    def test_union(self):
+        """
+        A brain knows what its base knows as well as its own facts and
+        rules, which can use each other.
+        """
+        gary = Brain(base=self.world)
+        gary.add('(allowed, bob, alice, car)')
+        gary.add('(wants, X, T) if (owns, X, T) and (stealing, gary, T)')
+        self.assertEqual(self.answers(gary, '(owns, X, Y)'),
+            [[('X', 'ann'), ('Y', 'bike')], [('X', 'bob'), ('Y', 'car')]])
+        self.assertEqual(self.answers(gary, '(stealing, alice, X)'),
+            [[('X', 'bike')]])
+        self.assertEqual(self.answers(gary, '(wants, X, car)'),
+            [[('X', 'bob')]])
+
+    def test_parse_cache(self):
+        """
+        A brain keeps its own parse cache, of the size it was given,
+        rather than its base's.
+        """
+        gary = Brain(base=self.world, parse_cache_size=1)
+        list(self.world.query('(owns, X, car)'))
+        list(gary.query('(owns, X, car)'))
+        list(gary.query('(owns, ann, X)'))
+        self.assertEqual(len(gary._parse_cache), 1)
+        self.assertEqual(len(self.world._parse_cache), 1)
+        self.assertIsNot(gary._parse_cache, self.world._parse_cache)
+
+    def test_private(self):
+        """
+        What is added to a brain isn't seen by its base or by other
+        brains with the same base.
+        """
+        gary = Brain(base=self.world)
+        fonz = Brain(base=self.world)
+        gary.add('(allowed, bob, alice, car)')
+        fonz.add('(owns, fonz, jacket)')
+        self.assertEqual(self.answers(gary, '(stealing, alice, car)'), [])
+        self.assertEqual(self.answers(fonz, '(stealing, alice, car)'), [[]])
+        self.assertEqual(self.answers(self.world, '(stealing, alice, car)'),
+            [[]])
+        self.assertEqual(self.answers(gary, '(owns, fonz, X)'), [])
+        self.assertEqual(self.answers(fonz, '(owns, fonz, X)'),
+            [[('X', 'jacket')]])
+        self.assertEqual(len(gary._rules), 1)
+
+    def test_frozen(self):
+        """
+        Nothing can be added to a brain that is the base of others.
+        """
+        Brain(base=self.world)
+        self.assertRaises(FrozenBrain, self.world.add, '(owns, gary, hat)')
+        self.assertRaises(FrozenBrain, self.world.addFacts, [('a', 'b')])
+        self.assertEqual(self.answers(self.world, '(owns, gary, X)'), [])
+
+    def test_layers(self):
+        """
+        Brains can be built on brains that are built on others, with
+        any engine.
+        """
+        for kwargs in [{}, {'engine': 'trail'}, {'tabling': True},
+                       {'planning': True}]:
+            town = Brain(base=self.world)
+            town.add('(owns, mayor, townhall)')
+            gary = Brain(base=town, **kwargs)
+            gary.add('(allowed, mayor, gary, townhall)')
+            self.assertEqual(self.answers(gary, '(stealing, gary, X)'),
+                [[('X', 'bike')], [('X', 'car')]], kwargs)
+            self.assertEqual(self.answers(town, '(stealing, gary, X)'),
+                [[('X', 'bike')], [('X', 'car')], [('X', 'townhall')]])
+
+    def test_materialize(self):
+        """
+        Brains with a base can't be materialized.
+        """
+        self.assertRaises(ValueError, Brain, base=self.world, materialize=True)
+
+
+class TimeSlicedQueryTest(TestCase):
+
+    def setUp(self):
+        Var.count = 0
+        self.brain = Brain()
+        self.brain.add('(path, X, Y) if (edge, X, Y)')
+        self.brain.add('(path, X, Y) if (edge, X, Z) and (path, Z, Y)')
+        for i in range(20):
+            self.brain.add('(edge, n{0}, n{1})'.format(i, i + 1))
+
+    def everything(self, brain, query):
+        return sorted(sorted(x.items()) for x in brain.query(query))
+
+    def test_steps(self):
+        """
+        A task only takes as many steps as it's given, and gives all
+        the answers once it has been run enough.
+        """
+        task = self.brain.start('(path, n0, X)')
+        found = []
+        slices = 0
+        while not task.done:
+            before = task.steps
+            found.extend(task.run(steps=10))
+            self.assertTrue(task.steps - before <= 10)
+            slices += 1
+        self.assertTrue(slices > 1)
+        self.assertEqual(sorted(sorted(x.items()) for x in found),
+                         self.everything(self.brain, '(path, n0, X)'))
+        self.assertEqual(task.run(steps=10), [])
+
+    def test_unlimited(self):
+        """
+        With no limit a task runs to the end.
+        """
+        task = self.brain.start('(path, n15, X)')
+        self.assertEqual(len(task.run()), 5)
+        self.assertTrue(task.done)
+
+    def test_seconds(self):
+        """
+        A task can be given a time limit instead.
+        """
+        task = self.brain.start('(path, X, Y)')
+        task.run(seconds=0)
+        self.assertFalse(task.done)
+        self.assertTrue(0 < task.steps <= task.chunk)
+        task.run(seconds=60)
+        self.assertTrue(task.done)
+
+    def test_engines(self):
+        """
+        Tasks work on brains that table or materialize.
+        """
+        for kwargs in [{'tabling': True}, {'materialize': True},
+                       {'engine': 'trail'}]:
+            brain = Brain(**kwargs)
+            brain.add('(path, X, Y) if (edge, X, Y)')
+            brain.add('(path, X, Y) if (edge, X, Z) and (path, Z, Y)')
+            brain.add('(edge, a, b)')
+            brain.add('(edge, b, c)')
+            task = brain.start('(path, a, X)')
+            found = task.run(steps=1)
+            while not task.done:
+                found.extend(task.run(steps=1))
+            self.assertEqual(sorted(sorted(x.items()) for x in found),
+                [[('X', 'b')], [('X', 'c')]], kwargs)
+
+    def test_cooperate(self):
+        """
+        A task can find its answers a slice at a time between turns of
+        the reactor.
+        """
+        from twisted.internet.task import Clock, Cooperator
+        clock = Clock()
+        cooperator = Cooperator(
+            terminationPredicateFactory=lambda: lambda: True,
+            scheduler=lambda f: clock.callLater(1, f))
+        task = self.brain.start('(path, n0, X)')
+        d = task.cooperate(steps=5, cooperator=cooperator)
+        results = []
+        d.addCallback(results.append)
+        clock.advance(1)
+        self.assertEqual(results, [])
+        while not results:
+            clock.advance(1)
+        self.assertEqual(sorted(sorted(x.items()) for x in results[0]),
+                         self.everything(self.brain, '(path, n0, X)'))
+
+
+class NegationTest(TestCase):
+
+    rules = [
+        '(owns, bob, car)',
+        '(owns, ann, bike)',
+        '(agent, jim)',
+        '(agent, sue)',
+        '(allowed, O, T, X) if (friend, O, T)',
+        '(stealing, T, X) if (agent, T) and (owns, O, X) and '
+        '(not, (allowed, O, T, X))',
+    ]
+
+    def setUp(self):
+        Var.count = 0
+
+    def answers(self, brain, query):
+        return sorted(sorted(x.items()) for x in brain.query(query))
+
+    def negatedGoals(self, brain, query):
+        """
+        Count how many times the negated goals are tried while
+        answering C{query}.
+        """
+        brain.tracer = tracer = RecordingTracer()
+        list(brain.query(query))
+        brain.tracer = None
+        return len([x for x in tracer.events
+                    if x[0] == 'goal' and x[1].args[0] == Atom('allowed')])
+
+    def test_cached(self):
+        """
+        Whether a ground negated goal is provable is remembered.
+        """
+        for kwargs in [{}, {'engine': 'trail'}, {'tabling': True}]:
+            brain = Brain(**kwargs)
+            map(brain.add, self.rules)
+            self.assertTrue(self.negatedGoals(brain, '(stealing, T, X)') > 0)
+            self.assertEqual(self.negatedGoals(brain, '(stealing, T, X)'), 0,
+                             kwargs)
+            self.assertEqual(len(self.answers(brain, '(stealing, T, X)')), 4)
+
+    def test_forgotten(self):
+        """
+        What is remembered is forgotten when something it depends on
+        is added, even through other rules.
+        """
+        for kwargs in [{}, {'engine': 'trail'}, {'tabling': True}]:
+            brain = Brain(**kwargs)
+            map(brain.add, self.rules)
+            self.assertEqual(len(self.answers(brain, '(stealing, jim, X)')), 2)
+            brain.add('(friend, bob, jim)')
+            self.assertEqual(self.answers(brain, '(stealing, jim, X)'),
+                [[('X', 'bike')]], kwargs)
+            brain.addFacts([('friend', 'ann', 'jim')])
+            self.assertEqual(self.answers(brain, '(stealing, jim, X)'), [],
+                             kwargs)
+            self.assertEqual(len(self.answers(brain, '(stealing, sue, X)')), 2)
+            brain.add('(family, bob, sue)')
+            brain.add('(friend, X, Y) if (family, X, Y)')
+            self.assertEqual(self.answers(brain, '(stealing, sue, X)'),
+                [[('X', 'bike')]], kwargs)
+
+    def test_unrelated(self):
+        """
+        Adding facts that a remembered goal doesn't depend on doesn't
+        make it be tried again.
+        """
+        brain = Brain()
+        map(brain.add, self.rules)
+        list(brain.query('(stealing, T, X)'))
+        brain.add('(owns, sue, hat)')
+        self.assertEqual(self.negatedGoals(brain, '(stealing, T, X)'), 2,
+                         'only those about the hat')
+
+    def test_unstratified(self):
+        """
+        Predicates that depend on their own negation are found when
+        rules are added, and goals that depend on them aren't
+        remembered.
+        """
+        brain = Brain()
+        brain.add('(p, X) if (q, X) and (not, (r, X))')
+        brain.add('(r, X) if (q, X) and (not, (p, X))')
+        brain.add('(s, X) if (q, X) and (not, (t, X))')
+        self.assertEqual(brain._unstratified, set([(2, 'p'), (2, 'r')]))
+        brain.add('(q, a)')
+        list(brain.query('(s, X)'))
+        self.assertEqual(brain._negations.keys(), [parse('(t, a)')])
+
+    def test_unstratified_later(self):
+        """
+        A predicate found to depend on its own negation only through
+        rules added later is found then.
+        """
+        brain = Brain()
+        brain.add('(p, X) if (q, X) and (not, (r, X))')
+        brain.add('(q, a)')
+        self.assertEqual(list(brain.query('(p, a)')), [{}])
+        self.assertEqual(brain._unstratified, set())
+        brain.add('(r, X) if (s, X)')
+        self.assertEqual(brain._unstratified, set())
+        brain.add('(s, X) if (p, X)')
+        self.assertEqual(brain._unstratified, set([(2, 'p')]))
+        brain.retract('(s, X) if (p, X)')
+        self.assertEqual(brain._unstratified, set())
+
+    def test_cache_size(self):
+        """
+        Only so many negated goals are remembered, and what they
+        depended on is forgotten with them.
+        """
+        brain = Brain(negation_cache_size=2)
+        map(brain.add, self.rules)
+        self.assertEqual(len(list(brain.query('(stealing, T, X)'))), 4)
+        self.assertEqual(len(brain._negations), 2)
+        goals = set()
+        for x in brain._negation_deps.values():
+            goals.update(x)
+        self.assertEqual(goals, set(brain._negations.keys()))
+        brain.add('(owns, sue, hat)')
+        self.assertEqual(len(list(brain.query('(stealing, T, X)'))), 6)
+
+
+class AnswerSetTest(TestCase):
+
+    def test_add(self):
+        """
+        Each answer is new the first time it's added.
+        """
+        answers = AnswerSet()
+        a, b = Atom('a'), Atom('b')
+        self.assertTrue(answers.add((a, b)))
+        self.assertTrue(answers.add((b, a)))
+        self.assertTrue(answers.add((a, a)))
+        self.assertFalse(answers.add((a, b)))
+        self.assertEqual(len(answers), 3)
+
+    def test_empty(self):
+        """
+        A goal without variables has at most one answer.
+        """
+        answers = AnswerSet()
+        self.assertTrue(answers.add(()))
+        self.assertFalse(answers.add(()))
+        self.assertEqual(len(answers), 1)
+
+    def test_variants(self):
+        """
+        Answers that only differ in the names of their variables are
+        the same, but not if the variables are shared differently.
+        """
+        answers = AnswerSet()
+        X, Y, Z = Var('X'), Var('Y'), Var('Z')
+        a = Atom('a')
+        self.assertTrue(answers.add((Term(a, X), X)))
+        self.assertFalse(answers.add((Term(a, Y), Y)))
+        self.assertTrue(answers.add((Term(a, Y), Z)))
+        self.assertFalse(answers.add((Term(a, Z), X)))
+
+    def test_unique(self):
+        """
+        Brains don't give the same answer twice, whichever variables
+        are left unbound.
+        """
+        brain = Brain()
+        brain.add('(likes, X, cake)')
+        brain.add('(likes, sam, cake)')
+        brain.add('(likes, sam, cake)')
+        brain.add('(likes, X, X)')
+        for engine in ['recursive', 'trail']:
+            brain.engine = engine
+            self.assertEqual(sorted(x.get('X') for x in
+                                    brain.query('(likes, X, cake)')),
+                [None, 'cake', 'sam'])
+
+
+class BuiltinTest(TestCase):
+
+    engines = [{}, {'engine': 'trail'}, {'tabling': True},
+               {'planning': True}, {'materialize': True}]
+
+    def setUp(self):
+        Var.count = 0
+
+    def answers(self, brain, query):
+        return sorted(sorted(x.items()) for x in brain.query(query))
+
+    def ages(self, **kwargs):
+        brain = Brain(**kwargs)
+        for i in xrange(20):
+            brain.add('(age, p{0}, {1})'.format(i, i * 5))
+        brain.add('(age, bob, 2.5)')
+        brain.add('(age, sam, old)')
+        brain.add('(age, (son, sam), 90)')
+        return brain
+
+    def test_comparisons(self):
+        """
+        C{lt} and C{gt} compare numbers, and aren't true of anything
+        else.
+        """
+        for kwargs in self.engines:
+            brain = self.ages(**kwargs)
+            brain.add('(old, P) if (age, P, A) and (gt, A, 80)')
+            brain.add('(young, P) if (age, P, A) and (lt, A, 5)')
+            self.assertEqual(self.answers(brain, '(old, P)'),
+                [[('P', 'p17')], [('P', 'p18')], [('P', 'p19')],
+                 [('P', ('son', 'sam'))]], kwargs)
+            self.assertEqual(self.answers(brain, '(young, P)'),
+                [[('P', 'bob')], [('P', 'p0')]], kwargs)
+            self.assertEqual(len(list(brain.query('(lt, 1, 2)'))), 1)
+            self.assertEqual(len(list(brain.query('(gt, 1, 2)'))), 0)
+            self.assertEqual(len(list(brain.query('(gt, b, a)'))), 0)
+
+    def test_between(self):
+        """
+        C{between} checks that a number is in a range, or generates the
+        integers in it.
+        """
+        for kwargs in self.engines:
+            brain = Brain(**kwargs)
+            self.assertEqual(self.answers(brain, '(between, 1, 3, X)'),
+                [[('X', 1)], [('X', 2)], [('X', 3)]], kwargs)
+            self.assertEqual(len(list(brain.query('(between, 1, 3, 2.5)'))), 1)
+            self.assertEqual(len(list(brain.query('(between, 1, 3, 4)'))), 0)
+
+    def test_arithmetic(self):
+        """
+        C{plus} and C{times} work out whichever of their numbers isn't
+        known.
+        """
+        for kwargs in self.engines:
+            brain = Brain(**kwargs)
+            self.assertEqual(self.answers(brain, '(plus, 2, 3, X)'),
+                [[('X', 5)]], kwargs)
+            self.assertEqual(self.answers(brain, '(plus, 2, X, 7)'),
+                [[('X', 5)]])
+            self.assertEqual(self.answers(brain, '(plus, X, 1.5, 2)'),
+                [[('X', Decimal('0.5'))]])
+            self.assertEqual(self.answers(brain, '(times, 3, 4, X)'),
+                [[('X', 12)]])
+            self.assertEqual(self.answers(brain, '(times, X, 4, 12)'),
+                [[('X', 3)]])
+            self.assertEqual(self.answers(brain, '(times, X, 4, 13)'), [])
+            self.assertEqual(self.answers(brain, '(times, X, 4, 1.5)'),
+                [[('X', Decimal('0.375'))]])
+            self.assertEqual(self.answers(brain, '(times, X, 0, 5)'), [])
+            self.assertEqual(self.answers(brain, '(plus, 2, 3, 5)'), [[]])
+            self.assertEqual(self.answers(brain, '(plus, 2, 3, 6)'), [])
+            self.assertEqual(self.answers(brain, '(plus, a, 3, X)'), [])
+
+    def test_integral(self):
+        """
+        Whole numbers worked out from decimals are integers, and join
+        with facts whether those have the number as an integer or not.
+        """
+        for kwargs in self.engines:
+            brain = Brain(**kwargs)
+            for query in ['(plus, 1000.25, 0.75, X)', '(plus, X, 0.5, 1001.5)',
+                          '(times, 500.5, 2, X)', '(times, 0.5, X, 500.5)']:
+                answers = [x['X'] for x in brain.query(query)]
+                self.assertEqual(answers, [1001], query)
+                self.assertEqual(type(answers[0]), int, query)
+            brain.add('(age, bob, 2)')
+            brain.add('(age, ann, 2.0)')
+            brain.add('(two, P) if (plus, 1.5, 0.5, X) and (age, P, X)')
+            self.assertEqual(self.answers(brain, '(two, P)'),
+                [[('P', 'ann')], [('P', 'bob')]], kwargs)
+
+    def test_rules(self):
+        """
+        Builtins can work out values for the rest of a rule's body.
+        """
+        for kwargs in self.engines:
+            brain = self.ages(**kwargs)
+            brain.add('(birthday, P, B) if (age, P, A) and (plus, A, 1, B) '
+                      'and (gt, B, 90)')
+            self.assertEqual(self.answers(brain, '(birthday, P, B)'),
+                [[('B', 91), ('P', 'p18')], [('B', 91), ('P', ('son', 'sam'))],
+                 [('B', 96), ('P', 'p19')]], kwargs)
+
+    def test_instantiation(self):
+        """
+        Builtins that need to know more of their arguments than they do
+        raise L{InstantiationError}.
+        """
+        brain = Brain()
+        brain.add('(bigger, A, B) if (gt, A, B)')
+        for query in ['(gt, X, 1)', '(plus, X, Y, 3)', '(between, 1, X, 3)',
+                      '(times, X, 0, 0)', '(bigger, 3, X)']:
+            self.assertRaises(InstantiationError, list, brain.query(query))
+
+    def test_other_arities(self):
+        """
+        Terms named after a builtin with a different number of arguments
+        are ordinary terms.
+        """
+        brain = Brain()
+        brain.add('(lt, lemon)')
+        brain.add('(plus, one)')
+        self.assertEqual(self.answers(brain, '(lt, X)'), [[('X', 'lemon')]])
+        self.assertEqual(self.answers(brain, '(plus, X)'), [[('X', 'one')]])
+
+    def test_range_scan(self):
+        """
+        A goal followed by a comparison on one of its variables only
+        tries the rules with numbers in range there, and rules that
+        could put anything there.
+        """
+        tried = {}
+        for ranges in [True, False]:
+            tracer = RecordingTracer()
+            brain = self.ages(tracer=tracer)
+            brain.add('(age, baby, X) if (between, 0, 2, X)')
+            brain.add('(same, X, X)')
+            if ranges:
+                brain.add('(old, P) if (age, P, A) and (gt, A, 80)')
+            else:
+                brain.add('(old, P) if (age, P, A) and (same, A, B) '
+                          'and (gt, B, 80)')
+            self.assertEqual(self.answers(brain, '(old, P)'),
+                [[('P', 'p17')], [('P', 'p18')], [('P', 'p19')],
+                 [('P', ('son', 'sam'))]])
+            tried[ranges] = len([x for x in tracer.events
+                                 if x[0] == 'rule' and
+                                 x[2].head.args[0] == Atom('age')])
+        self.assertEqual(tried[True], 6, 'p16 to p19, (son, sam) and baby')
+        self.assertEqual(tried[False], 24)
+
+    def test_range_ids(self):
+        """
+        L{RuleIndex.rangeIds} finds, in order, the rules with numbers
+        in range at a position, including rules added after the first
+        scan.
+        """
+        brain = self.ages()
+        index = brain._index
+        self.assertEqual(index.rangeIds(3, 2, 81, None), [17, 18, 19, 22])
+        self.assertEqual(index.rangeIds(3, 2, 2, 5), [1, 20])
+        self.assertEqual(index.rangeIds(3, 2, 2, 5, limit=2), None)
+        brain.add('(age, ann, 3)')
+        brain.addFacts([('age', 'tim', 4)])
+        self.assertEqual(index.rangeIds(3, 2, 2, 5), [1, 20, 23, 24])
+
+
+class RetractTest(TestCase):
+
+    engines = [{}, {'engine': 'trail'}, {'tabling': True},
+               {'planning': True}, {'materialize': True}]
+
+    rules = [
+        '(parent, a, b)',
+        '(parent, b, c)',
+        '(parent, c, d)',
+        '(person, a)',
+        '(person, b)',
+        '(person, c)',
+        '(person, d)',
+        '(ancestor, X, Y) if (parent, X, Y)',
+        '(ancestor, X, Z) if (parent, X, Y) and (ancestor, Y, Z)',
+        '(orphan, X) if (person, X) and (not, (parent, Y, X))',
+    ]
+
+    def setUp(self):
+        Var.count = 0
+
+    def answers(self, brain, query):
+        return sorted(x['X'] for x in brain.query(query))
+
+    def test_facts(self):
+        """
+        Retracted facts are forgotten, along with everything that
+        followed from them.
+        """
+        for kwargs in self.engines:
+            brain = Brain(**kwargs)
+            map(brain.add, self.rules)
+            self.assertEqual(self.answers(brain, '(ancestor, a, X)'),
+                ['b', 'c', 'd'])
+            self.assertEqual(self.answers(brain, '(orphan, X)'), ['a'])
+            self.assertEqual(brain.retract('(parent, b, c)'), 1, kwargs)
+            self.assertEqual(self.answers(brain, '(ancestor, a, X)'), ['b'],
+                             kwargs)
+            self.assertEqual(self.answers(brain, '(orphan, X)'), ['a', 'c'],
+                             kwargs)
+            self.assertEqual(brain.retract('(parent, b, c)'), 0)
+
+    def test_rules(self):
+        """
+        Rules can be retracted, whatever their variables are called.
+        """
+        for kwargs in self.engines:
+            brain = Brain(**kwargs)
+            map(brain.add, self.rules)
+            self.assertEqual(brain.retract(
+                '(ancestor, A, C) if (parent, A, B) and (ancestor, B, C)'), 1)
+            self.assertEqual(self.answers(brain, '(ancestor, a, X)'), ['b'],
+                             kwargs)
+            self.assertEqual(brain.retract('(orphan, X) if (person, X)'), 0)
+
+    def test_copies(self):
+        """
+        Every copy of a fact is retracted, and it can be added again.
+        """
+        brain = Brain()
+        brain.add('(likes, sam, cake)')
+        brain.addFacts([('likes', 'sam', 'cake'), ('likes', 'ann', 'cake')])
+        self.assertEqual(brain.retract('(likes, sam, cake)'), 2)
+        self.assertEqual(self.answers(brain, '(likes, X, cake)'), ['ann'])
+        self.assertEqual(self.answers(brain, 'X'), [('likes', 'ann', 'cake')])
+        brain.add('(likes, sam, cake)')
+        self.assertEqual(self.answers(brain, '(likes, X, cake)'),
+                         ['ann', 'sam'])
+
+    def test_base(self):
+        """
+        What a brain's base knows can't be retracted from the brain.
+        """
+        world = Brain()
+        world.add('(likes, sam, cake)')
+        brain = Brain(base=world)
+        self.assertEqual(brain.retract('(likes, sam, cake)'), 0)
+        self.assertRaises(FrozenBrain, world.retract, '(likes, sam, cake)')
+
+
+class SubscriptionTest(TestCase):
+
+    engines = RetractTest.engines + [{'columnar': True}]
+
+    rules = [
+        '(parent, a, b)',
+        '(parent, b, c)',
+        '(parent, c, d)',
+        '(grandparent, X, Z) if (parent, X, Y) and (parent, Y, Z)',
+        '(cousin, X, Y) if (grandparent, G, X) and (grandparent, G, Y)',
+    ]
+
+    def setUp(self):
+        Var.count = 0
+        self.changes = []
+
+    def changed(self, added, removed):
+        self.changes.append((sorted(x['X'] for x in added),
+                             sorted(x['X'] for x in removed)))
+
+    def test_changes(self):
+        """
+        A subscription is told the answers there are and then the
+        answers that appear and disappear.
+        """
+        for kwargs in RetractTest.engines:
+            del self.changes[:]
+            brain = Brain(**kwargs)
+            map(brain.add, RetractTest.rules)
+            brain.subscribe('(ancestor, a, X)', self.changed)
+            brain.add('(parent, d, e)')
+            brain.flushSubscriptions()
+            brain.retract('(parent, b, c)')
+            brain.flushSubscriptions()
+            self.assertEqual(self.changes, [
+                (['b', 'c', 'd'], []),
+                (['e'], []),
+                ([], ['c', 'd', 'e']),
+            ], kwargs)
+
+    def test_negation(self):
+        """
+        Answers that depend on a C{not} change when what it negates
+        does.
+        """
+        brain = Brain()
+        map(brain.add, RetractTest.rules)
+        subscription = brain.subscribe('(orphan, X)', self.changed)
+        brain.retract('(parent, a, b)')
+        brain.flushSubscriptions()
+        brain.addFacts([('parent', 'd', 'a')])
+        self.assertEqual(self.changes,
+            [(['a'], []), (['b'], []), ([], ['a'])])
+        self.assertEqual(subscription.answers, [{'X': 'b'}])
+
+    def test_unrelated(self):
+        """
+        The query isn't asked again when something it doesn't depend on
+        changes, or when the answers are the same.
+        """
+        brain = Brain()
+        map(brain.add, RetractTest.rules)
+        tracer = RecordingTracer()
+        brain.subscribe('(ancestor, c, X)', self.changed)
+        brain.tracer = tracer
+        brain.add('(likes, a, b)')
+        brain.retract('(likes, a, b)')
+        brain.flushSubscriptions()
+        self.assertEqual(tracer.events, [])
+        brain.add('(parent, a, e)')
+        brain.flushSubscriptions()
+        self.assertNotEqual(tracer.events, [])
+        self.assertEqual(self.changes, [(['d'], [])])
+
+    def test_cancel(self):
+        """
+        Cancelled subscriptions aren't told about changes.
+        """
+        brain = Brain()
+        subscription = brain.subscribe('(parent, a, X)', self.changed)
+        brain.add('(parent, a, b)')
+        brain.flushSubscriptions()
+        subscription.cancel()
+        brain.add('(parent, a, c)')
+        brain.flushSubscriptions()
+        self.assertEqual(self.changes, [(['b'], [])])
+
+    def test_batched(self):
+        """
+        Changes made with L{Brain.add} and L{Brain.retract} are told
+        all at once when the brain is flushed, and those made with
+        L{Brain.addFacts} when it finishes.
+        """
+        brain = Brain()
+        map(brain.add, self.rules)
+        subscription = brain.subscribe('(grandparent, a, X)', self.changed)
+        brain.add('(parent, b, e)')
+        brain.add('(parent, b, f)')
+        brain.retract('(parent, b, c)')
+        self.assertEqual(self.changes, [(['c'], [])])
+        self.assertEqual(subscription.answers, [{'X': 'c'}])
+        brain.flushSubscriptions()
+        brain.addFacts([('parent', 'b', 'g'), ('parent', 'b', 'h')])
+        self.assertEqual(self.changes, [
+            (['c'], []),
+            (['e', 'f'], ['c']),
+            (['g', 'h'], []),
+        ])
+
+    def test_incremental(self):
+        """
+        When only facts change and the query depends on them through
+        rules without C{not} that don't depend on themselves, the
+        answers that change are found from the changed facts, without
+        asking the whole query again.
+        """
+        for kwargs in self.engines:
+            del self.changes[:]
+            brain = Brain(**kwargs)
+            map(brain.add, self.rules)
+            subscription = brain.subscribe('(cousin, X, Y)',
+                                           lambda added, removed:
+                                           self.changes.append((
+                                               sorted(sorted(x.items())
+                                                      for x in added),
+                                               sorted(sorted(x.items())
+                                                      for x in removed))))
+            self.assertTrue(subscription._incremental, kwargs)
+            tracer = RecordingTracer()
+            brain.tracer = tracer
+            brain.addFacts([('parent', 'b', 'e')])
+            brain.retract('(parent, b, c)')
+            brain.flushSubscriptions()
+            brain.tracer = None
+            # only the answers that might be gone are asked about
+            self.assertEqual(
+                [x for x in tracer.events if x[0] == 'goal'
+                 and x[1].args[0] == Atom('cousin') and not x[1].ground],
+                [], kwargs)
+            self.assertEqual(self.changes, [
+                ([[('X', 'c'), ('Y', 'c')], [('X', 'd'), ('Y', 'd')]], []),
+                ([[('X', 'c'), ('Y', 'e')], [('X', 'e'), ('Y', 'c')],
+                  [('X', 'e'), ('Y', 'e')]], []),
+                ([], [[('X', 'c'), ('Y', 'c')], [('X', 'c'), ('Y', 'e')],
+                      [('X', 'd'), ('Y', 'd')], [('X', 'e'), ('Y', 'c')]]),
+            ], kwargs)
+            self.assertEqual(subscription.answers, [{'X': 'e', 'Y': 'e'}])
+
+    def test_not_incremental(self):
+        """
+        Queries that depend on a C{not} or on recursive rules, or
+        changes to rules, are asked again in full.
+        """
+        brain = Brain()
+        map(brain.add, RetractTest.rules + self.rules)
+        self.assertFalse(brain.subscribe('(orphan, X)',
+                                         self.changed)._incremental)
+        self.assertFalse(brain.subscribe('(ancestor, a, X)',
+                                         self.changed)._incremental)
+        subscription = brain.subscribe('(grandparent, a, X)', self.changed)
+        self.assertTrue(subscription._incremental)
+        del self.changes[:]
+        brain.add('(grandparent, X, Y) if (step, X, Y) and '
+                  '(not, (parent, Y, X))')
+        brain.flushSubscriptions()
+        self.assertFalse(subscription._incremental)
+        brain.addFacts([('step', 'a', 'z')])
+        self.assertEqual(self.changes[-1], (['z'], []))
+
+    def test_same_batch(self):
+        """
+        A fact added and retracted between flushes changes nothing, as
+        does one retracted and added again.
+        """
+        for kwargs in self.engines:
+            del self.changes[:]
+            brain = Brain(**kwargs)
+            map(brain.add, self.rules)
+            subscription = brain.subscribe('(grandparent, a, X)',
+                                           self.changed)
+            brain.add('(parent, b, e)')
+            brain.retract('(parent, b, e)')
+            brain.retract('(parent, b, c)')
+            brain.add('(parent, b, c)')
+            brain.flushSubscriptions()
+            self.assertEqual(self.changes, [(['c'], [])], kwargs)
+            self.assertEqual(subscription.answers, [{'X': 'c'}], kwargs)
+
+    def test_same_as_query(self):
+        """
+        Whatever facts are added and retracted, a subscription's answers
+        are those the query gives.
+        """
+        facts = [('parent', x, y) for x in 'abcd' for y in 'abcd']
+        for kwargs in self.engines:
+            rng = random.Random(4)
+            brain = Brain(**kwargs)
+            map(brain.add, self.rules[3:])
+            queries = ['(grandparent, X, Y)', '(cousin, a, X)',
+                       '(parent, X, b)']
+            subscriptions = [brain.subscribe(x, lambda *args: None)
+                             for x in queries]
+            for i in xrange(20):
+                for j in xrange(rng.randrange(1, 4)):
+                    fact = rng.choice(facts)
+                    if rng.random() < 0.5:
+                        brain.addFacts([fact])
+                    else:
+                        brain.retract('({0}, {1}, {2})'.format(*fact))
+                brain.flushSubscriptions()
+                for query, subscription in zip(queries, subscriptions):
+                    self.assertEqual(
+                        sorted(sorted(x.items())
+                               for x in subscription.answers),
+                        sorted(sorted(x.items())
+                               for x in brain.query(query)),
+                        (kwargs, query, i))
+
+
+class ProfilerTest(TestCase):
+
+    rules = [
+        '(parent, a, b)',
+        '(parent, b, c)',
+        '(parent, c, d)',
+        '(ancestor, X, Y) if (parent, X, Y)',
+        '(ancestor, X, Z) if (parent, X, Y) and (ancestor, Y, Z)',
+    ]
+
+    def setUp(self):
+        Var.count = 0
+
+    def profiled(self, **kwargs):
+        profiler = Profiler()
+        brain = Brain(profiler=profiler, **kwargs)
+        map(brain.add, self.rules)
+        self.assertEqual(len(list(brain.query('(ancestor, a, X)'))), 3)
+        return dict((x.name, x) for x in profiler.report())
+
+    def test_counts(self):
+        """
+        Each rule's tries, unifications and answers are counted, and
+        facts are counted together for each predicate.
+        """
+        stats = self.profiled()
+        self.assertEqual(sorted(stats), [
+            '(<ancestor>, X, Y) if (<parent>, X, Y)',
+            '(<ancestor>, X, Z) if (<parent>, X, Y) and (<ancestor>, Y, Z)',
+            'facts (parent, _, _)',
+        ])
+        base = stats['(<ancestor>, X, Y) if (<parent>, X, Y)']
+        self.assertEqual((base.tried, base.unified, base.failed,
+                          base.answers), (6, 4, 2, 3))
+        self.assertTrue(base.seconds > 0)
+        facts = stats['facts (parent, _, _)']
+        self.assertEqual((facts.tried, facts.unified, facts.failed,
+                          facts.answers), (18, 6, 12, 6))
+
+    def test_trail(self):
+        """
+        The trail engine counts tries and unifications.
+        """
+        stats = self.profiled(engine='trail')
+        facts = stats['facts (parent, _, _)']
+        self.assertEqual((facts.tried, facts.unified, facts.failed),
+                         (18, 6, 12))
+
+    def test_conflicts(self):
+        """
+        Conflicts are counted against the rule whose body was being
+        proved.
+        """
+        profiler = Profiler()
+        outer = profiler.rule(Rule(parse('(a, X)'), TRUE))
+        inner = RuleStats('inner')
+
+        def innerAnswers():
+            profiler.conflict()
+            yield {}
+
+        def answers():
+            yield {}
+            profiler.conflict()
+            for x in profiler.watch(inner, innerAnswers()):
+                yield x
+        self.assertEqual(len(list(profiler.watch(outer, answers()))), 2)
+        self.assertEqual((outer.conflicts, outer.answers), (1, 2))
+        self.assertEqual((inner.conflicts, inner.answers), (1, 1))
+
+    def test_report(self):
+        """
+        The report can be sorted, printed as a table and queried.
+        """
+        profiler = Profiler()
+        brain = Brain(profiler=profiler)
+        map(brain.add, self.rules)
+        list(brain.query('(ancestor, a, X)'))
+        tried = [x.tried for x in profiler.report('tried')]
+        self.assertEqual(tried, sorted(tried, reverse=True))
+        lines = profiler.table(sort='tried', limit=2).splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(lines[0].split(),
+            ['tried', 'unified', 'failed', 'conflicts', 'answers', 'ms',
+             'rule'])
+        self.assertTrue(lines[1].endswith('facts (parent, _, _)'))
+        report = profiler.brain()
+        self.assertEqual(list(report.query(
+            '(profile, N, 18, U, F, C, A, M)')),
+            [{'N': 'facts (parent, _, _)', 'U': 6, 'F': 12, 'C': 0, 'A': 6,
+              'M': 0}])
+        profiler.reset()
+        self.assertEqual(profiler.report(), [])
+
+
+class GrammarCacheTest(TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir)
+
+    def parse(self, parser):
+        return parser('(likes, X, 1.5)').rule().head.humanValue()
+
+    def test_cache(self):
+        """
+        The code generated for a grammar is kept in the cache directory
+        and used again.
+        """
+        parser = compileGrammar(grammar, grammar_bindings, self.cache_dir)
+        self.assertEqual(self.parse(parser), ('likes', 'X', Decimal('1.5')))
+        files = os.listdir(self.cache_dir)
+        self.assertEqual(len(files), 1)
+        path = os.path.join(self.cache_dir, files[0])
+        with open(path, 'rb') as f:
+            code = f.read()
+        parser = compileGrammar(grammar, grammar_bindings, self.cache_dir)
+        self.assertEqual(self.parse(parser), ('likes', 'X', Decimal('1.5')))
+        self.assertEqual(os.listdir(self.cache_dir), files)
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), code)
+
+    def test_bad_cache(self):
+        """
+        A cache file that can't be read is made again, and a cache
+        directory that can't be written to is done without.
+        """
+        compileGrammar(grammar, grammar_bindings, self.cache_dir)
+        path = os.path.join(self.cache_dir, os.listdir(self.cache_dir)[0])
+        with open(path, 'wb') as f:
+            f.write('junk')
+        parser = compileGrammar(grammar, grammar_bindings, self.cache_dir)
+        self.assertEqual(self.parse(parser), ('likes', 'X', Decimal('1.5')))
+        parser = compileGrammar(grammar, grammar_bindings, path)
+        self.assertEqual(self.parse(parser), ('likes', 'X', Decimal('1.5')))
+
+    def test_lazy(self):
+        """
+        Importing prolly doesn't compile the grammar or import Parsley.
+        """
+        env = dict(os.environ, PROLLY_CACHE=self.cache_dir)
+        output = subprocess.check_output([sys.executable, '-c',
+            'import sys, prolly; print "parsley" in sys.modules'],
+            env=env, cwd=os.path.dirname(os.path.abspath(__file__)))
+        self.assertEqual(output.strip(), 'False')
+        self.assertEqual(os.listdir(self.cache_dir), [])
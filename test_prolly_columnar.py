@@ -0,0 +1,247 @@
+from unittest import TestCase
+
+from prolly import Brain, Var, Atom, Term, PARSER
+from prolly_columnar import ColumnarStore, SymbolTable, sortMergeJoin
+import test_prolly
+
+
+def parse(query):
+    return PARSER(query).rule().normalizeVars().head
+
+
+def parseGoals(*goals):
+    """
+    Parse goals that share variables.
+    """
+    rule = PARSER('(x) if ' + ' and '.join(goals)).rule().normalizeVars()
+    return rule.body.parts
+
+
+def fact(*values):
+    return PARSER('({0})'.format(', '.join(values))).rule()
+
+
+class SymbolTableTest(TestCase):
+
+    def test_encode(self):
+        """
+        Each atom or ground term gets its own number, and the numbers
+        can be turned back into what they stand for.
+        """
+        symbols = SymbolTable()
+        a = symbols.encode(Atom('a'))
+        b = symbols.encode(Term(Atom('b'), Atom(1)))
+        self.assertEqual((a, b), (0, 1))
+        self.assertEqual(symbols.encode(Atom('a')), a)
+        self.assertEqual(symbols.lookup(Atom('c')), None)
+        self.assertEqual(list(symbols.decode([b, a, b])),
+            [Term(Atom('b'), Atom(1)), Atom('a'), Term(Atom('b'), Atom(1))])
+
+
+class ColumnarStoreTest(TestCase):
+
+    def setUp(self):
+        Var.count = 0
+        self.store = ColumnarStore()
+        for values in [
+                ('owns', 'bob', 'car'),
+                ('owns', 'ann', 'bike'),
+                ('owns', 'ann', 'car'),
+                ('permits', 'bob', 'take', 'jim', 'car'),
+                ('permits', 'ann', 'take', 'jim', 'bike'),
+                ('permits', 'ann', 'take', 'ann', 'bike'),
+                ('agent', 'bob'),
+                ('agent', 'ann'),
+                ('agent', 'jim')]:
+            self.store.add(fact(*values).head)
+
+    def answers(self, batch):
+        return sorted(sorted((k.name, v.humanValue()) for k, v in x.items())
+                      for x in batch.dicts())
+
+    def test_select(self):
+        """
+        Goals are matched against the columns for their predicate.
+        """
+        self.assertEqual(self.answers(self.store.select(parse('(owns, X, car)'))),
+            [[('X', 'ann')], [('X', 'bob')]])
+        self.assertEqual(len(self.store.select(parse('(owns, X, Y)'))), 3)
+        self.assertEqual(len(self.store.select(parse('(owns, X, boat)'))), 0)
+        self.assertEqual(len(self.store.select(parse('(sells, X, Y)'))), 0)
+
+    def test_repeated_variables(self):
+        """
+        A variable used twice in a goal must have the same value at
+        both places.
+        """
+        batch = self.store.select(parse('(permits, X, take, X, Y)'))
+        self.assertEqual(self.answers(batch), [[('X', 'ann'), ('Y', 'bike')]])
+
+    def test_join(self):
+        """
+        Conjunctions are answered by joining the goals' answers on the
+        variables they share.
+        """
+        goals = parseGoals('(agent, A)', '(owns, O, T)',
+                           '(permits, O, take, A, T)')
+        batch = self.store.join(goals)
+        self.assertEqual(self.answers(batch), [
+            [('A', 'ann'), ('O', 'ann'), ('T', 'bike')],
+            [('A', 'jim'), ('O', 'ann'), ('T', 'bike')],
+            [('A', 'jim'), ('O', 'bob'), ('T', 'car')],
+        ])
+
+    def test_cross_product(self):
+        """
+        Goals that share no variables give every combination.
+        """
+        batch = self.store.join(parseGoals('(agent, A)', '(owns, ann, T)'))
+        self.assertEqual(len(batch), 6)
+
+    def test_sortMergeJoin(self):
+        """
+        Every pair of positions with equal values is found.
+        """
+        import numpy as np
+        left, right = sortMergeJoin(np.array([3, 1, 3, 2]), np.array([3, 3, 1]))
+        self.assertEqual(sorted(zip(left, right)),
+            [(0, 0), (0, 1), (1, 2), (2, 0), (2, 1)])
+
+
+class ColumnarBrainTest(TestCase):
+
+    rules = test_prolly.PlanningTest.rules + [
+        '(tempted, A, T) if (agent, A) and (owns, O, T) and '
+        '(permits, O, take, A, T) and (not, (owns, A, T))',
+        '(agent, jim)',
+        '(agent, mary)',
+        '(owns, mary, (red, bike))',
+        '(owns, rita, car)',
+        '(permits, rita, take, jim, car)',
+        '(permits, mary, take, jim, (red, bike))',
+        '(permits, mary, take, mary, (red, bike))',
+    ]
+
+    queries = test_prolly.PlanningTest.queries + [
+        '(tempted, A, T)',
+        '(tempted, jim, (red, X))',
+        '(owns, X, Y)',
+        'X',
+    ]
+
+    def setUp(self):
+        Var.count = 0
+
+    def answers(self, brain, query):
+        return sorted(sorted(x.items()) for x in brain.query(query))
+
+    def test_same_answers(self):
+        """
+        Brains with a columnar store give the same answers as ones
+        without.
+        """
+        for kwargs in [{}, {'engine': 'trail'}, {'planning': True}]:
+            plain = Brain(**kwargs)
+            columnar = Brain(columnar=True, **kwargs)
+            for rule in self.rules:
+                plain.add(rule)
+                columnar.add(rule)
+            for query in self.queries:
+                self.assertEqual(self.answers(columnar, query),
+                                 self.answers(plain, query), (kwargs, query))
+
+    def test_facts_stored(self):
+        """
+        Ground facts go in the columnar store, not the list of rules.
+        """
+        brain = Brain(columnar=True)
+        brain.add('(owns, rita, car)')
+        brain.addFacts([('owns', 'mary', ('red', 'bike'))])
+        brain.add('(wants, X, car) if (owns, X, bike)')
+        brain.add('(likes, X, X)')
+        self.assertEqual(len(brain._rules), 2)
+        self.assertEqual(len(brain._columns), 2)
+
+    def test_fact_goals(self):
+        """
+        Only the goals at the start of a body that just facts can
+        answer are joined in the columnar store.
+        """
+        brain = Brain(columnar=True)
+        map(brain.add, self.rules)
+        goals = parseGoals('(owns, O, T)', '(permits, O, take, A, T)',
+                           '(parent, O, A)', '(owns, A, T)')
+        self.assertEqual(brain._factGoals(goals), 2)
+        self.assertEqual(brain._factGoals(goals[2:]), 0)
+        self.assertEqual(brain._factGoals([parse('(owns, X, (red, Y))')]), 0)
+        self.assertEqual(brain._factGoals([parse('(agent, X)')]), 0,
+            '(X, good) might match it')
+
+    def test_tabling(self):
+        """
+        Tables that used facts from the columnar store are forgotten
+        when facts are added.
+        """
+        brain = Brain(columnar=True, tabling=True)
+        brain.add('(path, X, Y) if (edge, X, Y)')
+        brain.add('(path, X, Y) if (path, X, Z) and (edge, Z, Y)')
+        brain.add('(hop2, X, Y) if (edge, X, Z) and (edge, Z, Y)')
+        brain.addFacts([('edge', 'a', 'b'), ('edge', 'b', 'c')])
+        self.assertEqual(self.answers(brain, '(path, a, X)'),
+            [[('X', 'b')], [('X', 'c')]])
+        self.assertEqual(self.answers(brain, '(hop2, a, X)'), [[('X', 'c')]])
+        brain.add('(edge, c, d)')
+        self.assertEqual(self.answers(brain, '(path, a, X)'),
+            [[('X', 'b')], [('X', 'c')], [('X', 'd')]])
+        self.assertEqual(self.answers(brain, '(hop2, b, X)'), [[('X', 'd')]])
+
+    def test_joined_rule(self):
+        """
+        A rule whose body starts with goals only facts can answer is
+        answered with a join.
+        """
+        rules = [x for x in self.rules if 'good' not in x]
+        columnar = Brain(columnar=True)
+        plain = Brain()
+        for rule in rules:
+            columnar.add(rule)
+            plain.add(rule)
+        tempted = [x for x in columnar._rules if x.head.args[0] == Atom('tempted')]
+        self.assertEqual(columnar._factGoals(tempted[0].body.parts), 3)
+        self.assertEqual(self.answers(columnar, '(tempted, A, T)'),
+                         self.answers(plain, '(tempted, A, T)'))
+        self.assertEqual(self.answers(columnar, '(tempted, A, T)'),
+            [[('A', 'jim'), ('T', 'car')], [('A', 'jim'), ('T', ('red', 'bike'))]])
+
+    def test_base(self):
+        """
+        Brains can be built on a brain with a columnar store, with or
+        without one of their own.
+        """
+        world = Brain(columnar=True)
+        world.add('(tempted, A, T) if (agent, A) and (owns, O, T) and '
+                  '(permits, O, take, A, T)')
+        world.addFacts([('agent', 'jim'), ('owns', 'rita', 'car'),
+                        ('permits', 'rita', 'take', 'jim', 'car')])
+        for columnar in [False, True]:
+            jim = Brain(base=world, columnar=columnar)
+            jim.addFacts([('owns', 'mary', 'bike'),
+                          ('permits', 'mary', 'take', 'jim', 'bike')])
+            self.assertEqual(self.answers(jim, '(tempted, jim, T)'),
+                [[('T', 'bike')], [('T', 'car')]])
+            self.assertEqual(self.answers(world, '(tempted, jim, T)'),
+                [[('T', 'car')]])
+
+    def test_retract(self):
+        """
+        Facts can be retracted from the columnar store.
+        """
+        brain = Brain(columnar=True)
+        brain.addFacts([('owns', 'rita', 'car'), ('owns', 'mary', 'bike'),
+                        ('owns', 'rita', 'car'), ('rain',)])
+        self.assertEqual(brain.retract('(owns, rita, car)'), 2)
+        self.assertEqual(brain.retract('(owns, rita, boat)'), 0)
+        self.assertEqual(brain.retract('(rain)'), 1)
+        self.assertEqual(self.answers(brain, 'X'),
+            [[('X', ('owns', 'mary', 'bike'))]])
+        self.assertEqual(len(brain._columns), 1)
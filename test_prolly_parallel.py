@@ -0,0 +1,88 @@
+from unittest import TestCase
+
+from prolly import Brain, Var
+from prolly_parallel import QueryPool, branchAnswers
+import test_prolly
+
+
+class BranchAnswersTest(TestCase):
+
+    rules = test_prolly.PlanningTest.rules
+
+    queries = test_prolly.PlanningTest.queries + [
+        '(not, (parent, mary, alicia))',
+    ]
+
+    def setUp(self):
+        Var.count = 0
+
+    def answers(self, brain, query):
+        return sorted(sorted(x.items()) for x in brain.query(query))
+
+    def test_parts(self):
+        """
+        The answers down all the parts of a search are the answers to
+        the query.
+        """
+        for kwargs in [{}, {'tabling': True}, {'planning': True}]:
+            brain = Brain(**kwargs)
+            map(brain.add, self.rules)
+            for query in self.queries:
+                parsed = brain._parseQuery(query)
+                for parts in [1, 3]:
+                    found = set()
+                    for part in range(parts):
+                        for match in branchAnswers(brain, parsed, part, parts):
+                            found.add(tuple(sorted(
+                                (k.humanValue(), v.humanValue())
+                                for k, v in match.items())))
+                    self.assertEqual(sorted(list(x) for x in found),
+                                     self.answers(brain, query),
+                                     (kwargs, query, parts))
+
+
+class QueryPoolTest(TestCase):
+
+    def test_query(self):
+        """
+        A pool of workers gives the same answers as the brain.
+        """
+        brain = Brain(base=Brain())
+        map(brain.add, BranchAnswersTest.rules)
+        pool = QueryPool(brain, processes=2)
+        self.addCleanup(pool.close)
+        for query in BranchAnswersTest.queries:
+            self.assertEqual(
+                sorted(sorted(x.items()) for x in pool.query(query)),
+                sorted(sorted(x.items()) for x in brain.query(query)), query)
+
+    def test_snapshot(self):
+        """
+        The pool answers from the rules the brain had when it was made.
+        """
+        brain = Brain(columnar=True)
+        brain.add('(a, b)')
+        pool = QueryPool(brain, processes=1)
+        self.addCleanup(pool.close)
+        brain.add('(a, c)')
+        self.assertEqual(list(pool.query('(a, X)')), [{'X': 'b'}])
+
+    def test_negation(self):
+        """
+        Negated goals are proven against the workers' facts, not facts
+        added to or removed from the brain after the pool was made.
+        """
+        brain = Brain()
+        for rule in ['(thing, a)', '(thing, b)', '(thing, c)', '(broken, a)',
+                     '(safe, X) if (thing, X) and (not, (broken, X))']:
+            brain.add(rule)
+        pool = QueryPool(brain, processes=2)
+        self.addCleanup(pool.close)
+        brain.retract('(broken, a)')
+        brain.add('(broken, b)')
+        self.assertEqual(sorted(x['X'] for x in brain.query('(safe, X)')),
+                         ['a', 'c'])
+        self.assertEqual(sorted(x['X'] for x in pool.query('(safe, X)')),
+                         ['b', 'c'])
+        self.assertEqual(list(pool.query('(not, (broken, b))')), [{}])
+        self.assertEqual(list(pool.query('(not, (broken, a))')), [])
@@ -0,0 +1,130 @@
+import os
+import tempfile
+from unittest import TestCase
+
+from prolly import Brain, Var
+from prolly_snapshot import Snapshot, SnapshotRules
+import test_prolly
+
+
+class SnapshotTest(TestCase):
+
+    rules = test_prolly.PlanningTest.rules + [
+        '(lonely, X) if (person, X) and (not, (parent, X, Y))',
+        '(person, mary)',
+        '(number, 12)',
+        '(number, -1.5)',
+        '(likes, X, X)',
+    ]
+
+    queries = test_prolly.PlanningTest.queries + [
+        '(lonely, X)',
+        '(number, X)',
+        '(likes, mary, X)',
+    ]
+
+    def setUp(self):
+        Var.count = 0
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+        self.addCleanup(os.remove, self.path)
+
+    def answers(self, brain, query):
+        return sorted(sorted(x.items()) for x in brain.query(query))
+
+    def assertSame(self, opened, brain, queries=None):
+        for query in queries or self.queries:
+            self.assertEqual(self.answers(opened, query),
+                             self.answers(brain, query), query)
+
+    def test_same_answers(self):
+        """
+        A brain opened from a snapshot gives the same answers as the
+        brain that saved it, whatever kind of brain it is.
+        """
+        brain = Brain()
+        map(brain.add, self.rules)
+        brain.save(self.path)
+        for kwargs in [{}, {'engine': 'trail'}, {'tabling': True},
+                       {'planning': True}, {'columnar': True}]:
+            self.assertSame(Brain.open(self.path, **kwargs), brain)
+
+    def test_lazy(self):
+        """
+        Rules are only decoded when they might answer a query.
+        """
+        brain = Brain()
+        map(brain.add, self.rules)
+        brain.save(self.path)
+        opened = Brain.open(self.path)
+        self.assertIsInstance(opened._rules, SnapshotRules)
+        self.assertEqual(opened._rules._decoded.count(None), len(self.rules))
+        self.assertEqual(self.answers(opened, '(number, X)'),
+            [[('X', -1.5)], [('X', 12)]])
+        decoded = len(self.rules) - opened._rules._decoded.count(None)
+        self.assertTrue(2 <= decoded <= 5, decoded)
+
+    def test_add(self):
+        """
+        Rules can be added to a brain opened from a snapshot.
+        """
+        brain = Brain()
+        map(brain.add, self.rules)
+        brain.save(self.path)
+        opened = Brain.open(self.path)
+        for rule in ['(parent, mary, zed)', '(person, zed)']:
+            brain.add(rule)
+            opened.add(rule)
+        opened.addFacts([('number', 7)])
+        brain.addFacts([('number', 7)])
+        self.assertSame(opened, brain)
+
+    def test_layers(self):
+        """
+        A snapshot of a brain built on others, with a columnar store,
+        has their rules too.
+        """
+        world = Brain(columnar=True)
+        map(world.add, self.rules)
+        brain = Brain(base=world)
+        brain.add('(parent, mary, zed)')
+        brain.save(self.path)
+        self.assertSame(Brain.open(self.path), brain)
+
+    def test_not_a_snapshot(self):
+        """
+        Opening something that isn't a snapshot fails.
+        """
+        with open(self.path, 'wb') as f:
+            f.write('(parent, mary, joe)\n' * 10)
+        self.assertRaises(ValueError, Snapshot, self.path)
+
+    def test_ranges(self):
+        """
+        The numbers at an argument position of a snapshot's rules can be
+        scanned by range, including those of rules added after it was
+        opened.
+        """
+        brain = Brain()
+        map(brain.add, self.rules)
+        brain.add('(big, X) if (number, X) and (gt, X, 5)')
+        brain.save(self.path)
+        opened = Brain.open(self.path)
+        opened.add('(number, 7)')
+        brain.add('(number, 7)')
+        self.assertSame(opened, brain, ['(big, X)'])
+        self.assertEqual(opened._index.rangeIds(2, 1, 5, None),
+            [self.rules.index('(number, 12)'), len(self.rules) + 1])
+
+    def test_retract(self):
+        """
+        Rules can be retracted from a brain opened from a snapshot.
+        """
+        brain = Brain()
+        map(brain.add, self.rules)
+        brain.save(self.path)
+        opened = Brain.open(self.path)
+        for rule in ['(parent, P, C) if (mother, P, C)', '(number, 12)']:
+            self.assertEqual(brain.retract(rule), 1)
+            self.assertEqual(opened.retract(rule), 1)
+        self.assertSame(opened, brain, self.queries + ['X'])
@@ -292,8 +292,7 @@ if __name__ == '__main__':
     blackboard2 = bt.Blackboard()
     last_time = time.time()
     while True:
-        tree.tick(agent1, blackboard1)
-        tree.tick(agent2, blackboard2)
+        tree.tickMany([agent1, agent2], [blackboard1, blackboard2])
         now = time.time()
         ctx = EngineContext(now - last_time)
         agent1.tick(ctx)